@@ -26,10 +26,18 @@ GDBDRIVER      = HOME / 'powertools/lapi-plus/GDBDriver.py'
 GDBONLYDRIVER  = HOME / 'powertools/lapi-plus/GDBOnly.py'
 SIMPT_PATH     = HOME / 'Simpoint3.2/bin/simpoint'
 PATHFINDER     = HOME / 'powertools/inscount/gdb_gen.py'
+CALIBRATOR     = HOME / 'powertools/inscount/gdb_calibrate.py'
+VERIFIER       = HOME / 'powertools/inscount/gdb_verify.py'
 RECORDER_PATH  = HOME / 'powertools/inscount/obj-intel64/recorder.so'
 CONVERTER_PATH = HOME / 'powertools/inscount/recorder.py'
 PATCHER_PATH   = Path(__file__).parent / 'patch.py'
 
+sys.path.append(str(Path(__file__).resolve().parent.parent / 'inscount'))
+from bbv_trace import CACHE_DIRNAME, load_brk
+sys.path.append(str(Path(__file__).resolve().parent.parent / 'lapi-plus'))
+from PageStore import MANIFEST_FILENAME, PMEM_FILENAME, find_manifests, load_manifest, materialize
+from DeltaCheckpoint import DELTA_FILENAME, flatten
+
 
 def gen_bbv(args):
   name = args.name
@@ -87,8 +95,8 @@ def gen_simpt(args):
   assert(out_simpts.exists())
   assert(out_weight.exists())
   assert(brkpt_file.exists())
-  with out_simpts.open() as simpt, brkpt_file.open() as brkpt, pin_break.open('w') as out:
-    brk_data = list(brkpt)
+  brk_pcs, brk_cnts = load_brk(brkpt_file, bench_dir / CACHE_DIRNAME)
+  with out_simpts.open() as simpt, pin_break.open('w') as out:
     simpts = []
     for line in simpt:
       slice_cnt, slice_id = list(map(int, line.split()))
@@ -97,8 +105,7 @@ def gen_simpt(args):
     for slice_cnt, slice_id in simpts:
       if slice_cnt > 0:
         # important! breakpoint data generated AFTER each slice execution
-        brk_info = brk_data[slice_cnt]
-        out.write('{} {}'.format(slice_id, brk_info))
+        out.write('{} {:x} {}\n'.format(slice_id, int(brk_pcs[slice_cnt]), int(brk_cnts[slice_cnt])))
       else:
         out.write('{} {}'.format(slice_id, '0 0\n'))
 
@@ -190,6 +197,8 @@ def gen_ckpt(args):
         'ckpt-prefix': os.path.join(args.CKPT_DIR, name),
         'run-dir': str(args.RUN_DIR / name)
       }
+      if args.PAGE_DIR:
+        config['page-store'] = str(args.PAGE_DIR)
       config_path = Path('config.json')
       with config_path.open('w') as f:
         json.dump(config, f)
@@ -239,6 +248,8 @@ def gen_ckpt_gdbonly(args):
         'ckpt-prefix': os.path.join(args.CKPT_DIR, name),
         'run-dir': str(args.RUN_DIR / name)
       }
+    if args.PAGE_DIR:
+      config['page-store'] = str(args.PAGE_DIR)
     config_path = Path('config.json')
     with config_path.open('w') as f:
       json.dump(config, f)
@@ -257,8 +268,9 @@ def gen_path(args):
   bench_dir = args.RUN_DIR / name
 
   os.chdir(bench_dir)
+  report_path = log_dir / '{}.json'.format(name)
   with open(log_dir / '{}.out'.format(name), 'wb') as out , open(log_dir / '{}.err'.format(name), 'wb') as err:
-    run_cmd = [str(PATHFINDER)]
+    run_cmd = [str(PATHFINDER), '--report', str(report_path)]
     logging.debug('Exec: {}'.format(' '.join(run_cmd)))
     p = subprocess.Popen(run_cmd, stdout=out, stderr=err)
     p.communicate()
@@ -266,10 +278,31 @@ def gen_path(args):
   assert Path(bench_dir / 'gdb.cmd').exists()
   logging.info('{} finished.'.format(name))
 
+  # replay the plan on the BBV before GDBOnly spends hours on it
+  with open(log_dir / '{}.verify'.format(name), 'wb') as out:
+    run_cmd = [str(VERIFIER)]
+    logging.debug('Exec: {}'.format(' '.join(run_cmd)))
+    verify_proc = subprocess.run(run_cmd, stdout=out, stderr=subprocess.STDOUT)
+  if (verify_proc.returncode):
+    logging.error('Invalid gdb.cmd, {}, see {}'.format(name, log_dir / '{}.verify'.format(name)))
+    raise RuntimeError('Invalid gdb.cmd')
+
   with open(log_dir / '{}.out'.format(name), 'r') as out:
     last_line = list(out)[-1]
   logging.info(f'{name}: {last_line}')
 
+  with report_path.open() as f:
+    report = json.load(f)
+  slowest = max(report['simpts'], key=lambda s: s['seconds'], default=None)
+  logging.info(f'{name}: predicted replay {datetime.timedelta(seconds=int(report["seconds"]))}' +
+               (f', slowest simpt #{slowest["simpt"]} {datetime.timedelta(seconds=int(slowest["seconds"]))}' if slowest else ''))
+
+
+def gdb_calibrate(args):
+  run_cmd = [str(CALIBRATOR)]
+  logging.debug('Exec: {}'.format(' '.join(run_cmd)))
+  subprocess.run(run_cmd, check=True)
+
 def gen_patches(args):
   for d in args.RUN_DIR.iterdir():
     if d.name not in IGNORES and d.is_dir():
@@ -315,21 +348,49 @@ def check_ckpt_stauts(args):
         continue
 
       corrupted = 0
+      stored = 0
       for ckpt in ckpt_path.iterdir():
         cpt = ckpt / 'm5.cpt'
-        pmem = ckpt / 'system.physmem.store0.pmem'
+        pmem = ckpt / PMEM_FILENAME
+        manifest = ckpt / MANIFEST_FILENAME
         try:
           assert(cpt.exists())
-          assert(pmem.exists())
-        except AssertionError:
+          if not pmem.exists() and (ckpt / DELTA_FILENAME).exists():
+            stored += 1
+          elif not pmem.exists():
+            # deduplicated checkpoints are fine as long as every chunk is still in the store
+            assert(manifest.exists())
+            manifest, store = load_manifest(manifest)
+            assert(not store.missing(manifest['chunks']))
+            stored += 1
+        except (AssertionError, ValueError):
           corrupted += 1
 
-      if not corrupted:
+      if not corrupted and stored:
+        print(f'[\u2713] {d.name:>20}: clean! {stored} checkpoints to materialize')
+      elif not corrupted:
         print(f'[\u2713] {d.name:>20}: clean!')
       else:
         print(f'[\u2717] {d.name:>20}: corrupted checkpoint {ckpt.name}: {corrupted}')
 
 
+def materialize_ckpts(args):
+  # rebuild gem5's pmem of deduplicated and delta checkpoints, all benchmarks if none is given
+  dirs = [Path(args.CKPT_DIR) / name for name in args.names] or [Path(args.CKPT_DIR)]
+  manifests = [m for m in find_manifests(dirs) if args.force or not (m.parent / PMEM_FILENAME).exists()]
+  with ThreadPoolExecutor(max_workers=args.parallelism) as executor:
+    for pmem in executor.map(lambda m: materialize(m, raw=args.raw), manifests):
+      logging.info(f'{pmem} materialized')
+  # delta checkpoints go after the manifests, their chains may start at one
+  for d in dirs:
+    for delta in sorted(d.glob(f'**/{DELTA_FILENAME}')):
+      pmem = delta.parent / PMEM_FILENAME
+      if args.force and pmem.exists():
+        pmem.unlink()
+      if not pmem.exists():
+        logging.info(f'{flatten(delta.parent, compress=not args.raw)} flattened')
+
+
 def gen_cmds(args):
   outfile = args.RUN_DIR / 'spec06_benchmarks.py'
   with outfile.open('w') as out:
@@ -374,10 +435,11 @@ def bbv(args):
   with ThreadPoolExecutor(max_workers=args.parallelism) as executor:
     candidates = [d for d in args.RUN_DIR.iterdir() if d.is_dir() and d.name not in IGNORES]
     for cnt, d in enumerate(candidates):
+      options = ['--page-store'] if args.page_store else []
       if sub_arg == 'simpt-runner' or subprocess == 'e2e-runner':
-        fu = executor.submit(subprocess.run, ['python3', __file__, sub_arg, d.name, '--maxK', str(args.maxK)])
+        fu = executor.submit(subprocess.run, ['python3', __file__] + options + [sub_arg, d.name, '--maxK', str(args.maxK)])
       else:
-        fu = executor.submit(subprocess.run, ['python3', __file__, sub_arg, d.name])
+        fu = executor.submit(subprocess.run, ['python3', __file__] + options + [sub_arg, d.name])
       futures.append(fu)
       fut_map[fu] = d.name
 
@@ -449,6 +511,7 @@ if __name__ == '__main__':
   parser = argparse.ArgumentParser()
   parser.add_argument('-j', '--parallelism', action='store', type=int, default=cpu_count())
   parser.add_argument('-d', '--cwd', type=str, default='.')
+  parser.add_argument('--page-store', action='store_true', help='deduplicate checkpoint memory in ckpt/.pages')
   subparsers = parser.add_subparsers(help='sub-command help')
 
   bbv_parser = subparsers.add_parser('bbv', help='bbv for all')
@@ -499,9 +562,18 @@ if __name__ == '__main__':
   recorder_runner_parser.add_argument('name', action='store')
   recorder_runner_parser.set_defaults(func=gen_pin_ckpt)
 
+  calibrate_parser = subparsers.add_parser('gdb-calibrate', help='measure gdb breakpoint costs on this machine')
+  calibrate_parser.set_defaults(func=gdb_calibrate)
+
   ckpt_status_parser = subparsers.add_parser('ckpt-status', help='check all checkpoint generation status')
   ckpt_status_parser.set_defaults(func=check_ckpt_stauts)
 
+  materialize_parser = subparsers.add_parser('materialize', help='rebuild pmem of deduplicated and delta checkpoints')
+  materialize_parser.add_argument('names', action='store', nargs='*')
+  materialize_parser.add_argument('--raw', action='store_true', help='write an uncompressed pmem')
+  materialize_parser.add_argument('-f', '--force', action='store_true', help='overwrite existing pmem files')
+  materialize_parser.set_defaults(func=materialize_ckpts)
+
   cmds_gen_parser = subparsers.add_parser('gen-cmds', help='generate spec17 config for gem5')
   cmds_gen_parser.set_defaults(func=gen_cmds)
 
@@ -517,6 +589,7 @@ if __name__ == '__main__':
   args.RUN_DIR  = Path(Path(args.cwd) / 'run').resolve()
   args.CKPT_DIR = Path(Path(args.cwd) / 'ckpt').resolve()
   args.LOG_DIR  = Path(Path(args.cwd) / 'log').resolve()
+  args.PAGE_DIR = args.CKPT_DIR / '.pages' if args.page_store else None
   try:
     args.func(args)
   except AttributeError:
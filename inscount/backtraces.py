@@ -1,3 +1,4 @@
+import os
 import re
 import sys
 
@@ -8,6 +9,7 @@ except ImportError:
     exit(1)
 
 
+# plain parsers, the Python of GDB may have no numpy for bbv_trace
 def brk_parser(fd) -> list:
     brks = []
     for line in fd:
@@ -24,11 +26,7 @@ def simpt_parser(fd) -> list:
     return simpts
 
 
-def get_bt(pc):
-    gdb.execute(f'b * {pc:#x}')
-    gdb.execute(f'r')
-    res = gdb.execute(f'bt', to_string=True)
-    print(res, file=sys.stderr)
+def parse_bt(res):
     bt = []
     pattern = r'\#([0-9]+) +(0x[0-9a-fA-F]+)'
     for entries in re.findall(pattern, res):
@@ -38,6 +36,48 @@ def get_bt(pc):
     return bt
 
 
+def get_bt(pc):
+    gdb.execute(f'b * {pc:#x}')
+    gdb.execute(f'r')
+    res = gdb.execute(f'bt', to_string=True)
+    print(res, file=sys.stderr)
+    return parse_bt(res)
+
+
+def get_bts(targets):
+    # one run for all (pc, cnt) targets: every pc gets one breakpoint whose ignore count skips
+    # to its next required execution, so the program only stops where a backtrace is needed
+    pending = {}
+    for pc, cnt in sorted(set(targets)):
+        pending.setdefault(pc, []).append(cnt)
+    bps = {}
+    for pc, cnts in pending.items():
+        bps[pc] = gdb.Breakpoint(f'*{pc:#x}')
+        bps[pc].ignore_count = cnts[0] - 1
+
+    traces = {}
+    gdb.execute('r')
+    while pending:
+        if not gdb.selected_inferior().pid:
+            missing = ', '.join(f'{pc:#x}@{cnts[0]}' for pc, cnts in pending.items())
+            raise RuntimeError(f'program exited before {missing}')
+        pc = int(gdb.parse_and_eval('$pc'))
+        cnt = pending[pc].pop(0)
+        # hit_count also counts the ignored hits
+        assert bps[pc].hit_count == cnt, f'{pc:#x} stopped at hit {bps[pc].hit_count} instead of {cnt}'
+        res = gdb.execute('bt', to_string=True)
+        print(res, file=sys.stderr)
+        traces[(pc, cnt)] = parse_bt(res)
+        if pending[pc]:
+            bps[pc].ignore_count = pending[pc][0] - cnt - 1
+        else:
+            bps.pop(pc).delete()
+            del pending[pc]
+        if pending:
+            gdb.execute('c')
+    return traces
+
+
 if __name__ == "__main__":
     brk_path = 'out.brk'
     simpt_path = 'results.simpts'
@@ -47,9 +87,14 @@ if __name__ == "__main__":
         brks = brk_parser(brk_in)
         simpts = simpt_parser(simpt_in)
 
-    pcs = {brks[sid - 1][0] for sid, _ in simpts if sid > 0}
+    targets = [brks[sid - 1] for sid, _ in simpts if sid > 0]
 
-    traces = {pc: get_bt(pc) for pc in pcs}
+    if os.getenv('BACKTRACE_RESTART'):
+        # the old way, one run per pc that stops at its first execution
+        traces = {pc: get_bt(pc) for pc in {pc for pc, _ in targets}}
+        traces = {(pc, cnt): traces[pc] for pc, cnt in targets}
+    else:
+        traces = get_bts(targets)
 
     with open(output, 'w') as out:
         simpts = sorted(simpts, key=lambda x: x[1])
@@ -58,5 +103,5 @@ if __name__ == "__main__":
                 out.write(f'{simpt_id} {s_cnt} 0 0\n')
             else:
                 pc, cnt = brks[s_cnt - 1]
-                trace = traces[pc]
+                trace = traces[(pc, cnt)]
                 out.write('{} {} {:#x} {} {}\n'.format(simpt_id, s_cnt, pc, cnt, ' '.join(map(lambda s: f'{s:#x}', trace))))
@@ -0,0 +1,335 @@
+#! /usr/bin/env python3
+
+import os
+import sys
+import json
+import hashlib
+import numpy as np
+
+from pathlib import Path
+
+
+# bytes per read when bulk-parsing out.bb, always cut at a line boundary
+CHUNK_SIZE = 64 * 1024 * 1024
+# parsed traces are cached here (relative to the run directory)
+CACHE_DIRNAME = '.bbv_cache'
+# bytes per read when hashing a source file whose mtime changed
+HASH_CHUNK = 16 * 1024 * 1024
+# out.bb records look like "T:<bbid>:<cnt> :<bbid>:<cnt> ...", turn them into plain integers
+_BBV_SEPARATORS = bytes.maketrans(b'T:', b'  ')
+
+
+def bbid_parser(fd):
+    # each line: <bbid> <pc> [<number of instructions>]
+    ids, pcs, sizes = [], [], []
+    for line in fd:
+        fields = line.strip().split()
+        if not fields:
+            continue
+        ids.append(int(fields[0]))
+        pcs.append(int(fields[1], base=16))
+        sizes.append(int(fields[2]) if len(fields) > 2 else 1)
+    return (np.array(ids, dtype=np.int64),
+            np.array(pcs, dtype=np.uint64),
+            np.array(sizes, dtype=np.int64))
+
+
+def brk_parser(fd):
+    pcs, cnts = [], []
+    for line in fd:
+        pc, cnt = line.strip().split()
+        pcs.append(int(pc, base=16))
+        cnts.append(int(cnt))
+    return np.array(pcs, dtype=np.uint64), np.array(cnts, dtype=np.int64)
+
+
+def simpt_parser(fd) -> list:
+    simpts = []
+    for line in fd:
+        sid, cnt = line.strip().split()
+        simpts.append((int(sid), int(cnt)))
+    return simpts
+
+
+def _file_hash(path: Path):
+    # the whole file, a rerun of bbv.cpp rewrites out.bb in the middle and keeps its size
+    digest = hashlib.blake2b()
+    with path.open('rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _source_key(path: Path, with_hash=True):
+    st = path.stat()
+    key = {'path': str(path.resolve()), 'size': st.st_size, 'mtime': st.st_mtime_ns}
+    if with_hash:
+        key['hash'] = _file_hash(path)
+    return key
+
+
+def cached(cache_dir, name, sources, build):
+    ''' Load the arrays called name from cache_dir, or build() and save them.
+
+    The cache is valid as long as every source file has the recorded size and mtime; if only
+    the mtime changed, the file hash decides. Arrays come back memory-mapped read-only.
+    '''
+    if cache_dir is None:
+        return build()
+
+    cache_dir = Path(cache_dir)
+    meta_path = cache_dir / f'{name}.json'
+    if meta_path.exists():
+        with meta_path.open() as f:
+            meta = json.load(f)
+        valid = len(meta['sources']) == len(sources)
+        touched = False
+        for recorded, path in zip(meta['sources'], sources):
+            if not valid:
+                break
+            current = _source_key(path, with_hash=False)
+            if current['path'] != recorded['path'] or current['size'] != recorded['size']:
+                valid = False
+            elif current['mtime'] != recorded['mtime']:
+                valid = _file_hash(path) == recorded['hash']
+                recorded['mtime'] = current['mtime']
+                touched = True
+        if valid:
+            try:
+                arrays = {key: np.load(cache_dir / f'{name}.{key}.npy', mmap_mode='r') for key in meta['arrays']}
+            except (OSError, ValueError):
+                arrays = None
+            if arrays is not None:
+                if touched:
+                    _write_meta(meta_path, meta)
+                return arrays
+
+    print(f'parsing {name} ...', file=sys.stderr)
+    arrays = build()
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    for key, array in arrays.items():
+        tmp_path = cache_dir / f'{name}.{key}.tmp.npy'
+        np.save(tmp_path, array)
+        os.replace(tmp_path, cache_dir / f'{name}.{key}.npy')
+    _write_meta(meta_path, {'sources': [_source_key(p) for p in sources], 'arrays': list(arrays)})
+    return {key: np.load(cache_dir / f'{name}.{key}.npy', mmap_mode='r') for key in arrays}
+
+
+def _write_meta(meta_path, meta):
+    tmp_path = meta_path.with_suffix('.tmp')
+    with tmp_path.open('w') as f:
+        json.dump(meta, f, indent=4)
+    os.replace(tmp_path, meta_path)
+
+
+def load_brk(brk_path: Path, cache_dir=None):
+    def build():
+        with brk_path.open() as f:
+            pcs, cnts = brk_parser(f)
+        return {'pcs': pcs, 'cnts': cnts}
+
+    arrays = cached(cache_dir, 'brk', [brk_path], build)
+    return arrays['pcs'], arrays['cnts']
+
+
+def _iter_chunks(fd, chunk_size=CHUNK_SIZE):
+    tail = b''
+    while True:
+        data = fd.read(chunk_size)
+        if not data:
+            break
+        data = tail + data
+        cut = data.rfind(b'\n') + 1
+        if cut == 0:
+            tail = data
+            continue
+        tail = data[cut:]
+        yield data[:cut]
+    if tail.strip():
+        yield tail + b'\n'
+
+
+def _parse_chunk(chunk):
+    # returns the number of records of every line and the flattened (bbid, cnt) pairs
+    raw = np.frombuffer(chunk, dtype=np.uint8)
+    colons = np.flatnonzero(raw == ord(':'))
+    newlines = np.flatnonzero(raw == ord('\n'))
+    nnz = np.diff(np.searchsorted(colons, newlines), prepend=0) // 2
+    values = np.fromstring(chunk.translate(_BBV_SEPARATORS).decode(), dtype=np.int64, sep=' ')
+    assert len(values) == 2 * nnz.sum(), 'malformed BBV records'
+    return nnz, values[0::2], values[1::2]
+
+
+def iter_records(bbv_path: Path):
+    # (records per slice, bbids, counts) of out.bb one chunk of whole slices at a time
+    with bbv_path.open('rb') as f:
+        for chunk in _iter_chunks(f):
+            yield _parse_chunk(chunk)
+
+
+class BBVTrace:
+    ''' Basic block vectors of all slices as a (slices x PCs) sparse matrix in CSR layout.
+
+    Row i holds the basic blocks executed in slice i: cols[indptr[i]:indptr[i + 1]] are
+    column ids (indices into pcs) and counts[...] are how many times each block was executed.
+    '''
+
+    def __init__(self, indptr, cols, counts, pcs, sizes):
+        self.indptr = indptr
+        self.cols   = cols
+        self.counts = counts
+        self.pcs    = pcs
+        self.sizes  = sizes
+
+    def __len__(self):
+        return len(self.indptr) - 1
+
+    @property
+    def num_pcs(self):
+        return len(self.pcs)
+
+    def row(self, index):
+        start, end = self.indptr[index], self.indptr[index + 1]
+        return self.cols[start:end], self.counts[start:end]
+
+    def col(self, pc):
+        # column id of pc, -1 if pc was never executed
+        return int(self.cols_of(np.array([pc], dtype=np.uint64))[0])
+
+    def cols_of(self, pcs):
+        pcs = np.asarray(pcs, dtype=np.uint64)
+        index = np.minimum(np.searchsorted(self.pcs, pcs), max(self.num_pcs - 1, 0))
+        found = self.pcs[index] == pcs if self.num_pcs else np.zeros(len(pcs), dtype=bool)
+        return np.where(found, index, -1)
+
+    def accumulate(self, start, end, out):
+        # add rows start..end (end included) into the dense vector out
+        lo, hi = self.indptr[start], self.indptr[end + 1]
+        np.add.at(out, self.cols[lo:hi], self.counts[lo:hi])
+        return out
+
+    def slice_lengths(self, batch=4096):
+        # instructions executed in every slice
+        lengths = np.zeros(len(self), dtype=np.int64)
+        for first in range(0, len(self), batch):
+            last = min(first + batch, len(self))
+            lo, hi = self.indptr[first], self.indptr[last]
+            insts = np.zeros(hi - lo + 1, dtype=np.int64)
+            np.cumsum(self.counts[lo:hi] * self.sizes[self.cols[lo:hi]], out=insts[1:])
+            lengths[first:last] = np.diff(insts[self.indptr[first:last + 1] - lo])
+        return lengths
+
+    @classmethod
+    def load(cls, bbv_path: Path, bbid_path: Path, cache_dir=None):
+        def build():
+            trace = cls.parse(bbv_path, bbid_path)
+            return {k: getattr(trace, k) for k in ('indptr', 'cols', 'counts', 'pcs', 'sizes')}
+
+        return cls(**cached(cache_dir, 'bbv', [bbv_path, bbid_path], build))
+
+    @classmethod
+    def parse(cls, bbv_path: Path, bbid_path: Path):
+        with bbid_path.open() as f:
+            ids, pcs, sizes = bbid_parser(f)
+
+        # columns are sorted by PC so that PC -> column lookups are a binary search
+        order = np.argsort(pcs, kind='stable')
+        id2col = np.full(ids.max() + 1 if len(ids) else 1, -1, dtype=np.int64)
+        id2col[ids[order]] = np.arange(len(order))
+        pcs, sizes = pcs[order], sizes[order]
+
+        nnz, cols, counts = [], [], []
+        for chunk_nnz, chunk_ids, chunk_cnts in iter_records(bbv_path):
+            chunk_cols = id2col[chunk_ids]
+            assert (chunk_cols >= 0).all(), 'BBV refers to unknown basic block ids'
+            nnz.append(chunk_nnz)
+            cols.append(chunk_cols.astype(np.int32))
+            # out.bb weights every block by its instruction count, convert back to executions
+            counts.append(chunk_cnts // sizes[chunk_cols])
+
+        nnz = np.concatenate(nnz) if nnz else np.zeros(0, dtype=np.int64)
+        indptr = np.zeros(len(nnz) + 1, dtype=np.int64)
+        np.cumsum(nnz, out=indptr[1:])
+        cols = np.concatenate(cols) if cols else np.zeros(0, dtype=np.int32)
+        counts = np.concatenate(counts) if counts else np.zeros(0, dtype=np.int64)
+        return cls(indptr, cols, counts, pcs, sizes)
+
+
+class CumulativeIndex:
+    ''' Cumulative execution counts of a subset of PCs at the end of every slice.
+
+    A dense (slices x PCs) prefix sum would not fit in memory, so for every tracked column only
+    the slices that executed it are kept, sorted by (column, slice) together with the running
+    total. A lookup is one binary search over that array and works on whole vectors of queries.
+    '''
+
+    def __init__(self, keys, totals, cols, num_slices):
+        self.keys       = keys
+        self.totals     = totals
+        self.cols       = cols
+        self.num_slices = num_slices
+
+    @classmethod
+    def load(cls, bbv: BBVTrace, cols, cache_dir=None, sources=(), name='cum'):
+        # sources are the files bbv and cols were derived from, they key the cache
+        def build():
+            index = cls.build(bbv, cols)
+            return {'keys': index.keys, 'totals': index.totals, 'cols': index.cols}
+
+        arrays = cached(cache_dir, name, list(sources), build)
+        return cls(arrays['keys'], arrays['totals'], arrays['cols'], len(bbv))
+
+    @classmethod
+    def build(cls, bbv: BBVTrace, cols):
+        cols = np.unique(np.asarray(cols, dtype=np.int64))
+        cols = cols[cols >= 0]
+        stride = len(bbv) + 1
+
+        selected = np.flatnonzero(np.isin(bbv.cols, cols))
+        slices = np.searchsorted(bbv.indptr, selected, side='right') - 1
+        keys = bbv.cols[selected].astype(np.int64) * stride + slices
+        order = np.argsort(keys, kind='stable')
+        keys, counts = keys[order], bbv.counts[selected][order]
+
+        # running totals restart at the first entry of every column
+        totals = np.cumsum(counts)
+        first = np.flatnonzero(np.diff(keys // stride, prepend=-1))
+        totals -= np.repeat(totals[first] - counts[first], np.diff(first, append=len(keys)))
+        return cls(keys, totals, cols, len(bbv))
+
+    def tracks(self, col):
+        index = np.searchsorted(self.cols, col)
+        return index < len(self.cols) and self.cols[index] == col
+
+    def at(self, cols, slices):
+        # executions of every column in cols up to the end of the matching slice (included),
+        # slice -1 is the program start
+        cols = np.asarray(cols, dtype=np.int64)
+        slices = np.broadcast_to(np.asarray(slices, dtype=np.int64), cols.shape)
+        if not len(self.keys):
+            return np.zeros(cols.shape, dtype=np.int64)
+        stride = self.num_slices + 1
+        index = np.searchsorted(self.keys, cols * stride + slices, side='right') - 1
+        valid = (index >= 0) & (cols >= 0) & (slices >= 0)
+        index = np.maximum(index, 0)
+        valid &= self.keys[index] // stride == cols
+        return np.where(valid, self.totals[index], 0)
+
+    def reaching(self, cols, targets):
+        # first slice at whose end every column has been executed the matching target times,
+        # num_slices if it never is
+        cols, targets = np.broadcast_arrays(np.asarray(cols, dtype=np.int64), np.asarray(targets, dtype=np.int64))
+        if not len(self.keys):
+            return np.full(cols.shape, self.num_slices, dtype=np.int64)
+        stride = self.num_slices + 1
+        lo = np.searchsorted(self.keys, cols * stride)
+        hi = end = np.searchsorted(self.keys, (cols + 1) * stride)
+        # totals only grow within a column, so this is one binary search over all columns at once
+        while (lo < hi).any():
+            active = lo < hi
+            mid = np.minimum((lo + hi) // 2, len(self.keys) - 1)
+            less = self.totals[mid] < targets
+            lo = np.where(active & less, mid + 1, lo)
+            hi = np.where(active & ~less, mid, hi)
+        found = (lo < end) & (cols >= 0)
+        return np.where(found, self.keys[np.minimum(lo, len(self.keys) - 1)] % stride, self.num_slices)
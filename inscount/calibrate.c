@@ -0,0 +1,13 @@
+// Target program of gdb_calibrate.py: calls tick() forever so gdb always has a breakpoint to hit
+
+__attribute__((noinline)) void tick(volatile unsigned long *counter) {
+    (*counter)++;
+}
+
+int main() {
+    volatile unsigned long counter = 0;
+    while (1) {
+        tick(&counter);
+    }
+    return 0;
+}
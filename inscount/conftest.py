@@ -0,0 +1,121 @@
+import random
+
+import pytest
+
+from gdb_plan import parse_cmd
+
+
+class Program:
+    ''' A synthetic run of basic blocks and the out.bb/out.brk/out.bbid bbv.cpp writes for it.
+
+    Every slice is a random body, then the block whose hit lands in out.brk, then one filler
+    block that crosses the interval. So the out.brk record is followed by nothing but the filler,
+    which is where the planners take a stop at a record to be.
+    '''
+
+    def __init__(self, seed, slices=60, interval=400, margin=8, hot=10, rare=6):
+        rng = random.Random(seed)
+        self.interval, self.margin = interval, margin
+        self.hot = [0x401000 + 0x40 * i for i in range(hot)]
+        self.rare = [0x402000 + 0x40 * i for i in range(rare)]
+        self.filler = 0x403000
+        self.sizes = {pc: rng.randint(1, 4) for pc in self.hot + self.rare}
+        self.sizes[self.hot[0]] = 1
+        self.sizes[self.filler] = margin
+
+        self.events = []
+        for _ in range(slices):
+            # a phase of the program runs some of the hot blocks
+            phase = [self.hot[0]] + rng.sample(self.hot[1:], rng.randint(1, hot - 1))
+            left = interval - margin
+            while left:
+                if rng.random() < 0.02:
+                    pc = rng.choice(self.rare)
+                else:
+                    pc = rng.choice(phase[:rng.randint(1, len(phase))])
+                if self.sizes[pc] <= left:
+                    self.events.append(pc)
+                    left -= self.sizes[pc]
+            self.events.append(rng.choice([pc for pc in phase if self.sizes[pc] == 1]))
+            self.events.append(self.filler)
+        self.bbv()
+
+    def bbv(self):
+        # docount() and dump() of bbv.cpp
+        self.slices, self.brk, self.brk_pos = [], [], []
+        counter, delta, ids = {}, {}, {}
+        icounter = oldicounter = 0
+        brp_saved = False
+        for pos, pc in enumerate(self.events):
+            ids.setdefault(pc, len(ids))
+            icounter += self.sizes[pc]
+            delta[pc] = delta.get(pc, 0) + 1
+            counter[pc] = counter.get(pc, 0) + 1
+            if icounter - oldicounter > self.interval:
+                oldicounter = icounter
+                self.slices.append(delta)
+                delta = {}
+                brp_saved = False
+            if icounter - oldicounter > self.interval - self.margin and not brp_saved:
+                self.brk.append((pc, counter[pc]))
+                self.brk_pos.append(pos)
+                brp_saved = True
+        self.ids = ids
+        assert len(self.brk) == len(self.slices)
+
+    def write(self, cwd, simpts):
+        with (cwd / 'out.bb').open('w') as f:
+            for delta in self.slices:
+                f.write('T' + ''.join(f':{self.ids[pc]}:{cnt * self.sizes[pc]} ' for pc, cnt in delta.items()) + '\n')
+        with (cwd / 'out.brk').open('w') as f:
+            f.writelines(f'{pc:x} {cnt}\n' for pc, cnt in self.brk)
+        with (cwd / 'out.bbid').open('w') as f:
+            f.writelines(f'{bbid} {pc:#x} {self.sizes[pc]}\n' for pc, bbid in self.ids.items())
+        with (cwd / 'results.simpts').open('w') as f:
+            f.writelines(f'{slice_num} {simpt_id}\n' for simpt_id, slice_num in enumerate(simpts))
+
+    def expected(self, simpts):
+        # where every simpoint has to be checkpointed, -1 is the program start
+        return {simpt_id: self.brk_pos[slice_num - 1] if slice_num else -1 for simpt_id, slice_num in enumerate(simpts)}
+
+    def replay(self, cmds):
+        ''' Run a gdb.cmd plan the way gdb does, returns the position of every '#ckpt@'.
+
+        A breakpoint counts the hits after the stop it was armed at, gdb steps over the
+        breakpoint at the pc it resumes from. Every hit uses up one ignore, a hit without
+        ignores left stops the program, a tbreak is deleted there.
+        '''
+        bps, number, pos, ckpts = {}, 0, -1, {}
+        for cmd in cmds:
+            action, args = parse_cmd(cmd)
+            if action in ('break', 'b', 'tbreak'):
+                number += 1
+                bps[number] = [int(''.join(args).lstrip('*'), 16), 0, action == 'tbreak']
+            elif action == 'ignore':
+                bp, count = (number, args[0]) if len(args) == 1 else args
+                bps[int(bp)][1] = int(count)
+            elif action == 'delete':
+                for bp in args or list(bps):
+                    bps.pop(int(bp))
+            elif action in ('c', 'continue'):
+                stopped = []
+                while not stopped:
+                    pos += 1
+                    assert pos < len(self.events), f'the program exits at "{cmd}"'
+                    for bp, (pc, ignore, _) in bps.items():
+                        if pc == self.events[pos]:
+                            if ignore:
+                                bps[bp][1] -= 1
+                            else:
+                                stopped.append(bp)
+                for bp in stopped:
+                    if bps[bp][2]:
+                        del bps[bp]
+            elif action == 'ckpt':
+                ckpts[int(args[0])] = pos
+        return ckpts
+
+
+@pytest.fixture(params=range(5))
+def program(request):
+    return Program(request.param)
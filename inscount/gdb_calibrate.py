@@ -0,0 +1,83 @@
+#! /usr/bin/env python3
+
+# Measures how expensive breakpoint hits and stops are for GDBOnly on this machine.
+# Run it directly: it builds calibrate.c and re-runs itself inside gdb, which writes the profile.
+
+import os
+import sys
+import json
+import time
+import tempfile
+import datetime
+import subprocess
+
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent))
+
+from gdb_plan import DEFAULT_PROFILE
+
+
+def measure(num_hits, num_stops):
+    import gdb  # pylint: disable=import-error
+    gdb.execute('starti', to_string=True)
+    tick = int(gdb.parse_and_eval('(unsigned long) &tick'))
+
+    # ignored hits: one stop at the end of num_hits traps
+    res = gdb.execute(f'break * {tick:#x}', to_string=True)
+    gdb.execute(f'ignore {res.split()[1]} {num_hits - 1}', to_string=True)
+    begin = time.perf_counter()
+    gdb.execute('c', to_string=True)
+    hit_cost = (time.perf_counter() - begin) / num_hits
+    gdb.execute('delete', to_string=True)
+
+    # the break/c/delete round trip GDBOnly does for every waypoint
+    begin = time.perf_counter()
+    for _ in range(num_stops):
+        gdb.execute(f'break * {tick:#x}', to_string=True)
+        gdb.execute('c', to_string=True)
+        gdb.execute('delete', to_string=True)
+    stop_cost = (time.perf_counter() - begin) / num_stops - hit_cost
+
+    gdb.execute('kill', to_string=True)
+    return hit_cost, max(stop_cost, 0.0)
+
+
+def calibrate(output: Path, num_hits, num_stops):
+    with tempfile.TemporaryDirectory() as tmp:
+        binary = Path(tmp) / 'calibrate'
+        subprocess.run(['cc', '-O1', '-g', '-o', str(binary), str(Path(__file__).parent / 'calibrate.c')], check=True)
+
+        env = dict(os.environ, CALIBRATE_OUTPUT=str(output), CALIBRATE_HITS=str(num_hits),
+                   CALIBRATE_STOPS=str(num_stops))
+        subprocess.run(['gdb', '--batch', '-x', str(Path(__file__).resolve()), str(binary)], env=env, check=True)
+
+    with output.open() as f:
+        profile = json.load(f)
+    print(f"hit cost: {profile['hit_cost'] * 1e6:.2f}us, stop cost: {profile['stop_cost'] * 1e3:.2f}ms")
+
+
+if __name__ == '__main__':
+    try:
+        import gdb  # pylint: disable=import-error
+    except ImportError:
+        import argparse
+        parser = argparse.ArgumentParser()
+        parser.add_argument('-o', '--output', type=str, help='where to save the profile', default=str(DEFAULT_PROFILE))
+        parser.add_argument('--hits', type=int, help='number of ignored hits to time', default=200000)
+        parser.add_argument('--stops', type=int, help='number of stops to time', default=500)
+        args = parser.parse_args()
+
+        output = Path(args.output)
+        output.parent.mkdir(parents=True, exist_ok=True)
+        calibrate(output, args.hits, args.stops)
+    else:
+        hit_cost, stop_cost = measure(int(os.environ['CALIBRATE_HITS']), int(os.environ['CALIBRATE_STOPS']))
+        profile = {
+            'hit_cost': hit_cost,
+            'stop_cost': stop_cost,
+            'gdb': gdb.VERSION,
+            'date': str(datetime.datetime.now(datetime.timezone.utc))
+        }
+        with open(os.environ['CALIBRATE_OUTPUT'], 'w') as f:
+            json.dump(profile, f, indent=4)
@@ -1,29 +1,66 @@
 #! /usr/bin/env python3
 
 import sys
+import json
+import numpy as np
+import multiprocessing
 
 from pathlib import Path
-from collections import defaultdict, namedtuple
-from math import inf
+from collections import namedtuple, defaultdict
+from concurrent.futures import ProcessPoolExecutor
+
+from bbv_trace import CACHE_DIRNAME, BBVTrace, CumulativeIndex, bbid_parser, iter_records, load_brk, simpt_parser
+from gdb_plan import estimate_replay, load_profile
 
 WayPoint = namedtuple('WayPoint', 'slice_num pc rel_cnt abs_cnt ctx')
 SimPoint = namedtuple('SimPoint', 'simpt_id slice_num ctx')
 
 
 class PathFinder:
-    def __init__(self, bbv_path, brk_path, bbid_path, interval, args):
-        with bbid_path.open() as f:
-            self.bbid = PathFinder.bbid_parser(f)
-        with bbv_path.open() as f:
-            self.bbv = self.bbv_parser(f)
-        with brk_path.open() as f:
-            self.brk = PathFinder.brk_parser(f)
+    def __init__(self, bbv_path, brk_path, bbid_path, interval, args, cache_dir=None, rare=0):
+        self.bbv = BBVTrace.load(bbv_path, bbid_path, cache_dir)
+        self.brk_pcs, self.brk_cnts = load_brk(brk_path, cache_dir)
+        self.brk_cols = self.bbv.cols_of(self.brk_pcs)
+        self.brk = list(zip(self.brk_pcs.tolist(), self.brk_cnts.tolist()))
+
+        # a context is the index of the slice it ends with, counts come from this index
+        rare_slices, rare_cols = self._rare_blocks(rare)
+        self.cum = CumulativeIndex.load(self.bbv, np.concatenate([self.brk_cols, rare_cols]), cache_dir,
+                                        [bbv_path, bbid_path, brk_path], name=f'cum-rare{rare}' if rare else 'cum')
+
+        # waypoint candidates sorted by slice: the out.brk record of every slice, plus the first
+        # execution of the least executed blocks of every slice
+        rare_abs = self.cum.at(rare_cols, rare_slices - 1) + 1
+        slices = np.concatenate([np.arange(len(self.brk_cnts)), rare_slices])
+        order = np.argsort(slices, kind='stable')
+        self.cand_slices = slices[order]
+        self.cand_cols   = np.concatenate([self.brk_cols, rare_cols])[order]
+        self.cand_pcs    = np.concatenate([self.brk_pcs, self.bbv.pcs[rare_cols]])[order]
+        self.cand_abs    = np.concatenate([self.brk_cnts, rare_abs])[order]
+        self.cand_rare   = np.concatenate([np.zeros(len(self.brk_cnts), dtype=bool), np.ones(len(rare_cols), dtype=bool)])[order]
 
         self.interval = interval
-        self.ctx_cache = {-1: defaultdict(lambda: 0)}
         if args.tradition:
             self.waypoints = self.gen_waypoints()
 
+    def _rare_blocks(self, rare, batch=4096):
+        # the rare least executed blocks of every slice that has an out.brk record
+        slices, cols = [], []
+        num_slices = min(len(self.bbv), len(self.brk_cnts))
+        for first in range(0, num_slices if rare else 0, batch):
+            last = min(first + batch, num_slices)
+            lo, hi = self.bbv.indptr[first], self.bbv.indptr[last]
+            lengths = np.diff(self.bbv.indptr[first:last + 1])
+            rows = np.repeat(np.arange(first, last), lengths)
+            order = np.lexsort((self.bbv.counts[lo:hi], rows))
+            rank = np.arange(hi - lo) - np.repeat(self.bbv.indptr[first:last] - lo, lengths)
+            picked = order[rank < rare]
+            slices.append(rows[picked])
+            cols.append(self.bbv.cols[lo:hi][picked].astype(np.int64))
+        if not slices:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        return np.concatenate(slices), np.concatenate(cols)
+
     def gen_waypoints(self):
         waypoints = []
         for start_index in range(0, len(self.bbv), self.interval):
@@ -36,16 +73,8 @@ class PathFinder:
                 last_wp = waypoints[-1]
                 ctx = last_wp.ctx
             # search for the "shortest path"
-            way_index = None
-            min_cnt = inf
-            for i in range(start_index, end_index + 1):
-                brk_pc, brk_cnt = self.brk[i]
-                diff = brk_cnt - ctx.get(brk_pc, 0)
-                if diff < min_cnt and diff > 0:
-                    way_index = i
-                    min_cnt = diff
-            new_ctx = self.get_ctx(way_index)
-            waypoints.append(WayPoint(slice_num=way_index, pc=self.brk[way_index][0], rel_cnt=min_cnt, abs_cnt=self.brk[way_index][1], ctx=new_ctx))
+            way_index, min_cnt = self._min_diff(ctx, start_index, end_index)
+            waypoints.append(self._waypoint(way_index, min_cnt))
             print(f'gen waypoint from {start_index} to {end_index}', waypoints[-1].slice_num, hex(waypoints[-1].pc), waypoints[-1].abs_cnt, waypoints[-1].rel_cnt, file=sys.stderr)
         return {wp.slice_num: wp for wp in waypoints}
 
@@ -61,20 +90,11 @@ class PathFinder:
             results.append(SimPoint(simpt_id=sid, slice_num=snum, ctx=self.get_ctx(snum)))
         return results
 
-    def search_waypoint(self, start, end):
+    def search_waypoint(self, start, end, from_rare=False, target_col=-1):
         # search a waypoint based on the context at start, so the search range is start+1 -> end (included)
         ctx = self.get_ctx(start)
-        way_index = None
-        min_cnt = inf
-        for i in range(start + 1, end + 1):
-            brk_pc, brk_cnt = self.brk[i]
-            diff = brk_cnt - ctx.get(brk_pc, 0)
-            if diff < min_cnt and diff > 0:
-                way_index = i
-                min_cnt = diff
-        new_ctx = self.get_ctx(way_index)
-        wp = WayPoint(slice_num=way_index, pc=self.brk[way_index][0], rel_cnt=min_cnt, abs_cnt=self.brk[way_index][1], ctx=new_ctx)
-        return wp
+        way_index, min_cnt = self._min_diff(ctx, start + 1, end, from_rare, target_col)
+        return None if way_index is None else self._waypoint(way_index, min_cnt)
 
     def binary_search(self, start, slice_num, simpt_id, threshold=1000000):
         waypoints = []
@@ -82,68 +102,256 @@ class PathFinder:
         brk_pc, brk_cnt = self.brk[end]
 
         ctx = self.get_ctx(start)
+        from_rare = False
         wp_start = start
-        while brk_cnt - ctx.get(brk_pc, 0) > threshold and wp_start < end - 1:
+        while brk_cnt - self.ctx_count(ctx, brk_pc, from_rare) > threshold and wp_start < end - 1:
             print(f'searching... {wp_start}-{end-1}, size={len(waypoints)}')
-            wp = self.search_waypoint(wp_start, end - 1)
+            wp = self.search_waypoint(wp_start, end - 1, from_rare, self.brk_cols[end])
+            if wp is None:
+                break
             waypoints.append(wp)
             ctx = wp.ctx
+            from_rare = self.is_rare(wp)
             wp_start = wp.slice_num
         waypoints.append(SimPoint(simpt_id=simpt_id, slice_num=slice_num, ctx=self.get_ctx(end)))
         return waypoints
 
+    def dp_search(self, start, slice_num, simpt_id, hit_cost, stop_cost, window=1000):
+        # cheapest chain of waypoints from start to slice_num, every waypoint costs one stop and
+        # every ignored hit of the next breakpoint costs one trap. Nodes are start and the
+        # candidates in start+1..slice_num-1, edges only span up to window slices except the
+        # final one to slice_num
+        end = slice_num
+        first, last = self._cand_range(start + 1, end - 1)
+        ctxs = np.concatenate([[start], self.cand_slices[first:last]])
+        from_rare = np.concatenate([[False], self.cand_rare[first:last]])
+        cost = np.full(len(ctxs), np.inf)
+        prev = np.full(len(ctxs), -1, dtype=np.int64)
+        hits = np.zeros(len(ctxs), dtype=np.int64)
+        cost[0] = 0
+
+        for k in range(len(ctxs) - 1):
+            if cost[k] == np.inf:
+                continue
+            lo, hi = self._cand_range(ctxs[k] + 1, min(ctxs[k] + window, end - 1))
+            if lo >= hi:
+                continue
+            diffs = self._diffs(ctxs[k], lo, hi, from_rare[k])
+            new_cost = np.where(diffs > 0, cost[k] + diffs * hit_cost + stop_cost, np.inf)
+            targets = np.arange(lo, hi) - first + 1
+            better = new_cost < cost[targets]
+            cost[targets[better]] = new_cost[better]
+            prev[targets[better]] = k
+            hits[targets[better]] = diffs[better]
+
+        brk_pc, brk_cnt = self.brk[end]
+        brk_cols = np.full(len(ctxs), self.brk_cols[end])
+        final_diffs = brk_cnt - self.cum.at(brk_cols, ctxs)
+        final_diffs[from_rare & self._unknown(brk_cols, ctxs)] = 0
+        total = np.where(final_diffs > 0, cost + final_diffs * hit_cost, np.inf)
+        k = int(np.argmin(total))
+        assert total[k] < np.inf, f'no path to slice {slice_num}'
+
+        waypoints = []
+        while k > 0:
+            waypoints.append(self._waypoint(first + k - 1, int(hits[k])))
+            k = prev[k]
+        waypoints.reverse()
+        print(f'dp {start}-{end}: {len(waypoints)} waypoints, cost={total.min():.3f}s', file=sys.stderr)
+        waypoints.append(SimPoint(simpt_id=simpt_id, slice_num=slice_num, ctx=self.get_ctx(end)))
+        return waypoints
+
     def get_ctx(self, index):
         # get the context until index (included)
-        if index not in self.ctx_cache:
-            # search for nearest startpoint in cache
-            start_point = min([s for s in self.ctx_cache if s < index], key=lambda x: index - x)
-            self.ctx_cache[index] = self._acc(start_point, index)
-        return self.ctx_cache[index]
-
-    def _acc(self, start, end):
-        # include end
-        accumulator = dict(self.ctx_cache[start])
-        for i in range(start + 1, end + 1):
-            for k, v in self.bbv[i].items():
-                if k in accumulator:
-                    accumulator[k] += v
-                else:
-                    accumulator[k] = v
-        return accumulator
-
-    def bbv_parser(self, fd) -> list:
-        trace = []
-        for line in fd:
-            record = defaultdict(lambda: 0)
-            for bb in line.strip().split():
-                bbid, cnt = list(map(int, bb.split(':')[1:]))
-                record[self.bbid[bbid]] += cnt  # convert bbid to PC
-            trace.append(record)
-        return trace
-
-    @staticmethod
-    def brk_parser(fd) -> list:
-        brks = []
-        for line in fd:
-            pc, cnt = line.strip().split()
-            brks.append((int(pc, base=16), int(cnt)))
-        return brks
-
-    @staticmethod
-    def bbid_parser(fd) -> dict:
-        id_map = {}
-        for line in fd:
-            bbid, pc = line.strip().split()
-            id_map[int(bbid)] = int(pc, base=16)
-        return id_map
-
-
-def simpt_parser(fd) -> list:
-    simpts = []
-    for line in fd:
-        sid, cnt = line.strip().split()
-        simpts.append((int(sid), int(cnt)))
-    return simpts
+        return index
+
+    def _cand_range(self, start, end):
+        # indices of the candidates in slices start..end (included)
+        return (int(np.searchsorted(self.cand_slices, start, side='left')),
+                int(np.searchsorted(self.cand_slices, end, side='right')))
+
+    def _unknown(self, cols, ctxs):
+        # whether slice ctx executed the block, then its count at a stop inside that slice is unknown
+        return self.cum.at(cols, ctxs) != self.cum.at(cols, np.asarray(ctxs) - 1)
+
+    def _diffs(self, ctx, lo, hi, from_rare=False):
+        # hits from ctx until candidates lo..hi-1, non-positive if a candidate is unreachable
+        cols = self.cand_cols[lo:hi]
+        diffs = self.cand_abs[lo:hi] - self.cum.at(cols, ctx)
+        # a stop at an out.brk record is taken as the end of its slice, the first execution of a
+        # rare block lies anywhere inside it. So the executions of a block done by then are only
+        # known if that slice did not execute the block at all, from and to rare waypoints
+        rare = self.cand_rare[lo:hi] | from_rare
+        if rare.any():
+            diffs[rare & self._unknown(cols, ctx)] = 0
+        return diffs
+
+    def _min_diff(self, ctx, start, end, from_rare=False, target_col=-1):
+        # candidate in slices start..end (included) that is the closest one after ctx, a rare one
+        # only if the count of target_col is known from there
+        lo, hi = self._cand_range(start, end)
+        diffs = self._diffs(ctx, lo, hi, from_rare)
+        if target_col >= 0:
+            diffs[self.cand_rare[lo:hi] & self._unknown(np.full(hi - lo, target_col), self.cand_slices[lo:hi])] = 0
+        diffs = np.where(diffs > 0, diffs, np.iinfo(np.int64).max)
+        if hi <= lo or diffs.min() == np.iinfo(np.int64).max:
+            return None, np.inf
+        offset = int(np.argmin(diffs))
+        return lo + offset, int(diffs[offset])
+
+    def _waypoint(self, cand, rel_cnt):
+        slice_num = int(self.cand_slices[cand])
+        return WayPoint(slice_num=slice_num, pc=int(self.cand_pcs[cand]), rel_cnt=rel_cnt,
+                        abs_cnt=int(self.cand_abs[cand]), ctx=self.get_ctx(slice_num))
+
+    def is_rare(self, wp):
+        # whether wp is the first execution of a rare block rather than an out.brk record
+        lo, hi = self._cand_range(wp.slice_num, wp.slice_num)
+        match = (self.cand_pcs[lo:hi] == wp.pc) & (self.cand_abs[lo:hi] == wp.abs_cnt)
+        return bool((match & self.cand_rare[lo:hi]).any() and not (match & ~self.cand_rare[lo:hi]).any())
+
+    def ctx_count(self, ctx, pc, from_rare=False):
+        # number of executions of pc in ctx, or before the slice of ctx for a rare waypoint
+        col = self.bbv.col(pc)
+        assert col < 0 or self.cum.tracks(col), f'{pc:#x} is not a waypoint candidate'
+        if from_rare:
+            assert not self._unknown([col], ctx)[0], f'{pc:#x} runs in slice {ctx} of a rare waypoint'
+            ctx -= 1
+        return int(self.cum.at([col], ctx)[0])
+
+
+class StreamPathFinder:
+    ''' Greedy planner for traces that do not fit in memory.
+
+    out.bb is read once from start to end and only running totals of the out.brk PCs are kept.
+    The greedy chain only moves forward, so every decision is made when the pass reaches its
+    slice. A context is a dict of the counts it was asked for while the pass was there.
+    '''
+
+    def __init__(self, bbv_path, brk_path, bbid_path, cache_dir=None):
+        self.bbv_path = bbv_path
+        self.brk_pcs, self.brk_cnts = load_brk(brk_path, cache_dir)
+        self.brk = list(zip(self.brk_pcs.tolist(), self.brk_cnts.tolist()))
+
+        # running totals only exist for the PCs out.brk may ask for
+        self.pcs = np.unique(self.brk_pcs)
+        self.brk_slots = np.searchsorted(self.pcs, self.brk_pcs)
+        self.totals = np.zeros(len(self.pcs), dtype=np.int64)
+
+        with bbid_path.open() as f:
+            ids, pcs, sizes = bbid_parser(f)
+        slots = np.minimum(np.searchsorted(self.pcs, pcs), max(len(self.pcs) - 1, 0))
+        tracked = self.pcs[slots] == pcs if len(self.pcs) else np.zeros(len(pcs), dtype=bool)
+        self.id2slot = np.full(ids.max() + 1 if len(ids) else 1, -1, dtype=np.int64)
+        self.id2slot[ids[tracked]] = slots[tracked]
+        self.id2size = np.ones(len(self.id2slot), dtype=np.int64)
+        self.id2size[ids] = sizes
+
+    def _chunks(self):
+        # (first slice, row pointers, slots, executions) of the tracked records of every chunk
+        first = 0
+        for nnz, ids, cnts in iter_records(self.bbv_path):
+            slots = self.id2slot[ids]
+            keep = slots >= 0
+            rows = np.repeat(np.arange(len(nnz)), nnz)[keep]
+            indptr = np.searchsorted(rows, np.arange(len(nnz) + 1))
+            yield first, indptr, slots[keep], cnts[keep] // self.id2size[ids[keep]]
+            first += len(nnz)
+
+    def plan(self, segments, threshold=1000000):
+        planner = self._greedy(segments, threshold)
+        done = -1  # totals hold the counts up to the end of this slice
+        try:
+            target = next(planner)
+            for first, indptr, slots, execs in self._chunks():
+                last = first + len(indptr) - 1
+                while target < last:
+                    lo, hi = indptr[done + 1 - first], indptr[target + 1 - first]
+                    np.add.at(self.totals, slots[lo:hi], execs[lo:hi])
+                    done = target
+                    target = planner.send(None)
+                lo, hi = indptr[done + 1 - first], indptr[-1]
+                np.add.at(self.totals, slots[lo:hi], execs[lo:hi])
+                done = last - 1
+        except StopIteration as stop:
+            return stop.value
+        raise AssertionError(f'{self.bbv_path} ends before slice {target}')
+
+    def _greedy(self, segments, threshold):
+        # same choices as PathFinder.binary_search, yields the slice it has to look at next
+        path = []
+        ctx = self.get_ctx(-1)
+        for start, end, simpt_id in segments:
+            brk_cnt = int(self.brk_cnts[end])
+            wp_start = start
+            first = len(path)
+            while brk_cnt - self._record(ctx, self.brk_slots[end]) > threshold and wp_start < end - 1:
+                print(f'searching... {wp_start}-{end-1}, size={len(path) - first}')
+                diffs = self.brk_cnts[wp_start + 1:end] - self.totals[self.brk_slots[wp_start + 1:end]]
+                diffs = np.where(diffs > 0, diffs, np.iinfo(np.int64).max)
+                assert diffs.min() < np.iinfo(np.int64).max, f'no waypoint in slices {wp_start + 1}-{end - 1}'
+                wp_start += 1 + int(np.argmin(diffs))
+                rel_cnt = brk_cnt = int(self.brk_cnts[wp_start])
+                rel_cnt -= self._record(ctx, self.brk_slots[wp_start])
+                yield wp_start
+                ctx = {}
+                path.append(WayPoint(slice_num=wp_start, pc=int(self.brk_pcs[wp_start]), rel_cnt=rel_cnt,
+                                     abs_cnt=brk_cnt, ctx=ctx))
+                brk_cnt = int(self.brk_cnts[end])
+            yield end
+            ctx = {}
+            path.append(SimPoint(simpt_id=simpt_id, slice_num=end, ctx=ctx))
+        return path
+
+    def _record(self, ctx, slot):
+        ctx[int(self.pcs[slot])] = int(self.totals[slot])
+        return ctx[int(self.pcs[slot])]
+
+    def get_ctx(self, index):
+        # only the program start can be looked up, every other context is filled by the pass
+        assert index == -1, 'contexts of a streamed trace are only known to the planner'
+        return defaultdict(int)
+
+    def ctx_count(self, ctx, pc, from_rare=False):
+        assert not from_rare, 'a streamed trace has no rare waypoints'
+        return ctx[pc]
+
+
+def plan_segment(pf, segment, planner='greedy', threshold=1000000, window=1000, profile=None):
+    ''' The waypoints of one simpoint, segment is (start, slice_num, simpt_id). '''
+    start, slice_num, simpt_id = segment
+    if planner == 'dp':
+        return pf.dp_search(start, slice_num, simpt_id, profile.hit_cost, profile.stop_cost, window)
+    return pf.binary_search(start, slice_num, simpt_id, threshold)
+
+
+# the planner inputs of a worker process, set once by init_worker
+_worker_inputs = None
+
+
+def init_worker(pf, *options):
+    global _worker_inputs
+    _worker_inputs = (pf, *options)
+
+
+def plan_in_worker(segment):
+    pf, *options = _worker_inputs
+    return plan_segment(pf, segment, *options)
+
+
+def plan_segments(pf, segments, jobs=1, planner='greedy', threshold=1000000, window=1000, profile=None):
+    ''' plan_segment for every segment, in jobs worker processes if jobs > 1.
+
+    The inputs reach the workers through initargs. A forked worker shares pf with the parent,
+    other start methods pickle it once per worker.
+    '''
+    options = (planner, threshold, window, profile)
+    if jobs <= 1:
+        return [plan_segment(pf, segment, *options) for segment in segments]
+    # fork is only safe on Linux, elsewhere the default start method is used
+    context = multiprocessing.get_context('fork') if sys.platform.startswith('linux') else None
+    with ProcessPoolExecutor(jobs, mp_context=context, initializer=init_worker, initargs=(pf, *options)) as executor:
+        return list(executor.map(plan_in_worker, segments))
 
 
 if __name__ == "__main__":
@@ -158,7 +366,26 @@ if __name__ == "__main__":
     parser.add_argument('-i', '--interval', type=int, help='maximum number of breakpoints', default=300)
     parser.add_argument('-t', '--threshold', type=int, help='maximum ignores', default=1000000)
     parser.add_argument('-T', '--tradition', action='store_true', help='use tradition mode')
+    parser.add_argument('-p', '--planner', choices=['greedy', 'dp'], help='waypoint planner', default='greedy')
+    parser.add_argument('--profile', type=str, help='GDB cost profile from gdb_calibrate.py', default=None)
+    parser.add_argument('--hit-cost', type=float, help='seconds per ignored breakpoint hit, overrides the profile', default=None)
+    parser.add_argument('--stop-cost', type=float, help='seconds per breakpoint stop, overrides the profile', default=None)
+    parser.add_argument('-w', '--window', type=int, help='maximum slices between two waypoints (dp planner)', default=1000)
+    parser.add_argument('-r', '--rare', type=int, help='also try the N least executed blocks of every slice as waypoints', default=0)
+    parser.add_argument('--cache-dir', type=str, help='cache of parsed traces', default=CACHE_DIRNAME)
+    parser.add_argument('--no-cache', action='store_true', help='always parse traces from scratch')
+    parser.add_argument('--report', type=str, help='JSON report of the predicted replay time', default=None)
+    parser.add_argument('-j', '--jobs', type=int, help='number of simpoints planned in parallel', default=1)
+    parser.add_argument('-s', '--stream', action='store_true', help='plan in one pass over out.bb for traces larger than memory')
     args = parser.parse_args()
+    if args.stream and (args.tradition or args.planner != 'greedy' or args.rare or args.jobs > 1):
+        parser.error('--stream only supports the greedy planner without -T, -r and -j')
+    if args.tradition and args.rare:
+        parser.error('-T plans its waypoints without the simpoints, it cannot use -r')
+
+    profile = load_profile(args.profile)
+    profile = profile._replace(hit_cost=profile.hit_cost if args.hit_cost is None else args.hit_cost,
+                               stop_cost=profile.stop_cost if args.stop_cost is None else args.stop_cost)
 
     # load data
     cwd = Path(args.cwd).resolve()
@@ -168,7 +395,12 @@ if __name__ == "__main__":
     simpt_path = cwd / args.simpt
     out_path   = cwd / args.output
 
-    pf = PathFinder(bbv_path, brk_path, bbid_path, args.interval, args)
+    cache_dir  = None if args.no_cache else cwd / args.cache_dir
+
+    if args.stream:
+        pf = StreamPathFinder(bbv_path, brk_path, bbid_path, cache_dir)
+    else:
+        pf = PathFinder(bbv_path, brk_path, bbid_path, args.interval, args, cache_dir, args.rare)
 
     with simpt_path.open() as simpt_in:
         simpts = simpt_parser(simpt_in)
@@ -182,44 +414,58 @@ if __name__ == "__main__":
         else:
             slice_nums.append((simpt_id, slice_num - 1))
 
+    # contexts are looked up directly, so the segment between two simpoints only depends on them
+    segments = []
+    start = -1
+    for simpt_id, slice_num in slice_nums:
+        segments.append((start, slice_num, simpt_id))
+        start = slice_num
+
     if args.tradition:
         path = pf.get_path(slice_nums)
+    elif args.stream:
+        path = pf.plan(segments, args.threshold)
     else:
-        path = []
-        start = -1
-        for simpt_id, slice_num in slice_nums:
-            path.extend(pf.binary_search(start, slice_num, simpt_id, args.threshold))
-            start = slice_num
+        plans = plan_segments(pf, segments, args.jobs, args.planner, args.threshold, args.window, profile)
+        path = [ckpt for plan in plans for ckpt in plan]
 
+    # gdb stops at the (ignore + 1)-th hit of a breakpoint
     skip_cnt = 1
     total_ignore = 0
     for index, ckpt in enumerate(path):
+        prev = path[index - skip_cnt] if index >= skip_cnt else None
+        ctx = pf.get_ctx(-1) if prev is None else prev.ctx
+        from_rare = args.rare > 0 and isinstance(prev, WayPoint) and pf.is_rare(prev)
         if isinstance(ckpt, WayPoint):
-            ctx = defaultdict(lambda: 0) if index == 0 else path[index - skip_cnt].ctx
             brk_pc, brk_cnt = ckpt.pc, ckpt.abs_cnt
-            brk_cnt = brk_cnt - ctx.get(brk_pc, 0)
+            brk_cnt = brk_cnt - pf.ctx_count(ctx, brk_pc, from_rare)
             if brk_cnt > 0:
                 cmds += [f'break * {brk_pc:#x}']
                 if brk_cnt > 1:
-                    cmds.append(f'#ignore@{brk_cnt}')
-                    total_ignore += brk_cnt
+                    cmds.append(f'#ignore@{brk_cnt - 1}')
+                    total_ignore += brk_cnt - 1
                 cmds += ['c', 'delete']
                 skip_cnt = 1
             else:
                 skip_cnt += 1
         elif isinstance(ckpt, SimPoint):
-            ctx = defaultdict(lambda: 0) if index == 0 else path[index - skip_cnt].ctx
             brk_pc, brk_cnt = pf.brk[ckpt.slice_num]
-            print(ckpt.simpt_id, ckpt.slice_num, hex(brk_pc), brk_cnt, ctx.get(brk_pc, 0), file=sys.stderr)
-            brk_cnt = brk_cnt - ctx.get(brk_pc, 0)
+            print(ckpt.simpt_id, ckpt.slice_num, hex(brk_pc), brk_cnt, pf.ctx_count(ctx, brk_pc, from_rare), file=sys.stderr)
+            brk_cnt = brk_cnt - pf.ctx_count(ctx, brk_pc, from_rare)
             assert brk_cnt > 0
             cmds.append(f'break * {brk_pc:#x}')
             if brk_cnt > 1:
-                cmds.append(f'#ignore@{brk_cnt}')
-                total_ignore += brk_cnt
+                cmds.append(f'#ignore@{brk_cnt - 1}')
+                total_ignore += brk_cnt - 1
             cmds += ['c', f'#ckpt@{ckpt.simpt_id}', 'delete']
             skip_cnt = 1
 
-    print(f'Ignore {total_ignore // 1000000}M times in total')
     with out_path.open('w') as f:
         f.write('\n'.join(cmds))
+
+    report = estimate_replay(cmds, profile)
+    print(f"Predicted replay time {report['seconds']:.0f}s", file=sys.stderr)
+    if args.report:
+        with (cwd / args.report).open('w') as f:
+            json.dump(report, f, indent=4)
+    print(f'Ignore {total_ignore // 1000000}M times in total')
@@ -1,100 +1,158 @@
 #! /usr/bin/env python3
 
-from pathlib import Path
-from collections import defaultdict
-
-
-def bbv_parser(fd) -> list:
-    trace = []
-    for line in fd:
-        record = defaultdict(lambda: 0)
-        for bb in line.strip().split():
-            bbid, cnt = list(map(int, bb.split(':')[1:]))
-            record[bbid] += cnt
-        trace.append(record)
-    return trace
-
-
-def brk_parser(fd) -> list:
-    brks = []
-    for line in fd:
-        pc, cnt = line.strip().split()
-        brks.append((int(pc, base=16), int(cnt)))
-    return brks
-
-
-def bbid_parser(fd) -> dict:
-    id_map = {}
-    for line in fd:
-        bbid, pc = line.strip().split()
-        id_map[int(bbid)] = int(pc, base=16)
-    return id_map
-
-
-def simpt_parser(fd) -> list:
-    simpts = []
-    for line in fd:
-        sid, cnt = line.strip().split()
-        simpts.append((int(sid), int(cnt)))
-    return simpts
-
-
-def gdb_sequence_gen(bbv: list, brk: list, bbid_map: dict, simpts: list, max_num: int) -> list:
-    breaks_so_far = defaultdict(lambda: 0)
-
-    def accumulate(start, end):
-        # includes end!!!
-        res = defaultdict(lambda: 0)
-        for index in range(start, end + 1):
-            for k, v in bbv[index]:
-                res[k] += v
-        return res
-
-
-    def search_path(start, end, pc, is_last=False):
-        acc_res = accumulate(start, end)
-        if is_last:
-            assert(pc in acc_res)
-            # cnd = breaks_so_far[pc] -
-            return [f'b * {pc:#x}', '#ignore {}', 'c']
-
-
-    cmds = ['b main', 'r']
-    simpts = sorted(simpts)
-    start_slice = 0
-    for pt in simpts:
-        slice_id = pt - 1
-        if slice_id == -1:  # simpt wants the first
-            cmds.append('#ckpt')
-            continue
-        else:
-            cmds.extend(search_path(start_slice, slice_id, *brk[slice_id]))
-            start_slice = slice_id + 1
-
-
+import sys
+import json
+import numpy as np
 
+from pathlib import Path
 
+from bbv_trace import CACHE_DIRNAME, simpt_parser
+from gdb_gen import PathFinder, SimPoint
+from gdb_plan import estimate_replay, load_profile, parse_cmd
+
+
+def gdb_sequence_gen(pf: PathFinder, path: list, max_num: int, hit_cost, stop_cost) -> list:
+    ''' Turn a PathFinder path into gdb commands that arm up to max_num breakpoints at once.
+
+    At a stop, the next simpoints are armed together as tbreaks with their own ignore counts,
+    so GDB stops at each of them in turn without a break/delete round trip. The last breakpoint
+    of such a batch is where the next batch is armed, the waypoints in between are dropped.
+    Which milestones of path arm a batch is a shortest path, priced like dp_search.
+    '''
+    pcs, cnts, ctxs, rare, simpt_ids = [], [], [], [], []
+    for ckpt in path:
+        if isinstance(ckpt, SimPoint):
+            pc, cnt = pf.brk[ckpt.slice_num]
+            rare.append(False)
+            simpt_ids.append(ckpt.simpt_id)
+        else:
+            pc, cnt = ckpt.pc, ckpt.abs_cnt
+            rare.append(pf.is_rare(ckpt))
+            simpt_ids.append(-1)
+        pcs.append(pc)
+        cnts.append(cnt)
+        ctxs.append(ckpt.ctx)
+
+    # node 0 is the program start, node k + 1 is the stop at path[k]
+    cols = pf.bbv.cols_of(pcs)
+    cnts = np.array(cnts, dtype=np.int64)
+    ctxs = np.array([pf.get_ctx(-1)] + ctxs, dtype=np.int64)
+    rare = np.array(rare, dtype=bool)
+    is_simpt = np.array(simpt_ids) >= 0
+
+    def hits_from(node, first, last):
+        # hits of path[first:last] from the stop at node, non-positive if one is already behind
+        done = pf.cum.at(cols[first:last], ctxs[node])
+        hits = cnts[first:last] - done
+        # same rule as PathFinder._diffs for the first execution of a rare block, as a target or
+        # as the stop at node
+        from_rare = node > 0 and rare[node - 1]
+        hits[(rare[first:last] | from_rare) & (done != pf.cum.at(cols[first:last], ctxs[node] - 1))] = 0
+        return hits
+
+    cost = np.full(len(path) + 1, np.inf)
+    prev = np.full(len(path) + 1, -1, dtype=np.int64)
+    cost[0] = 0
+    for node in range(len(path)):
+        if cost[node] == np.inf:
+            continue
+        # a batch armed at node ends with path[k] and holds every simpoint before it
+        simpts = is_simpt[node:]
+        armed = np.cumsum(simpts) - simpts + 1
+        last = node + int(np.searchsorted(armed, max_num, side='right'))
+        simpts, armed = simpts[:last - node], armed[:last - node]
+        hits = hits_from(node, node, last)
+        behind = simpts & (hits <= 0)
+        simpt_hits = np.where(simpts, hits, 0)
+        edge = (np.cumsum(simpt_hits) - simpt_hits + hits) * hit_cost + armed * stop_cost
+        edge[(hits <= 0) | (np.cumsum(behind) - behind > 0)] = np.inf
+        targets = np.arange(node, last) + 1
+        better = cost[node] + edge < cost[targets]
+        cost[targets[better]] = cost[node] + edge[better]
+        prev[targets[better]] = node
+    assert cost[-1] < np.inf, 'no batch reaches the last simpoint'
+
+    nodes = [len(path)]
+    while nodes[-1] > 0:
+        nodes.append(int(prev[nodes[-1]]))
+    nodes.reverse()
+
+    cmds = []
+    for node, end in zip(nodes, nodes[1:]):
+        batch = [k for k in range(node, end - 1) if is_simpt[k]] + [end - 1]
+        hits = hits_from(node, node, end)[np.array(batch) - node]
+        for k, hit in zip(batch, hits):
+            cmds.append(f'tbreak * {pcs[k]:#x}')
+            if hit > 1:
+                cmds.append(f'#ignore@{hit - 1}')
+        # gdb deletes a tbreak when it stops there, the rest keep counting down
+        for k in batch:
+            cmds.append('c')
+            if is_simpt[k]:
+                cmds.append(f'#ckpt@{simpt_ids[k]}')
+    print(f'{len(nodes) - 1} batches, {cmds.count("c")} stops, cost={cost[-1]:.3f}s', file=sys.stderr)
+    return cmds
 
 
 if __name__ == "__main__":
     import argparse
     parser = argparse.ArgumentParser()
-    parser.add_argument('bbv', type=str, help='path to bbv')
-    parser.add_argument('brk', type=str, help='path to glibc function black list', default=str(Path(__file__).parent / 'libc.symbols'))
-    parser.add_argument('bbid', type=str, help='path to the output file', default='white.list')
+    parser.add_argument('--bbv', type=str, help='path to bbv', default='out.bb')
+    parser.add_argument('--brk', type=str, help='path to the breakpoints of every slice', default='out.brk')
+    parser.add_argument('--bbid', type=str, help='path to the basic block ids', default='out.bbid')
+    parser.add_argument('--simpt', type=str, help='path to the simpoints', default='results.simpts')
+    parser.add_argument('--output', type=str, help='gdb commands', default='gdb.cmd')
     parser.add_argument('-d', '--cwd', type=str, help='current work directory', default='.')
     parser.add_argument('-m', '--max-num', type=int, help='maximum number of breakpoints', default=10)
+    parser.add_argument('-t', '--threshold', type=int, help='maximum ignores (greedy planner)', default=1000000)
+    parser.add_argument('-p', '--planner', choices=['greedy', 'dp'], help='planner of the waypoints', default='dp')
+    parser.add_argument('--profile', type=str, help='GDB cost profile from gdb_calibrate.py', default=None)
+    parser.add_argument('--hit-cost', type=float, help='seconds per ignored breakpoint hit, overrides the profile', default=None)
+    parser.add_argument('--stop-cost', type=float, help='seconds per breakpoint stop, overrides the profile', default=None)
+    parser.add_argument('-w', '--window', type=int, help='maximum slices between two waypoints (dp planner)', default=1000)
+    parser.add_argument('-r', '--rare', type=int, help='also try the N least executed blocks of every slice as waypoints', default=0)
+    parser.add_argument('--cache-dir', type=str, help='cache of parsed traces', default=CACHE_DIRNAME)
+    parser.add_argument('--no-cache', action='store_true', help='always parse traces from scratch')
+    parser.add_argument('--report', type=str, help='JSON report of the predicted replay time', default=None)
+    parser.set_defaults(tradition=False)
     args = parser.parse_args()
+    assert args.max_num > 0
 
-    # load data
-    bbv_path = Path(args.cwd) / args.bbv
-    brk_path = Path(args.cwd) / args.brk
-    bbid_path = Path(args.cwd) / args.bbid
-
-    with bbv_path.open() as bbv_in, brk_path.open() as brk_in, bbid_path.open() as bbid_in:
-        bbv = bbv_parser(bbv_in)
-        brk = brk_parser(brk_in)
-        bbid = bbid_parser(brk_in)
-
-
+    profile = load_profile(args.profile)
+    profile = profile._replace(hit_cost=profile.hit_cost if args.hit_cost is None else args.hit_cost,
+                               stop_cost=profile.stop_cost if args.stop_cost is None else args.stop_cost)
 
+    # load data
+    cwd = Path(args.cwd).resolve()
+    cache_dir = None if args.no_cache else cwd / args.cache_dir
+    pf = PathFinder(cwd / args.bbv, cwd / args.brk, cwd / args.bbid, 0, args, cache_dir, args.rare)
+
+    with (cwd / args.simpt).open() as f:
+        simpts = sorted(simpt_parser(f))
+
+    # the milestones are the sequential path, the batches are planned on top of it
+    cmds = []
+    path = []
+    start = -1
+    for slice_num, simpt_id in simpts:
+        if slice_num == 0:
+            cmds.append(f'#ckpt@{simpt_id}')
+            continue
+        if args.planner == 'dp':
+            path += pf.dp_search(start, slice_num - 1, simpt_id, profile.hit_cost, profile.stop_cost, args.window)
+        else:
+            path += pf.binary_search(start, slice_num - 1, simpt_id, args.threshold)
+        start = slice_num - 1
+    if path:
+        cmds += gdb_sequence_gen(pf, path, args.max_num, profile.hit_cost, profile.stop_cost)
+
+    with (cwd / args.output).open('w') as f:
+        f.write('\n'.join(cmds))
+
+    report = estimate_replay(cmds, profile)
+    print(f"Predicted replay time {report['seconds']:.0f}s", file=sys.stderr)
+    if args.report:
+        with (cwd / args.report).open('w') as f:
+            json.dump(report, f, indent=4)
+    total_ignore = sum(int(params[-1]) for action, params in map(parse_cmd, cmds) if action == 'ignore')
+    print(f'Ignore {total_ignore // 1000000}M times in total')
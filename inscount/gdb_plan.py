@@ -0,0 +1,90 @@
+#! /usr/bin/env python3
+
+import sys
+import json
+import socket
+
+from pathlib import Path
+from collections import namedtuple
+
+
+CostProfile = namedtuple('CostProfile', 'hit_cost stop_cost')
+
+# used until gdb_calibrate.py has measured this machine
+DEFAULT_COSTS = CostProfile(hit_cost=2e-5, stop_cost=1e-2)
+DEFAULT_PROFILE = Path.home() / '.cache' / 'powertools' / f'gdb-profile-{socket.gethostname()}.json'
+
+
+def load_profile(path=None) -> CostProfile:
+    path = Path(path) if path else DEFAULT_PROFILE
+    if not path.exists():
+        print(f'No GDB cost profile at {path}, using defaults', file=sys.stderr)
+        return DEFAULT_COSTS
+    with path.open() as f:
+        profile = json.load(f)
+    return CostProfile(hit_cost=profile['hit_cost'], stop_cost=profile['stop_cost'])
+
+
+def parse_cmd(cmd):
+    # '#action@arg@...' lines are handled by GDBOnly itself, the rest goes straight to gdb
+    cmd = cmd.strip()
+    if cmd.startswith('#'):
+        action, *args = cmd[1:].split('@')
+        return action, args
+    return cmd.split()[0] if cmd else '', cmd.split()[1:]
+
+
+def estimate_replay(cmds, profile: CostProfile) -> dict:
+    ''' Predict how long GDBOnly takes to replay a gdb.cmd plan.
+
+    A breakpoint traps (ignore + 1) times into gdb before it stops and hands control back to
+    the engine. Armed breakpoints stop in the order they were set, so every 'c' is charged the
+    traps of the next one. The time until a '#ckpt@' is charged to that simpoint.
+    '''
+    simpts = []
+    hits, stops = 0, 0
+    armed = []
+    for cmd in cmds:
+        action, args = parse_cmd(cmd)
+        if action in ('break', 'b', 'tbreak'):
+            armed.append(1)
+        elif action == 'ignore' and armed:
+            armed[-1] = int(args[-1]) + 1
+        elif action == 'c':
+            hits += armed.pop(0) if armed else 0
+            stops += 1
+        elif action == 'delete':
+            armed = []
+        elif action == 'ckpt':
+            simpts.append({
+                'simpt': int(args[0]),
+                'hits': hits,
+                'stops': stops,
+                'seconds': hits * profile.hit_cost + stops * profile.stop_cost
+            })
+            hits, stops = 0, 0
+    return {
+        'hit_cost': profile.hit_cost,
+        'stop_cost': profile.stop_cost,
+        'seconds': sum(s['seconds'] for s in simpts),
+        'simpts': simpts
+    }
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('plan', type=str, help='path to gdb.cmd')
+    parser.add_argument('--profile', type=str, help='GDB cost profile', default=None)
+    parser.add_argument('-o', '--output', type=str, help='JSON report', default=None)
+    args = parser.parse_args()
+
+    with open(args.plan) as f:
+        report = estimate_replay(f, load_profile(args.profile))
+
+    for s in report['simpts']:
+        print(f"simpt {s['simpt']:>3}: {s['seconds']:>10.1f}s, {s['stops']} stops, {s['hits']} hits")
+    print(f"Predicted replay time {report['seconds']:.1f}s")
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=4)
@@ -0,0 +1,177 @@
+#! /usr/bin/env python3
+
+# Replays a gdb.cmd plan against the BBV trace to check that every checkpoint lands on its
+# simpoint, so a bad plan is caught before hours of GDBOnly.py
+
+import sys
+import numpy as np
+
+from pathlib import Path
+from collections import namedtuple
+
+sys.path.append(str(Path(__file__).parent))
+
+from bbv_trace import CACHE_DIRNAME, BBVTrace, CumulativeIndex, cached, load_brk, simpt_parser
+from gdb_plan import parse_cmd
+
+# a stop is only known up to a range: hit_lo..hit_hi is the hit of pc it happens at, somewhere
+# in slices slice_lo..slice_hi, inst is the estimated number of instructions executed until hit_hi
+Stop = namedtuple('Stop', 'line pc hit_lo hit_hi slice_lo slice_hi inst')
+BREAKS = ('break', 'b', 'tbreak')
+
+
+def _break_pc(args):
+    # 'break * 0x401000' and 'break *0x401000' are the same breakpoint, symbols cannot be simulated
+    arg = ''.join(args)
+    return int(arg[1:], base=16) if arg.startswith('*') else None
+
+
+def simulate(cmds, bbv: BBVTrace, lengths, brk):
+    ''' Run a gdb.cmd plan on the BBV trace, returns the stop of every '#ckpt@', errors and warnings.
+
+    The trace only knows how often a block ran in every slice. A stop at the out.brk record of
+    a slice is taken as the end of that slice, like the planners do, bbv.cpp records it close
+    to there. Any other stop, like the first execution of a rare block, lies anywhere inside its
+    slices, so the hits of the next breakpoint done before it are only known to lie between the
+    counts at the ends of those slices. That is an error unless those slices never ran the
+    block. A breakpoint counts its hits from the stop it was armed at, whichever armed
+    breakpoint is reached first stops the program.
+    '''
+    cmds = [cmd for cmd in cmds if cmd.strip()]
+    pcs = [_break_pc(args) for action, args in map(parse_cmd, cmds) if action in BREAKS]
+    cum = CumulativeIndex.build(bbv, bbv.cols_of([pc for pc in pcs if pc is not None]))
+    starts = np.cumsum(lengths) - lengths
+
+    ckpts, errors, warnings = [], [], []
+    active = {}  # breakpoint number -> [pc, ignore count, temporary, hit range it stops at]
+    number = 0
+    slice_lo, slice_hi = 0, -1  # the program start: nothing has been executed yet
+    at_end = True
+    stop = None
+    for line, cmd in enumerate(cmds, 1):
+        action, args = parse_cmd(cmd)
+        if action in BREAKS:
+            pc = _break_pc(args)
+            if pc is None:
+                errors.append(f'line {line}: cannot simulate "{cmd.strip()}"')
+                break
+            number += 1
+            active[number] = [pc, 0, action == 'tbreak', None]
+        elif action == 'ignore':
+            # '#ignore@<n>' applies to the last breakpoint, 'ignore <number> <n>' is plain gdb
+            bp, count = (number, args[0]) if len(args) == 1 else args
+            active[int(bp)][1] = int(count)
+            active[int(bp)][3] = None
+        elif action == 'delete':
+            for bp in args or list(active):
+                active.pop(int(bp), None)
+        elif action in ('c', 'continue'):
+            if not active:
+                errors.append(f'line {line}: continue without breakpoints, the program exits')
+                break
+            numbers = list(active)
+            cols = bbv.cols_of([active[bp][0] for bp in numbers])[:, None]
+            unknown = []
+            for bp, col in zip(numbers, cols):
+                if active[bp][3] is None:
+                    done = cum.at([col[0], col[0]], [slice_hi if at_end else slice_lo - 1, slice_hi])
+                    if not at_end and done[0] != done[1]:
+                        unknown.append(f'{active[bp][0]:#x}')
+                    active[bp][3] = done + active[bp][1] + 1
+            if unknown:
+                errors.append(f'line {line}: {", ".join(unknown)} ran in slices {slice_lo}-{slice_hi}, the hits '
+                              f'before the stop at line {stop.line} inside them are unknown')
+                break
+            hits = np.array([active[bp][3] for bp in numbers])
+            reached = cum.reaching(cols, hits)
+            first = int(np.argmin(reached[:, 1]))
+            if reached[first].max() >= len(bbv):
+                pc, hit = active[numbers[first]][0], hits[first].max()
+                errors.append(f'line {line}: {pc:#x} may be hit less than {hit} times, the program exits')
+                break
+            for other in np.flatnonzero(reached[:, 0] <= reached[first, 1]):
+                if other != first:
+                    warnings.append(f'line {line}: breakpoint {numbers[other]} may stop before {numbers[first]}')
+
+            pc, col, hits = active[numbers[first]][0], cols[first, 0], hits[first]
+            slice_lo, slice_hi = (int(s) for s in reached[first])
+            before, after = cum.at([col, col], [slice_hi - 1, slice_hi])
+            inst = starts[slice_hi] + lengths[slice_hi] * (hits[1] - before) // max(after - before, 1)
+            stop = Stop(line=line, pc=pc, hit_lo=int(hits[0]), hit_hi=int(hits[1]),
+                        slice_lo=slice_lo, slice_hi=slice_hi, inst=int(inst))
+            at_end = slice_lo == slice_hi < len(brk) and brk[slice_hi] == (pc, hits[0]) and hits[0] == hits[1]
+            if active[numbers[first]][2]:
+                del active[numbers[first]]
+            else:
+                active[numbers[first]][3] = hits + 1
+        elif action == 'ckpt':
+            ckpts.append((int(args[0]), stop))
+    return ckpts, errors, warnings
+
+
+def verify(ckpts, brk, simpts):
+    # a simpoint in slice n is checkpointed at the out.brk record of slice n - 1, slice 0 at the start
+    errors, warnings = [], []
+    expected = {simpt_id: slice_num for slice_num, simpt_id in simpts}
+    for simpt_id, stop in ckpts:
+        if simpt_id not in expected:
+            errors.append(f'#ckpt@{simpt_id} is not a simpoint or is taken twice')
+            continue
+        slice_num = expected.pop(simpt_id)
+        if slice_num == 0 or stop is None:
+            if slice_num != 0 or stop is not None:
+                errors.append(f'simpt {simpt_id}: slice {slice_num} checkpointed ' +
+                              ('at the program start' if stop is None else f'at line {stop.line}'))
+            continue
+        pc, cnt = brk[slice_num - 1]
+        where = f'hit {stop.hit_lo}-{stop.hit_hi} of {stop.pc:#x} in slices {stop.slice_lo}-{stop.slice_hi}'
+        if stop.pc != pc or not stop.hit_lo <= cnt <= stop.hit_hi:
+            errors.append(f'simpt {simpt_id}: stops at {where}, expected hit {cnt} of {pc:#x} in slice {slice_num - 1}')
+        elif stop.hit_lo != stop.hit_hi:
+            warnings.append(f'simpt {simpt_id}: may stop at {where}')
+    for simpt_id in expected:
+        errors.append(f'simpt {simpt_id} is never checkpointed')
+    return errors, warnings
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--bbv', type=str, help='path to bbv', default='out.bb')
+    parser.add_argument('--brk', type=str, help='path to the breakpoints of every slice', default='out.brk')
+    parser.add_argument('--bbid', type=str, help='path to the basic block ids', default='out.bbid')
+    parser.add_argument('--simpt', type=str, help='path to the simpoints', default='results.simpts')
+    parser.add_argument('--plan', type=str, help='gdb commands', default='gdb.cmd')
+    parser.add_argument('-d', '--cwd', type=str, help='current work directory', default='.')
+    parser.add_argument('--cache-dir', type=str, help='cache of parsed traces', default=CACHE_DIRNAME)
+    parser.add_argument('--no-cache', action='store_true', help='always parse traces from scratch')
+    args = parser.parse_args()
+
+    cwd = Path(args.cwd).resolve()
+    bbv_path  = cwd / args.bbv
+    bbid_path = cwd / args.bbid
+    cache_dir = None if args.no_cache else cwd / args.cache_dir
+
+    bbv = BBVTrace.load(bbv_path, bbid_path, cache_dir)
+    lengths = cached(cache_dir, 'insts', [bbv_path, bbid_path], lambda: {'lengths': bbv.slice_lengths()})['lengths']
+    brk = list(zip(*(a.tolist() for a in load_brk(cwd / args.brk, cache_dir))))
+    with (cwd / args.simpt).open() as f:
+        simpts = simpt_parser(f)
+    with (cwd / args.plan).open() as f:
+        ckpts, errors, sim_warnings = simulate(list(f), bbv, lengths, brk)
+
+    for simpt_id, stop in ckpts:
+        if stop is None:
+            print(f'simpt {simpt_id:>3}: program start')
+        else:
+            print(f'simpt {simpt_id:>3}: line {stop.line}, slice {stop.slice_lo}-{stop.slice_hi}, '
+                  f'hit {stop.hit_lo}-{stop.hit_hi} of {stop.pc:#x}, ~{stop.inst / 1e6:.0f}M instructions')
+    verify_errors, warnings = verify(ckpts, brk, simpts)
+    warnings = sim_warnings + warnings
+    for warning in warnings:
+        print(f'warning: {warning}', file=sys.stderr)
+    for error in errors + verify_errors:
+        print(f'error: {error}', file=sys.stderr)
+    if errors or verify_errors:
+        sys.exit(1)
+    print(f'{len(ckpts)} checkpoints verified, {len(warnings)} uncertain')
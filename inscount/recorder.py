@@ -1,11 +1,16 @@
 #! /usr/bin/env python3
 import os
-import re
+import sys
 import git
 import datetime
 
 from pathlib import Path
 
+sys.path.append(str(Path(__file__).resolve().parent.parent / 'lapi-plus'))
+from CheckpointTemplate import MemoryMapping, PageTable, fill_checkpoint_template
+from MemoryImage import compress_memory_image
+from ProcMaps import ProcMaps
+
 
 DEFAULT_REGS = {
     'CR0': 2147483699,
@@ -30,22 +35,20 @@ DEFAULT_REGS = {
 }
 
 PAGE_SIZE = 4 * 1024
+MEM_SIZE = 4 * 1024**3
 
 
 def parse_map(args):
     pid = args.pid
     root_dir = args.root_dir
-    pattern = "\\s*([0-9a-f]+)-([0-9a-f]+)\\s+[^\\s]+\\s+[^\\s]+\\s+[^\\s]+\\s+[^\\s]+\\s*([^\\s]*)"
     print(root_dir)
-    with open(f'/proc/{pid}/maps') as f, open(root_dir / 'map.out', 'w') as out:
-        for line in f:
-            match = re.findall(pattern, line)
-            if len(match) == 1:
-                start = int(match[0][0], base=16)
-                end = int(match[0][1], base=16)
-                path = match[0][2]
-                if start < 0x7fff00000000 or path in {'[vvar]', '[vdso]', '[stack]'}:
-                    out.write(f'{start:#x} {end:#x} {path}\n')
+    maps = ProcMaps.read(pid)
+    with open(root_dir / 'map.out', 'w') as out:
+        for start, end, name in zip(maps.starts.tolist(), maps.ends.tolist(), maps.names):
+            # map.out is split on whitespace, ' (deleted)' and the like are dropped
+            path = name.split(maxsplit=1)[0] if name else ''
+            if start < 0x7fff00000000 or path in {'[vvar]', '[vdso]', '[stack]'}:
+                out.write(f'{start:#x} {end:#x} {path}\n')
 
 
 def convert_from_raw(args):
@@ -76,50 +79,43 @@ def convert_from_raw(args):
                 stack_start = mappings[-1][0]
                 stack_end = mappings[-1][1]
 
-    page_table = []
     paddr = 0
-    for seg in mappings:
-        for vaddr in range(seg[0], seg[1], PAGE_SIZE):
-            page_table.append((vaddr, paddr))
-            paddr += PAGE_SIZE
-
-    page_table_str = []
-    for idx, (vaddr, paddr) in enumerate(page_table):
-        page_table_str.append(
-            f'[system.cpu.workload.Entry{idx}]\n'
-            f'vaddr={vaddr}\n'
-            f'paddr={paddr}\n'
-            f'flags=0\n'
-        )
+    page_table = []
+    for index, (start, end, path) in enumerate(mappings):
+        page_table.append(MemoryMapping(index, paddr, start, end - start, 0, 0, path))
+        paddr += (end - start + PAGE_SIZE - 1) // PAGE_SIZE * PAGE_SIZE
+    page_table = PageTable(page_table, PAGE_SIZE)
 
     repo = git.Repo(path=__file__, search_parent_directories=True)
     repo_head = repo.head.object.hexsha
 
-    with open(Path(__file__).parent / 'm5-2.cpt.template') as fin:
-        with open(root_dir / 'm5.cpt', 'w') as out:
-            text = fin.read()
-            text = text.format(
-                timeNow=str(datetime.datetime.now(datetime.timezone.utc)),
-                repoHEAD=repo_head,
-                fp_regs=get_fp_str(regvals),
-                int_regs=get_int_str(regvals),
-                pc=regvals['PC'],
-                npc=regvals['NPC'],
-                sbrk=regvals['SBRK'],
-                stack_base=stack_end,
-                stack_size=stack_end - stack_start,
-                stack_min=stack_start,
-                pagetable_size=len(page_table),
-                page_table='\n'.join(page_table_str),
-                isa_regs=get_isa_str(regvals),
-                mem_size=4*1024*1024*1024
-            )
-            out.write(text)
-
-    pmem_path = root_dir / 'system.physmem.store0.pmem'
-    os.system(f'truncate -s4294967296 {pmem_path}')
-    os.system(f'gzip {pmem_path}')
-    os.system(f'mv {pmem_path}.gz {pmem_path}')
+    fill_checkpoint_template(
+        root_dir / 'm5.cpt',
+        template_path=Path(__file__).parent / 'm5-2.cpt.template',
+        timeNow=str(datetime.datetime.now(datetime.timezone.utc)),
+        repoHEAD=repo_head,
+        fp_regs=get_fp_str(regvals),
+        int_regs=get_int_str(regvals),
+        pc=regvals['PC'],
+        npc=regvals['NPC'],
+        sbrk=regvals['SBRK'],
+        stack_base=stack_end,
+        stack_size=stack_end - stack_start,
+        stack_min=stack_start,
+        mappings=page_table,
+        isa_regs=get_isa_str(regvals),
+        mem_size=4*1024*1024*1024
+    )
+
+    compress_pmem(root_dir / 'system.physmem.store0.pmem', MEM_SIZE)
+
+
+def compress_pmem(pmem_path, mem_size):
+    # recorder.cpp has written the memory of the process into pmem, pad it to mem_size and gzip it
+    raw_path = Path(str(pmem_path) + '.raw')
+    Path(pmem_path).rename(raw_path)
+    compress_memory_image(raw_path, pmem_path, size=mem_size)
+    raw_path.unlink()
 
 
 def get_int_str(regvals: dict):
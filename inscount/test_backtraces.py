@@ -0,0 +1,11 @@
+import sys
+import subprocess
+
+from pathlib import Path
+
+
+def test_runs_without_numpy():
+    # backtraces.py runs in the Python of GDB, which may not have numpy
+    script = ('import sys, types; sys.modules["numpy"] = None; sys.modules["gdb"] = types.ModuleType("gdb"); '
+              f'sys.path.insert(0, {str(Path(__file__).parent)!r}); import backtraces')
+    subprocess.run([sys.executable, '-c', script], check=True)
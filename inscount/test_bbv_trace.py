@@ -0,0 +1,134 @@
+import os
+
+import numpy as np
+
+from bbv_trace import BBVTrace, CumulativeIndex, bbid_parser, brk_parser, cached, load_brk, simpt_parser
+
+# three blocks of 2, 1 and 3 instructions, out.bb counts instructions, not executions
+BBID = '0 0x401100 2\n1 0x401000 1\n2 0x401200 3\n'
+BBV = 'T:0:4 :1:3 \nT:2:6 \nT:1:1 :0:2 :2:3 \n'
+
+
+def write_trace(cwd, bbv=BBV, bbid=BBID):
+    (cwd / 'out.bb').write_text(bbv)
+    (cwd / 'out.bbid').write_text(bbid)
+    return BBVTrace.parse(cwd / 'out.bb', cwd / 'out.bbid')
+
+
+def test_parse(tmp_path):
+    trace = write_trace(tmp_path)
+    assert len(trace) == 3
+    assert trace.pcs.tolist() == [0x401000, 0x401100, 0x401200]
+    assert trace.sizes.tolist() == [1, 2, 3]
+    rows = [dict(zip(*(a.tolist() for a in trace.row(i)))) for i in range(len(trace))]
+    assert rows == [{1: 2, 0: 3}, {2: 2}, {0: 1, 1: 1, 2: 1}]
+    assert trace.slice_lengths().tolist() == [7, 6, 6]
+
+
+def test_cols_of(tmp_path):
+    trace = write_trace(tmp_path)
+    assert trace.cols_of([0x401200, 0x401000, 0x401300]).tolist() == [2, 0, -1]
+    assert trace.col(0x401100) == 1
+
+
+def test_accumulate(tmp_path):
+    trace = write_trace(tmp_path)
+    assert trace.accumulate(1, 2, np.zeros(trace.num_pcs, dtype=np.int64)).tolist() == [1, 1, 3]
+
+
+def test_parse_chunks(tmp_path, monkeypatch):
+    # chunks are cut at line ends, a slice never spans two of them
+    monkeypatch.setattr('bbv_trace.CHUNK_SIZE', 8)
+    trace = write_trace(tmp_path)
+    assert trace.indptr.tolist() == [0, 2, 3, 6]
+    assert trace.counts.tolist() == [2, 3, 2, 1, 1, 1]
+
+
+def test_two_column_bbid(tmp_path):
+    trace = write_trace(tmp_path, bbid='0 0x401100\n1 0x401000\n2 0x401200\n')
+    assert trace.row(1)[1].tolist() == [6]
+
+
+def test_parsers():
+    ids, pcs, sizes = bbid_parser(BBID.splitlines())
+    assert (ids.tolist(), pcs.tolist(), sizes.tolist()) == ([0, 1, 2], [0x401100, 0x401000, 0x401200], [2, 1, 3])
+    pcs, cnts = brk_parser(['401000 3\n', '401200 2\n'])
+    assert (pcs.tolist(), cnts.tolist()) == ([0x401000, 0x401200], [3, 2])
+    assert simpt_parser(['0 1\n', '2 0\n']) == [(0, 1), (2, 0)]
+
+
+def dense(trace):
+    # executions of every column up to the end of every slice, row 0 is the program start
+    counts = np.zeros((len(trace) + 1, trace.num_pcs), dtype=np.int64)
+    for i in range(len(trace)):
+        cols, cnts = trace.row(i)
+        counts[i + 1] = counts[i]
+        counts[i + 1, cols] += cnts
+    return counts
+
+
+def test_cumulative_counts(tmp_path):
+    trace = write_trace(tmp_path)
+    cum = CumulativeIndex.build(trace, [0, 2])
+    assert cum.at([0, 0, 0, 0], [-1, 0, 1, 2]).tolist() == [0, 3, 3, 4]
+    assert cum.at([2, 2, 2], [0, 1, 2]).tolist() == [0, 2, 3]
+    assert cum.tracks(2) and not cum.tracks(1)
+    # an untracked or unknown column has no executions
+    assert cum.at([1, -1], [2, 2]).tolist() == [0, 0]
+
+
+def test_reaching(tmp_path):
+    trace = write_trace(tmp_path)
+    cum = CumulativeIndex.build(trace, [0, 2])
+    assert cum.reaching([0, 0, 0, 2, 2], [1, 4, 5, 1, 3]).tolist() == [0, 2, 3, 1, 2]
+
+
+def test_cumulative_against_dense(program, tmp_path):
+    program.write(tmp_path, [0])
+    trace = BBVTrace.parse(tmp_path / 'out.bb', tmp_path / 'out.bbid')
+    counts = dense(trace)
+    cols = np.arange(0, trace.num_pcs, 2)
+    cum = CumulativeIndex.build(trace, cols)
+    slices = np.arange(-1, len(trace))
+    for col in cols:
+        assert (cum.at(np.full(len(slices), col), slices) == counts[:, col]).all()
+
+
+def test_cached(tmp_path):
+    source = tmp_path / 'out.brk'
+    source.write_text('401000 3\n')
+    builds = []
+
+    def build():
+        builds.append(source.read_text())
+        return {'lines': np.array([len(builds)])}
+
+    cache_dir = tmp_path / 'cache'
+    assert cached(cache_dir, 'brk', [source], build)['lines'].tolist() == [1]
+    assert cached(cache_dir, 'brk', [source], build)['lines'].tolist() == [1]
+    # a touched file with the same content keeps its cache
+    os.utime(source, ns=(0, 0))
+    assert cached(cache_dir, 'brk', [source], build)['lines'].tolist() == [1]
+    source.write_text('401000 4\n')
+    assert cached(cache_dir, 'brk', [source], build)['lines'].tolist() == [2]
+    # a file of the same size rewritten in the middle is parsed again
+    source.write_text('401000 3\n' * 400000)
+    assert cached(cache_dir, 'brk', [source], build)['lines'].tolist() == [3]
+    content = source.read_bytes()
+    mtime = source.stat().st_mtime_ns
+    source.write_bytes(content[:1800000] + b'5' + content[1800001:])
+    os.utime(source, ns=(mtime + 10**9, mtime + 10**9))
+    assert cached(cache_dir, 'brk', [source], build)['lines'].tolist() == [4]
+    assert len(builds) == 4
+
+
+def test_load_from_cache(tmp_path):
+    trace = write_trace(tmp_path)
+    (tmp_path / 'out.brk').write_text('401000 3\n401200 2\n')
+    for _ in range(2):
+        loaded = BBVTrace.load(tmp_path / 'out.bb', tmp_path / 'out.bbid', tmp_path / 'cache')
+        for key in ('indptr', 'cols', 'counts', 'pcs', 'sizes'):
+            assert (getattr(loaded, key) == getattr(trace, key)).all()
+        pcs, cnts = load_brk(tmp_path / 'out.brk', tmp_path / 'cache')
+        assert (pcs.tolist(), cnts.tolist()) == ([0x401000, 0x401200], [3, 2])
+    assert isinstance(loaded.counts, np.memmap)
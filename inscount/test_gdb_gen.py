@@ -0,0 +1,79 @@
+import sys
+import types
+import subprocess
+import multiprocessing
+
+from pathlib import Path
+
+import pytest
+
+from concurrent.futures import ProcessPoolExecutor
+
+from conftest import Program
+from gdb_gen import PathFinder, init_worker, plan_in_worker, plan_segment
+from gdb_plan import CostProfile, estimate_replay
+
+GDB_GEN = Path(__file__).parent / 'gdb_gen.py'
+SIMPTS = [0, 9, 17, 26, 33, 45, 58]
+
+
+def plan(program, cwd, *options):
+    program.write(cwd, SIMPTS)
+    subprocess.run([sys.executable, GDB_GEN, '-d', cwd, '--hit-cost', '1e-3', '--stop-cost', '1e-2', *options],
+                   check=True, capture_output=True)
+    return (cwd / 'gdb.cmd').read_text().splitlines()
+
+
+@pytest.mark.parametrize('options', [
+    ('-p', 'greedy', '-t', '50'),
+    ('-p', 'greedy', '-t', '50', '-r', '3'),
+    ('-p', 'dp'),
+    ('-p', 'dp', '-r', '3'),
+])
+def test_checkpoints_land_on_out_brk(program, tmp_path, options):
+    cmds = plan(program, tmp_path, *options)
+    assert program.replay(cmds) == program.expected(SIMPTS)
+
+
+def test_rare_waypoints_are_used(program, tmp_path):
+    # the plans above only cover rare waypoints if the planner takes some
+    cmds = plan(program, tmp_path, '-p', 'dp', '-r', '3')
+    rare = {f'break * {pc:#x}' for pc in program.rare}
+    assert rare & set(cmds)
+
+
+def test_dp_is_no_slower_than_greedy(program, tmp_path):
+    # greedy chains are paths of the dp graph too, dp finds the cheapest one
+    profile = CostProfile(hit_cost=1e-3, stop_cost=1e-2)
+    dp = estimate_replay(plan(program, tmp_path, '-p', 'dp'), profile)
+    for threshold in ('20', '50', '200'):
+        greedy = estimate_replay(plan(program, tmp_path, '-p', 'greedy', '-t', threshold), profile)
+        assert dp['seconds'] <= greedy['seconds'] + 1e-9
+
+
+def test_stream_plans_like_greedy(program, tmp_path, monkeypatch):
+    # one pass over out.bb in tiny chunks makes the same choices as the in-memory greedy planner
+    greedy = plan(program, tmp_path, '-p', 'greedy', '-t', '50', '--no-cache')
+    monkeypatch.setenv('BBV_CHUNK_SIZE', '512')
+    stream = plan(program, tmp_path, '--stream', '-t', '50', '--no-cache')
+    assert stream == greedy
+    assert program.replay(stream) == program.expected(SIMPTS)
+
+
+def test_jobs_plan_like_one_process(program, tmp_path):
+    serial = plan(program, tmp_path, '-p', 'dp', '-r', '3')
+    assert plan(program, tmp_path, '-p', 'dp', '-r', '3', '-j', '3') == serial
+
+
+def test_spawned_workers(tmp_path):
+    # workers get the planner through initargs, they do not need fork or the globals of __main__
+    program = Program(0)
+    program.write(tmp_path, SIMPTS)
+    pf = PathFinder(tmp_path / 'out.bb', tmp_path / 'out.brk', tmp_path / 'out.bbid', 300,
+                    types.SimpleNamespace(tradition=False), rare=3)
+    segments = list(zip([-1] + [s - 1 for s in SIMPTS[1:-1]], [s - 1 for s in SIMPTS[1:]], range(1, len(SIMPTS))))
+    options = ('dp', 1000000, 1000, CostProfile(hit_cost=1e-3, stop_cost=1e-2))
+    with ProcessPoolExecutor(2, mp_context=multiprocessing.get_context('spawn'),
+                             initializer=init_worker, initargs=(pf, *options)) as executor:
+        spawned = list(executor.map(plan_in_worker, segments))
+    assert spawned == [plan_segment(pf, segment, *options) for segment in segments]
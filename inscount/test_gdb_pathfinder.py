@@ -0,0 +1,40 @@
+import re
+import sys
+import subprocess
+
+from pathlib import Path
+
+import pytest
+
+from test_gdb_gen import SIMPTS
+
+GDB_PATHFINDER = Path(__file__).parent / 'gdb_pathfinder.py'
+
+
+def plan(program, cwd, *options):
+    program.write(cwd, SIMPTS)
+    subprocess.run([sys.executable, GDB_PATHFINDER, '-d', cwd, '--hit-cost', '1e-3', '--stop-cost', '1e-2', *options],
+                   check=True, capture_output=True)
+    return (cwd / 'gdb.cmd').read_text().splitlines()
+
+
+@pytest.mark.parametrize('options', [
+    ('-p', 'greedy', '-t', '50'),
+    ('-p', 'dp'),
+    ('-p', 'dp', '-r', '3'),
+    ('-p', 'dp', '-r', '3', '-m', '1'),
+])
+def test_batches_land_on_out_brk(program, tmp_path, options):
+    cmds = plan(program, tmp_path, *options)
+    assert program.replay(cmds) == program.expected(SIMPTS)
+
+
+def test_batches_cost_no_more_than_single_breakpoints(program, tmp_path):
+    # one breakpoint at a time is a batch plan too
+    costs = {}
+    for max_num in ('1', '10'):
+        program.write(tmp_path, SIMPTS)
+        res = subprocess.run([sys.executable, GDB_PATHFINDER, '-d', tmp_path, '--hit-cost', '1e-3', '--stop-cost', '1e-2',
+                              '-p', 'dp', '-m', max_num], check=True, capture_output=True, text=True)
+        costs[max_num] = float(re.search(r'cost=(\S+)s', res.stderr).group(1))
+    assert costs['10'] <= costs['1']
@@ -0,0 +1,43 @@
+import sys
+import subprocess
+
+from pathlib import Path
+
+import pytest
+
+from test_gdb_gen import SIMPTS, plan
+
+GDB_VERIFY = Path(__file__).parent / 'gdb_verify.py'
+
+
+def verify(cwd):
+    return subprocess.run([sys.executable, GDB_VERIFY, '-d', cwd], capture_output=True, text=True)
+
+
+def count(program, pc, last):
+    # executions of pc up to the end of slice last
+    return sum(delta.get(pc, 0) for delta in program.slices[:last + 1])
+
+
+@pytest.mark.parametrize('options', [('-p', 'greedy', '-t', '50', '-r', '3'), ('-p', 'dp', '-r', '3')])
+def test_plans_verify(program, tmp_path, options):
+    plan(program, tmp_path, *options)
+    res = verify(tmp_path)
+    assert res.returncode == 0, res.stderr
+    assert 'error' not in res.stderr
+
+
+def test_counting_from_the_end_of_a_rare_stop_is_an_error(program, tmp_path):
+    # stop at the first execution of a rare block in slice s, then count the hits of the out.brk
+    # record of a later slice as if that stop was at the end of s
+    s, rare, t = next((s, rare, t) for s in range(1, len(program.slices) - 1) for rare in program.rare
+                      if rare in program.slices[s] for t in range(s + 1, len(program.slices))
+                      if program.brk[t][0] in program.slices[s])
+    pc, cnt = program.brk[t]
+    program.write(tmp_path, [t + 1])
+    cmds = [f'break * {rare:#x}', f'#ignore@{count(program, rare, s - 1)}', 'c', 'delete',
+            f'break * {pc:#x}', f'#ignore@{cnt - count(program, pc, s) - 1}', 'c', '#ckpt@0', 'delete']
+    (tmp_path / 'gdb.cmd').write_text('\n'.join(cmds))
+    res = verify(tmp_path)
+    assert res.returncode == 1
+    assert f'line 7: {pc:#x} ran in slices {s}-{s}' in res.stderr
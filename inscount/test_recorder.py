@@ -0,0 +1,22 @@
+import sys
+import gzip
+import types
+
+sys.modules.setdefault('git', types.ModuleType('git'))
+
+from recorder import compress_pmem
+
+
+def test_compress_keeps_recorded_memory(tmp_path):
+    # loadMapping wrote a page of the process into pmem before convert runs
+    pmem = tmp_path / 'system.physmem.store0.pmem'
+    page = bytes(range(256)) * 16
+    with pmem.open('wb') as f:
+        f.seek(3 * len(page))
+        f.write(page)
+    compress_pmem(pmem, 1 << 20)
+    image = gzip.decompress(pmem.read_bytes())
+    assert len(image) == 1 << 20
+    assert image[3 * len(page):4 * len(page)] == page
+    assert image[:3 * len(page)] == bytes(3 * len(page)) and not any(image[4 * len(page):])
+    assert not (tmp_path / 'system.physmem.store0.pmem.raw').exists()
@@ -23,31 +23,179 @@
 # SOFTWARE.
 
 import json, os, resource
-import subprocess
+import mmap
+import bisect
+import signal
 import logging
 
+from concurrent.futures import ThreadPoolExecutor
 from elftools.elf.elffile import ELFFile
 from pathlib import Path
 from time import sleep
 
 from Checkpoints import GDBCheckpoint
+from MemoryImage import DEFAULT_LEVEL, DEFAULT_WORKERS, compress_memory_image
+from PageStore import PageStore, store_memory_image
+
+COPY_CHUNK = 1 << 30
+COPY_WORKERS = min(8, os.cpu_count() or 1)
+CAPTURE_CHUNK = 16 * 1024 * 1024
+ZERO_CHUNK = bytes(CAPTURE_CHUNK)
+MAX_FILE_OFFSET = (1 << 63) - 1
+
+
+def copy_range(src_fd, dst_fd, src_offset, dst_offset, size):
+    ''' Copy size bytes between two file offsets without going through Python buffers.
+
+    copy_file_range keeps the bytes in the kernel (or shares the extents on reflink file
+    systems); where it is not supported, e.g. across file systems on old kernels, the range
+    is mapped and written from the mapping with pwrite.
+    '''
+    while size > 0:
+        try:
+            copied = os.copy_file_range(src_fd, dst_fd, min(size, COPY_CHUNK), src_offset, dst_offset)
+        except (AttributeError, OSError):
+            break
+        if copied == 0:
+            raise EOFError(f'core ends before offset {src_offset + size:#x}')
+        src_offset, dst_offset, size = src_offset + copied, dst_offset + copied, size - copied
+    if size <= 0:
+        return
+
+    # mmap offsets must be page aligned
+    skip = src_offset % mmap.ALLOCATIONGRANULARITY
+    with mmap.mmap(src_fd, skip + size, access=mmap.ACCESS_READ, offset=src_offset - skip) as src, \
+         memoryview(src) as view:
+        done = 0
+        while done < size:
+            chunk = view[skip + done:skip + min(size, done + COPY_CHUNK)]
+            try:
+                done += os.pwrite(dst_fd, chunk, dst_offset + done)
+            finally:
+                chunk.release()
+
+
+def copy_process_range(mem_fd, dst_fd, vaddr, paddr, size):
+    ''' Copy a mapping from /proc/<pid>/mem of a stopped process to paddr of dst_fd.
+
+    /proc/<pid>/mem can neither be mapped nor used with copy_file_range, so the mapping goes
+    through one reused buffer. Chunks that are all zeros are not written and stay holes in
+    pmem; pages that cannot be read, e.g. of [vvar], are skipped one by one and read as zeros.
+    '''
+    if vaddr + size > MAX_FILE_OFFSET:
+        # [vsyscall] is above what a file offset can address, gcore does not dump it either
+        return
+    pgsize = resource.getpagesize()
+    buf = bytearray(min(size, CAPTURE_CHUNK))
+    view = memoryview(buf)
+    done = 0
+    while done < size:
+        want = min(len(buf), size - done)
+        try:
+            n = os.preadv(mem_fd, [view[:want]], vaddr + done)
+        except OSError:
+            done += pgsize - (vaddr + done) % pgsize
+            continue
+        if n == 0:
+            break
+        zeros = buf == ZERO_CHUNK[:n] if n == len(buf) else buf.count(0, 0, n) == n
+        if not zeros:
+            os.pwrite(dst_fd, view[:n], paddr + done)
+        done += n
 
 
 class GDBCheckpointConverter:
 
-    def __init__(self, gdb_checkpoint):
+    def __init__(self, gdb_checkpoint, pid=None):
         assert isinstance(gdb_checkpoint, GDBCheckpoint)
-        assert gdb_checkpoint.is_valid_checkpoint()
+        # without a core file, the memory is read from the stopped process
+        assert pid is not None or gdb_checkpoint.is_valid_checkpoint()
+        self.pid = pid
         self.gdb_checkpoint = gdb_checkpoint
         self.mappings = self.gdb_checkpoint.get_mappings()
+        self.regions = sorted((vaddr, int(m['paddr']), int(m['size'])) for vaddr, m in self.mappings.items()
+                              if vaddr != 'mem_size')
+        self.region_starts = [vaddr for vaddr, _, _ in self.regions]
 
     @staticmethod
-    def compress_memory_image(file_path):
-        subprocess.call(['gzip', '-f', str(file_path)])
-        gzip_path = Path(str(file_path) + '.gz')
-        gzip_path.rename(file_path)
+    def compress_memory_image(file_path, level=DEFAULT_LEVEL, workers=DEFAULT_WORKERS):
+        # pmem is sparse, only the segments written into it are read and compressed
+        raw_path = Path(str(file_path) + '.raw')
+        Path(file_path).rename(raw_path)
+        compress_memory_image(raw_path, file_path, level=level, workers=workers)
+        raw_path.unlink()
 
-    def create_pmem_file(self):
+    def store_pages(self, file_path, page_store, level=DEFAULT_LEVEL, workers=DEFAULT_WORKERS):
+        # the checkpoint only keeps a manifest, pmem is materialized from the store when needed
+        regions = [(int(m['paddr']), int(m['size'])) for vaddr, m in self.mappings.items() if vaddr != 'mem_size']
+        store_memory_image(file_path, regions, PageStore(page_store), self.gdb_checkpoint.manifest_file,
+                           self.mappings['mem_size'], level=level, workers=workers)
+        Path(file_path).unlink()
+        return self.gdb_checkpoint.manifest_file
+
+    def mapped_parts(self, vaddr, size):
+        # (offset from vaddr, paddr, size) of the parts of [vaddr, vaddr + size) that are placed in
+        # pmem, a compacted mapping only holds some pages of the segment gdb dumped
+        parts = []
+        index = max(bisect.bisect_right(self.region_starts, vaddr) - 1, 0)
+        for start, paddr, region_size in self.regions[index:]:
+            if start >= vaddr + size:
+                break
+            lo, hi = max(vaddr, start), min(vaddr + size, start + region_size)
+            if lo < hi:
+                parts.append((lo - vaddr, paddr + lo - start, hi - lo))
+        return parts
+
+    def core_segments(self, core_elf):
+        # (offset in core, paddr, size) of every part of a PT_LOAD segment that is in the mappings
+        segments = []
+        for s in core_elf.iter_segments():
+            if s['p_type'] != 'PT_LOAD':
+                continue
+            assert s['p_filesz'] == s['p_memsz']
+            for offset, paddr, size in self.mapped_parts(int(s['p_vaddr']), int(s['p_filesz'])):
+                segments.append((int(s['p_offset']) + offset, paddr, size))
+        return segments
+
+    def copy_core(self, workers=COPY_WORKERS):
+        # only the program headers are parsed, the segments are copied by the kernel in parallel
+        with self.gdb_checkpoint.get_pmem_file_handle() as pmem_raw,\
+             self.gdb_checkpoint.gdb_core_file.open('rb') as core:
+            segments = self.core_segments(ELFFile(core))
+            pmem_raw.truncate(self.mappings['mem_size'])
+            pmem_fd, core_fd = pmem_raw.fileno(), core.fileno()
+
+            # biggest first so that one large segment does not start last
+            segments.sort(key=lambda seg: seg[2], reverse=True)
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                for _ in pool.map(lambda seg: copy_range(core_fd, pmem_fd, *seg), segments):
+                    pass
+
+        return self.gdb_checkpoint.pmem_file
+
+    def capture_process(self, workers=COPY_WORKERS):
+        # every mapping is read from the process at its vaddr, the process must stay stopped
+        with self.gdb_checkpoint.get_pmem_file_handle() as pmem_raw,\
+             open(f'/proc/{self.pid}/mem', 'rb', buffering=0) as mem:
+            pmem_raw.truncate(self.mappings['mem_size'])
+            pmem_fd, mem_fd = pmem_raw.fileno(), mem.fileno()
+
+            regions = [(vaddr, int(m['paddr']), int(m['size'])) for vaddr, m in self.mappings.items()
+                       if vaddr != 'mem_size']
+            regions.sort(key=lambda region: region[2], reverse=True)
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                for _ in pool.map(lambda region: copy_process_range(mem_fd, pmem_fd, *region), regions):
+                    pass
+
+        return self.gdb_checkpoint.pmem_file
+
+    def create_pmem_file(self, workers=COPY_WORKERS):
+        if self.pid is not None:
+            return self.capture_process(workers)
+        if self.gdb_checkpoint.gdb_core_file.exists():
+            return self.copy_core(workers)
+
+        # a gzipped core cannot be copied by offset, its segments are decompressed one by one
         with self.gdb_checkpoint.get_pmem_file_handle() as pmem_raw,\
              self.gdb_checkpoint.get_core_file_handle() as core:
             core_elf = ELFFile(core)
@@ -91,31 +239,79 @@ class GDBCheckpointConverter:
                     continue
                 assert s['p_filesz'] == s['p_memsz']
                 # assert s['p_memsz'] % pgsize == 0
-                if s['p_vaddr'] in self.mappings:
-
-                    mapping = self.mappings[s['p_vaddr']]
-                    paddr = int(mapping['paddr'])
-                    pmem_raw.seek(paddr, 0)
-
+                parts = self.mapped_parts(int(s['p_vaddr']), int(s['p_memsz']))
+                if parts:
                     mem = s.data()
                     assert len(mem) == s['p_memsz']
-                    pmem_raw.write(mem)
+                    for offset, paddr, size in parts:
+                        pmem_raw.seek(paddr, 0)
+                        pmem_raw.write(mem[offset:offset + size])
 
         return self.gdb_checkpoint.pmem_file
 
 
-def convert_checkpoint(gdb_checkpoint, force_recreate, compress=True):
+def convert_checkpoint(gdb_checkpoint, force_recreate, compress=True, workers=COPY_WORKERS,
+                       compress_level=DEFAULT_LEVEL, compress_workers=DEFAULT_WORKERS, pid=None, page_store=None,
+                       raw_pmem=False):
+    # with a pid, pmem is captured from the stopped process instead of converted from gdb.core,
+    # with raw_pmem, pmem already holds the captured memory and is only compressed or stored,
+    # with a page_store, the pages go to the store and the manifest is returned instead of pmem
     assert isinstance(gdb_checkpoint, GDBCheckpoint)
 
-    if gdb_checkpoint.pmem_file_exists() and not force_recreate:
+    if gdb_checkpoint.pmem_file_exists() and not force_recreate and not raw_pmem:
         return None
 
-    converter = GDBCheckpointConverter(gdb_checkpoint)
-    pmem_out_file = converter.create_pmem_file()
+    converter = GDBCheckpointConverter(gdb_checkpoint, pid)
+    pmem_out_file = gdb_checkpoint.pmem_file if raw_pmem else converter.create_pmem_file(workers)
     assert pmem_out_file.exists()
+    if page_store is not None:
+        logging.info('Storing pmem pages')
+        return converter.store_pages(pmem_out_file, page_store, compress_level, compress_workers)
     if compress:
         logging.info('Starting to compress pmem')
-        converter.compress_memory_image(pmem_out_file)
+        converter.compress_memory_image(pmem_out_file, compress_level, compress_workers)
         logging.info('Compression finished')
         assert pmem_out_file.exists()
     return pmem_out_file
+
+
+if __name__ == "__main__":
+    # the worker of GDBOnly's conversion pipeline, it runs outside of GDB
+    import argparse
+    from types import SimpleNamespace
+    parser = argparse.ArgumentParser(description='convert a GDB checkpoint into the memory image gem5 reads')
+    parser.add_argument('ckpt_dir', type=str, help='checkpoint directory')
+    parser.add_argument('--core', type=str, help='name of the core file', default='gdb.core')
+    parser.add_argument('--mappings', type=str, help='name of the mappings file', default='mappings.json')
+    parser.add_argument('--pmem', type=str, help='name of the memory image', default='system.physmem.store0.pmem')
+    parser.add_argument('--raw-pmem', action='store_true', help='the memory image is already captured, only compress or store it')
+    parser.add_argument('--pid', type=int, help='capture the memory of this stopped process instead of a core file', default=None)
+    parser.add_argument('--kill-pid', action='store_true', help='kill the process once its memory is captured')
+    parser.add_argument('--no-compress', action='store_true', help='leave the memory image uncompressed')
+    parser.add_argument('-l', '--level', type=int, help='compression level', default=DEFAULT_LEVEL)
+    parser.add_argument('-j', '--workers', type=int, help='compression threads', default=DEFAULT_WORKERS)
+    parser.add_argument('--page-store', type=str, help='deduplicate the memory into this page store', default=None)
+    parser.add_argument('--remove-core', action='store_true', help='delete the core file when done')
+    parser.add_argument('--remove-mappings', action='store_true', help='delete the mappings file when done')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(message)s')
+    ckpt_dir = Path(args.ckpt_dir)
+    configs = SimpleNamespace(COREDUMP_FILENAME=args.core, MMAP_FILENAME=args.mappings, PMEM_FILENAME=args.pmem)
+    raw_pmem = args.raw_pmem
+    if args.pid is not None:
+        # a forked copy of the inferior keeps its pages alive until it is gone, so it is
+        # killed before the slow part
+        try:
+            convert_checkpoint(GDBCheckpoint(ckpt_dir, configs), True, compress=False, pid=args.pid)
+        finally:
+            if args.kill_pid:
+                os.kill(args.pid, signal.SIGKILL)
+        raw_pmem = True
+    convert_checkpoint(GDBCheckpoint(ckpt_dir, configs), True, compress=not args.no_compress,
+                       compress_level=args.level, compress_workers=args.workers, page_store=args.page_store,
+                       raw_pmem=raw_pmem)
+    if args.remove_core:
+        (ckpt_dir / args.core).unlink()
+    if args.remove_mappings:
+        (ckpt_dir / args.mappings).unlink()
@@ -25,9 +25,12 @@ from jinja2 import Template
 from pathlib import Path
 
 import os, resource
-import re
+import functools
+import numpy as np
 
 class MemoryMapping:
+    __slots__ = ('index', 'paddr', 'vaddr', 'size', 'offset', 'flags', 'name')
+
     def __init__(self, index, paddr, vaddr, size, offset, flags, name):
         self.index  = index
         self.paddr  = paddr
@@ -49,12 +52,92 @@ class MemoryMapping:
     def __contains__(self, vaddr):
         return self.vaddr <= vaddr and vaddr < self.vaddr + self.size
 
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+PAGE_ENTRY = '''
+[system.cpu.workload.Entry{}]
+vaddr={}
+paddr={}
+flags=0
+'''
+
+class PageTable:
+    ''' The page table entries of a list of mappings, one (vaddr, paddr) pair per page.
+
+    Pages are kept as two arrays, they only become text while a template iterates over
+    chunks(), a batch of [system.cpu.workload.EntryN] sections at a time.
+    '''
+    __slots__ = ('vaddrs', 'paddrs')
+
+    def __init__(self, mappings, pgsize):
+        mappings = list(mappings)
+        pages = np.array([(m.size + pgsize - 1) // pgsize for m in mappings], dtype=np.int64)
+        firsts = np.repeat(np.cumsum(pages) - pages, pages)
+        offsets = (np.arange(pages.sum(), dtype=np.int64) - firsts).astype(np.uint64) * np.uint64(pgsize)
+        self.vaddrs = np.repeat(np.array([m.vaddr for m in mappings], dtype=np.uint64), pages) + offsets
+        self.paddrs = np.repeat(np.array([m.paddr for m in mappings], dtype=np.uint64), pages) + offsets
+
+    def __len__(self):
+        return len(self.vaddrs)
+
+    def chunks(self, batch=65536):
+        for start in range(0, len(self), batch):
+            vaddrs = self.vaddrs[start:start + batch].tolist()
+            paddrs = self.paddrs[start:start + batch].tolist()
+            yield ''.join(PAGE_ENTRY.format(index, vaddr, paddr)
+                          for index, vaddr, paddr in zip(range(start, start + len(vaddrs)), vaddrs, paddrs))
+
+
+def layout(*groups):
+    # register names in the order gem5 serializes them, a group is a name or a (format, count) pair
+    names = []
+    for group in groups:
+        if isinstance(group, tuple):
+            names += [group[0].format(i) for i in range(group[1])]
+        else:
+            names.append(group)
+    return names
+
 
 class RegisterValues:
-    pattern = re.compile(r'(\w+)\s+(\w+)\s+([-\w]+)')
-    eflags  = re.compile(r'eflags\s+(\w+)\s+(\[.*\])\s*')
-    mxcsr   = re.compile(r'mxcsr\s+(\w+)\s+(\[.*\])\s*')
-    floats  = re.compile(r'(\w+).*v2_int64 = \{(\w+), (\w+)\}.*')
+    int_regs = layout('rax', 'rcx', 'rdx', 'rbx', 'rsp', 'rbp', 'rsi', 'rdi', 'r8', 'r9',
+        'r10', 'r11', 'r12', 'r13', 'r14', 'r15')
+    # Micro-op registers and implict registers
+    int_regs_implicit = 22
+
+    float_regs = layout(('{}', 8), ('fpr{}', 8), *[f'xmm{i}_{half}' for i in range(16) for half in ('low', 'high')],
+        ('microfp{}', 8))
+
+    misc_regs = layout(('cr{}', 16), ('dr{}', 8),
+        'rflags', 'm5', 'tsc', 'mtrrcap', 'sysenter_cs', 'sysenter_esp',
+        'sysenter_eip', 'mcg_cap', 'mcg_status', 'mcg_ctl', 'debug_ctl_msr',
+        'lbfi', 'lbti', 'lefi', 'leti',
+        ('mtrr_phys_base{}', 8), ('mtrr_phys_mask{}', 8), ('mtrr_fix{}', 11),
+        'pat', 'def_type',
+        ('mc{}_ctl', 8), ('mc{}_status', 8), ('mc{}_addr', 8), ('mc{}_misc', 8),
+        'efer', 'star', 'lstar', 'cstar', 'sf_mask', 'kernel_gs_base', 'tsc_aux',
+        ('perf_evt_sel{}', 4), ('perf_evt_ctr{}', 4),
+        'syscfg', 'iorr_base0', 'iorr_base1', 'iorr_mask0', 'iorr_mask1',
+        'top_mem', 'top_mem2', 'vm_cr', 'ignne', 'smm_ctl', 'vm_hsave_pa',
+        'es', 'cs', 'ss', 'ds', 'fs', 'gs', 'hs', 'tsl', 'tsg', 'ls', 'ms',
+        'tr', 'idtr', 'es_base', 'cs_base', 'ss_base', 'ds_base', 'fs_base',
+        'gs_base', 'hs_base', 'tsl_base', 'tsg_base', 'ls_base', 'ms_base',
+        'tr_base', 'idtr_base', 'es_eff_base', 'cs_eff_base', 'ss_eff_base',
+        'ds_eff_base', 'fs_eff_base', 'gs_eff_base', 'hs_eff_base', 'tsl_eff_base',
+        'tsg_eff_base', 'ls_eff_base', 'ms_eff_base', 'tr_eff_base',
+        'idtr_eff_base', 'es_limit', 'cs_limit', 'ss_limit', 'ds_limit',
+        'fs_limit', 'gs_limit', 'hs_limit', 'tsl_limit', 'tsg_limit',
+        'ls_limit', 'ms_limit', 'tr_limit', 'idtr_limit', 'es_attr', 'cs_attr',
+        'ss_attr', 'ds_attr', 'fs_attr', 'gs_attr', 'hs_attr', 'tsl_attr',
+        'tsg_attr', 'ls_attr', 'ms_attr', 'tr_attr', 'idtr_attr', 'x87_top',
+        'mxcsr', 'fcw', 'fsw', 'ftw', 'ftag', 'fiseg', 'fioff', 'foseg',
+        'fooff', 'fop', 'apic_base', 'pci_config_address')
+
+    # gdb names of the registers gem5 knows under another name
+    renames = {'eflags': 'rflags'}
+    scalar_regs = frozenset(int_regs + misc_regs + ['rip']) | frozenset(renames)
 
     defaults = {
         'cr0': 2147483699,
@@ -77,37 +160,60 @@ class RegisterValues:
         'idtr_attr': 46043
     }
 
+    # per gdb architecture: the scalar registers it has
+    arch_layouts = {}
+
     def __init__(self, fs_base):
-        import copy
         import gdb  # pylint: disable=import-error
-        raw = gdb.execute('info all-registers', to_string=True)
-        self.regvals = copy.deepcopy(RegisterValues.defaults)
+        frame = gdb.selected_frame()
+        arch = frame.architecture()
+        scalars = self.arch_layout(gdb, frame, arch)
+        self.regvals = dict(RegisterValues.defaults)
         self.fs_base = fs_base
 
-        for entry in raw.split(os.linesep):
-            entry = entry.strip()
-            matches = RegisterValues.pattern.match(entry)
-            if matches:
-                self.regvals[matches.group(1)] = int(matches.group(2), 16)
-
-            eflags_matches = RegisterValues.eflags.match(entry)
-            if eflags_matches:
-                self.regvals['rflags'] = int(eflags_matches.group(1), 16)
-
-            mxcsr_matches = RegisterValues.mxcsr.match(entry)
-            if mxcsr_matches:
-                self.regvals['mxcsr'] = int(mxcsr_matches.group(1), 16)
+        for name in scalars:
+            self.regvals[RegisterValues.renames.get(name, name)] = self.read(frame, name)
 
-        # Parse floats
+        # gem5's x86 has no AVX, only the xmm halves go into the checkpoint
         for i in range(16):
-            entry = gdb.execute('info registers xmm{}'.format(i), to_string=True)
-            matches = RegisterValues.floats.match(entry.strip())
-            if matches:
-                high = 'xmm{}_high'.format(i)
-                low = 'xmm{}_low'.format(i)
-                self.regvals[high] = int(matches.group(2), 16)
-                self.regvals[low] = int(matches.group(3), 16)
-                #print('{}: {}, {}'.format(i, self.regvals[high], self.regvals[low]))
+            self.regvals[f'xmm{i}_low'], self.regvals[f'xmm{i}_high'] = self.read_xmm(frame, i)
+
+        pc = self['rip']
+        self.pc_string = str(pc)
+        self.next_pc_string = str(pc + arch.disassemble(pc)[0]['length'])
+        self.int_reg_string = ' '.join([str(self[r]) for r in RegisterValues.int_regs] +
+                                       ['0'] * RegisterValues.int_regs_implicit)
+        self.float_reg_string = ' '.join(str(self[r]) for r in RegisterValues.float_regs)
+        self.misc_reg_string = ' '.join(str(self[r]) for r in RegisterValues.misc_regs)
+
+    @classmethod
+    def arch_layout(cls, gdb, frame, arch):
+        if arch.name() not in cls.arch_layouts:
+            try:
+                names = [r.name for r in arch.registers()]
+            except AttributeError:
+                # gdb < 12 has no register list, keep the registers it can read
+                names = []
+                for name in sorted(cls.scalar_regs):
+                    try:
+                        frame.read_register(name)
+                        names.append(name)
+                    except (ValueError, gdb.error):
+                        pass
+            cls.arch_layouts[arch.name()] = [n for n in names if n in cls.scalar_regs]
+        return cls.arch_layouts[arch.name()]
+
+    @staticmethod
+    def read(frame, name):
+        # as unsigned, the way gem5 stores it
+        value = frame.read_register(name)
+        return int(value) & ((1 << 8 * value.type.sizeof) - 1)
+
+    @staticmethod
+    def read_xmm(frame, index):
+        # the low and high 64 bit words
+        words = frame.read_register(f'xmm{index}')['v2_int64']
+        return [int(words[i]) & 0xffffffffffffffff for i in range(2)]
 
     def __getitem__(self, regname):
         if regname not in self.regvals:
@@ -118,116 +224,33 @@ class RegisterValues:
         return self.regvals[regname]
 
     def get_int_reg_string(self):
-        reg_str = str()
-        regs = ['rax', 'rcx', 'rdx', 'rbx', 'rsp', 'rbp', 'rsi', 'rdi', 'r8', 'r9',
-            'r10', 'r11', 'r12', 'r13', 'r14', 'r15']
-        for r in regs:
-            reg_str += '{} '.format(self[r])
-        # Micro-op registers and implict registers
-        reg_str += '0 ' * 22
-        regs_chk = reg_str.strip().split(' ')
-        return reg_str.strip()
-
+        return self.int_reg_string
 
     def get_float_reg_string(self):
-        reg_str = str()
-        for i in range(8):
-            regname = '{}'.format(i)
-            reg_str += '{} '.format(self[regname])
-        for i in range(8):
-            regname = 'fpr{}'.format(i)
-            reg_str += '{} '.format(self[regname])
-        for i in range(32):
-            suffix = '_low' if i % 2 else '_high'
-            regname = 'xmm{}{}'.format(i // 2, suffix)
-            reg_str += '{} '.format(self[regname])
-        for i in range(8):
-            regname = 'microfp{}'.format(i)
-            reg_str += '{} '.format(self[regname])
-        return reg_str.strip()
-
+        return self.float_reg_string
 
     def get_pc_string(self):
-        virt_pc = int(self['rip'])
-        return '{}'.format(virt_pc)
+        return self.pc_string
 
     def get_next_pc_string(self):
-        import gdb  # pylint: disable=import-error
-        raw = gdb.execute('x/2i $pc', to_string=True)
-        print(raw)
-        next_line = raw.split(os.linesep)[1].strip().replace('\t', ' ')
-        print(next_line)
-        next_pc = next_line.split(' ')[0].strip().replace(':', '')
-        return '{}'.format(int(next_pc, 16))
+        return self.next_pc_string
 
     def get_misc_reg_string(self):
         ''' For system.cpu.isa regVal string '''
-        reg_str = str()
-        # Control registers
-        for i in range(16):
-            reg_str += '{} '.format(self['cr{}'.format(i)])
-        # Debug registers
-        for i in range(8):
-            reg_str += '{} '.format(self['dr{}'.format(i)])
-
-        regs = ['rflags', 'm5', 'tsc', 'mtrrcap', 'sysenter_cs', 'sysenter_esp',
-            'sysenter_eip', 'mcg_cap', 'mcg_status', 'mcg_ctl', 'debug_ctl_msr',
-            'lbfi', 'lbti', 'lefi', 'leti']
-        for r in regs:
-            reg_str += '{} '.format(self[r])
-
-        for i in range(8):
-            reg_str += '{} '.format(self['mtrr_phys_base{}'.format(i)])
-        for i in range(8):
-            reg_str += '{} '.format(self['mtrr_phys_mask{}'.format(i)])
-        for i in range(11):
-            reg_str += '{} '.format(self['mtrr_fix{}'.format(i)])
-
-        regs = ['pat', 'def_type']
-        for r in regs:
-            reg_str += '{} '.format(self[r])
-
-        for i in range(8):
-            reg_str += '{} '.format(self['mc{}_ctl'.format(i)])
-        for i in range(8):
-            reg_str += '{} '.format(self['mc{}_status'.format(i)])
-        for i in range(8):
-            reg_str += '{} '.format(self['mc{}_addr'.format(i)])
-        for i in range(8):
-            reg_str += '{} '.format(self['mc{}_misc'.format(i)])
-
-        regs = ['efer', 'star', 'lstar', 'cstar', 'sf_mask', 'kernel_gs_base',
-            'tsc_aux']
-        for r in regs:
-            reg_str += '{} '.format(self[r])
-
-        for i in range(4):
-            reg_str += '{} '.format(self['perf_evt_sel{}'.format(i)])
-        for i in range(4):
-            reg_str += '{} '.format(self['perf_evt_ctr{}'.format(i)])
-
-        regs = ['syscfg', 'iorr_base0', 'iorr_base1', 'iorr_mask0', 'iorr_mask1',
-            'top_mem', 'top_mem2', 'vm_cr', 'ignne', 'smm_ctl', 'vm_hsave_pa',
-            'es', 'cs', 'ss', 'ds', 'fs', 'gs', 'hs', 'tsl', 'tsg', 'ls', 'ms',
-            'tr', 'idtr', 'es_base', 'cs_base', 'ss_base', 'ds_base', 'fs_base',
-            'gs_base', 'hs_base', 'tsl_base', 'tsg_base', 'ls_base', 'ms_base',
-            'tr_base', 'idtr_base', 'es_eff_base', 'cs_eff_base', 'ss_eff_base',
-            'ds_eff_base', 'fs_eff_base', 'gs_eff_base', 'hs_eff_base', 'tsl_eff_base',
-            'tsg_eff_base', 'ls_eff_base', 'ms_eff_base', 'tr_eff_base',
-            'idtr_eff_base', 'es_limit', 'cs_limit', 'ss_limit', 'ds_limit',
-            'fs_limit', 'gs_limit', 'hs_limit', 'tsl_limit', 'tsg_limit',
-            'ls_limit', 'ms_limit', 'tr_limit', 'idtr_limit', 'es_attr', 'cs_attr',
-            'ss_attr', 'ds_attr', 'fs_attr', 'gs_attr', 'hs_attr', 'tsl_attr',
-            'tsg_attr', 'ls_attr', 'ms_attr', 'tr_attr', 'idtr_attr', 'x87_top',
-            'mxcsr', 'fcw', 'fsw', 'ftw', 'ftag', 'fiseg', 'fioff', 'foseg',
-            'fooff', 'fop', 'apic_base', 'pci_config_address']
-        for r in regs:
-            reg_str += '{} '.format(self[r])
-        return reg_str.strip()
+        return self.misc_reg_string
 
 WORK_DIR = os.path.dirname(__file__)
-def fill_checkpoint_template(output_file, **kwargs):
-    with open(Path(__file__).parent / './templates/m5-2.cpt.template', 'r') as tf:
-        template = Template(tf.read())
-        with open(output_file, 'w') as f:
-            f.write(template.render(**kwargs))
+DEFAULT_TEMPLATE = Path(__file__).parent / 'templates' / 'm5-2.cpt.template'
+WRITE_BUFFER = 1024 * 1024
+
+@functools.lru_cache(maxsize=None)
+def load_template(template_path):
+    # compiled once per process
+    with open(template_path, 'r') as tf:
+        return Template(tf.read())
+
+def fill_checkpoint_template(output_file, template_path=DEFAULT_TEMPLATE, **kwargs):
+    # the page table is streamed in chunks, so memory does not grow with the address space
+    template = load_template(Path(template_path).resolve())
+    with open(output_file, 'w', buffering=WRITE_BUFFER) as f:
+        f.writelines(template.generate(**kwargs))
@@ -25,6 +25,7 @@ from pathlib import Path
 import json
 import gzip
 from elftools.elf.elffile import ELFFile
+from PageStore import MANIFEST_FILENAME
 
 class GDBCheckpoint:
 
@@ -37,6 +38,7 @@ class GDBCheckpoint:
         self.gdb_core_file = self.checkpoint_directory / configs.COREDUMP_FILENAME
         self.gdb_gzip_file = self.checkpoint_directory / self.GDB_GZIP_FILE
         self.pmem_file     = self.checkpoint_directory / configs.PMEM_FILENAME
+        self.manifest_file = self.checkpoint_directory / MANIFEST_FILENAME
         self.mappings      = None
 
     def get_mappings(self):
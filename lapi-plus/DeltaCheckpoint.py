@@ -0,0 +1,257 @@
+#! /usr/bin/env python3
+
+# Delta checkpoints. Consecutive simpoints are taken from one execution, so after a checkpoint
+# the soft-dirty bits of the process are cleared, and the next checkpoint only dumps the pages
+# written since then together with the name of its parent. flatten rebuilds a normal gem5
+# checkpoint from a chain of deltas.
+
+import os
+import sys
+import gzip
+import json
+import mmap
+import bisect
+import ctypes
+import functools
+import resource
+import tempfile
+import numpy as np
+
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent))
+
+from CheckpointConvert import MAX_FILE_OFFSET, copy_process_range, copy_range
+from MemoryImage import DEFAULT_LEVEL, DEFAULT_WORKERS, compress_memory_image
+from PageStore import MANIFEST_FILENAME, PMEM_FILENAME, materialize
+from ProcMaps import PAGE_PRESENT, PAGE_SWAPPED, ProcMaps
+
+DELTA_FILENAME = 'delta.json'
+PAGES_FILENAME = 'delta.pages'
+MMAP_FILENAME = 'mappings.json'
+SOFT_DIRTY = np.uint64(1 << 55)
+INFLATE_CHUNK = 16 * 1024 * 1024
+
+
+@functools.lru_cache(maxsize=None)
+def soft_dirty_supported():
+    # kernels without CONFIG_MEM_SOFT_DIRTY accept clear_refs but never set the bit, so
+    # write a page of our own after clearing and see whether it shows up
+    pgsize = resource.getpagesize()
+    try:
+        with mmap.mmap(-1, pgsize) as page:
+            page[0] = 1
+            with open('/proc/self/clear_refs', 'w') as f:
+                f.write('4')
+            page[0] = 2
+            vaddr = ctypes.addressof(ctypes.c_char.from_buffer(page))
+            with open('/proc/self/pagemap', 'rb', buffering=0) as pagemap:
+                entry = np.frombuffer(os.pread(pagemap.fileno(), 8, vaddr // pgsize * 8), dtype=np.uint64)
+            return bool(entry[0] & SOFT_DIRTY)
+    except (OSError, IndexError):
+        return False
+
+
+def clear_soft_dirty(pid):
+    ''' Track the pages pid writes from now on, False if the kernel has no soft-dirty bits. '''
+    if not soft_dirty_supported():
+        return False
+    try:
+        with open(f'/proc/{pid}/clear_refs', 'w') as f:
+            f.write('4')
+        return True
+    except OSError:
+        return False
+
+
+def page_runs(mask, vaddr, pgsize):
+    # (vaddr, size) of the runs of pages set in mask
+    mask = np.concatenate(([False], mask, [False]))
+    edges = np.flatnonzero(mask[1:] != mask[:-1]).reshape(-1, 2)
+    return [(vaddr + int(start) * pgsize, int(end - start) * pgsize) for start, end in edges]
+
+
+def classify_pages(entries, in_parent, file_backed):
+    ''' Masks of the pages to dump and of the pages that read as zeros since the parent.
+
+    MADV_DONTNEED (malloc_trim, shrink_heap) drops a page together with its soft-dirty bit, so
+    a page of the parent that is neither present nor swapped now is not what the parent holds.
+    An anonymous one reads as zeros, a file backed one reads as the file and is dumped again.
+    '''
+    dirty = (entries & SOFT_DIRTY) != 0
+    gone = in_parent & ((entries & (PAGE_PRESENT | PAGE_SWAPPED)) == 0)
+    if file_backed:
+        return dirty | gone, np.zeros_like(dirty)
+    return dirty, gone & ~dirty
+
+
+def dirty_runs(pid, regions, parent_regions=()):
+    ''' (vaddr, size) of the pages written since the last clear_soft_dirty, and of the pages of
+    parent_regions that were dropped since then and read as zeros. Pages of mappings created
+    since then are all soft-dirty.
+    '''
+    pgsize = resource.getpagesize()
+    maps = ProcMaps.read(pid)
+    runs, zeros = [], []
+    fd = os.open(f'/proc/{pid}/pagemap', os.O_RDONLY)
+    try:
+        for vaddr, size in regions:
+            if vaddr + size > MAX_FILE_OFFSET:
+                continue
+            entries = np.frombuffer(os.pread(fd, size // pgsize * 8, vaddr // pgsize * 8), dtype=np.uint64)
+            in_parent = np.zeros(len(entries), dtype=bool)
+            for prev_vaddr, _, prev_size in parent_regions:
+                lo, hi = max(vaddr, prev_vaddr), min(vaddr + size, prev_vaddr + prev_size)
+                if lo < hi:
+                    in_parent[(lo - vaddr) // pgsize:(hi - vaddr) // pgsize] = True
+            index = int(np.searchsorted(maps.starts, np.uint64(vaddr), side='right')) - 1
+            file_backed = index >= 0 and vaddr < int(maps.ends[index]) and int(maps.inodes[index]) != 0
+            dirty, zero = classify_pages(entries, in_parent, file_backed)
+            runs += page_runs(dirty, vaddr, pgsize)
+            zeros += page_runs(zero, vaddr, pgsize)
+    finally:
+        os.close(fd)
+    return runs, zeros
+
+
+def capture_delta(pid, ckpt_dir: Path, parent_dir: Path, regions):
+    ''' Dump the pages of the (vaddr, size) regions that pid wrote since parent_dir was taken. '''
+    pages, offset = [], 0
+    runs, zeros = dirty_runs(pid, regions, load_regions(parent_dir)[0])
+    with open(f'/proc/{pid}/mem', 'rb', buffering=0) as mem, (ckpt_dir / PAGES_FILENAME).open('wb') as out:
+        for vaddr, size in runs:
+            copy_process_range(mem.fileno(), out.fileno(), vaddr, offset, size)
+            pages.append([vaddr, size, offset])
+            offset += size
+        out.truncate(offset)
+
+    delta = {'parent': os.path.relpath(str(parent_dir), str(ckpt_dir)), 'pages': pages,
+             'zeros': [list(run) for run in zeros]}
+    with (ckpt_dir / DELTA_FILENAME).open('w') as f:
+        json.dump(delta, f)
+    return ckpt_dir / DELTA_FILENAME
+
+
+def is_full(ckpt_dir: Path):
+    return (ckpt_dir / PMEM_FILENAME).exists() or (ckpt_dir / MANIFEST_FILENAME).exists()
+
+
+def delta_chain(ckpt_dir: Path):
+    # the checkpoints from the closest full one down to ckpt_dir
+    chain = [ckpt_dir]
+    while not is_full(chain[-1]):
+        with (chain[-1] / DELTA_FILENAME).open() as f:
+            parent = (chain[-1] / json.load(f)['parent']).resolve()
+        assert parent not in chain, f'{ckpt_dir} has a cyclic delta chain'
+        chain.append(parent)
+    return chain[::-1]
+
+
+def load_regions(ckpt_dir: Path):
+    # (vaddr, paddr, size) of every mapping sorted by vaddr, and mem_size
+    with (ckpt_dir / MMAP_FILENAME).open() as f:
+        mappings = json.load(f)
+    mem_size = mappings.pop('mem_size')
+    regions = sorted((int(vaddr), int(m['paddr']), int(m['size'])) for vaddr, m in mappings.items())
+    return regions, mem_size
+
+
+def raw_image(ckpt_dir: Path, raw_path: Path):
+    ''' A path to the uncompressed pmem of a full checkpoint, raw_path if it had to be made. '''
+    pmem = ckpt_dir / PMEM_FILENAME
+    if not pmem.exists():
+        return materialize(ckpt_dir / MANIFEST_FILENAME, raw_path, raw=True)
+    with pmem.open('rb') as f:
+        if f.read(2) != b'\x1f\x8b':
+            return pmem
+
+    # zero chunks are skipped, the raw image stays as sparse as the memory was
+    zeros = bytes(INFLATE_CHUNK)
+    with gzip.open(str(pmem), 'rb') as src, raw_path.open('wb') as dst:
+        for chunk in iter(lambda: src.read(INFLATE_CHUNK), b''):
+            if chunk == zeros[:len(chunk)]:
+                dst.seek(len(chunk), os.SEEK_CUR)
+            else:
+                dst.write(chunk)
+        dst.truncate()
+    return raw_path
+
+
+def subtract_runs(lo, hi, runs):
+    # the parts of [lo, hi) outside the sorted, disjoint (vaddr, size) runs
+    index = max(bisect.bisect_right(runs, [lo]) - 1, 0)
+    for vaddr, size in runs[index:]:
+        if vaddr >= hi:
+            break
+        if vaddr + size <= lo:
+            continue
+        if vaddr > lo:
+            yield lo, vaddr
+        lo = max(lo, vaddr + size)
+    if lo < hi:
+        yield lo, hi
+
+
+def apply_delta(prev_path: Path, prev_regions, ckpt_dir: Path, out_path: Path):
+    ''' Build the raw pmem of the delta ckpt_dir from the raw pmem of its parent. '''
+    regions, mem_size = load_regions(ckpt_dir)
+    with (ckpt_dir / DELTA_FILENAME).open() as f:
+        delta = json.load(f)
+
+    with prev_path.open('rb') as prev, out_path.open('wb') as out, (ckpt_dir / PAGES_FILENAME).open('rb') as pages:
+        out.truncate(mem_size)
+        # pages that were not written are where the parent had them, at the same vaddr, except
+        # the dropped ones, which stay holes
+        zeros = sorted(delta.get('zeros', []))
+        for vaddr, paddr, size in regions:
+            for prev_vaddr, prev_paddr, prev_size in prev_regions:
+                lo, hi = max(vaddr, prev_vaddr), min(vaddr + size, prev_vaddr + prev_size)
+                for lo, hi in subtract_runs(lo, hi, zeros):
+                    copy_range(prev.fileno(), out.fileno(), prev_paddr + lo - prev_vaddr, paddr + lo - vaddr, hi - lo)
+
+        vaddrs = [vaddr for vaddr, _, _ in regions]
+        for vaddr, size, offset in delta['pages']:
+            start, paddr, _ = regions[bisect.bisect_right(vaddrs, vaddr) - 1]
+            copy_range(pages.fileno(), out.fileno(), offset, paddr + vaddr - start, size)
+    return regions
+
+
+def flatten(ckpt_dir, compress=True, level=DEFAULT_LEVEL, workers=DEFAULT_WORKERS):
+    ''' Write the gem5 pmem of a delta checkpoint, the deltas are kept. '''
+    ckpt_dir = Path(ckpt_dir).resolve()
+    chain = delta_chain(ckpt_dir)
+    output = ckpt_dir / PMEM_FILENAME
+    if len(chain) == 1:
+        return output
+
+    with tempfile.TemporaryDirectory(dir=str(ckpt_dir)) as tmp:
+        prev = raw_image(chain[0], Path(tmp) / chain[0].name)
+        regions, _ = load_regions(chain[0])
+        for ckpt in chain[1:]:
+            out = Path(tmp) / ckpt.name
+            regions = apply_delta(prev, regions, ckpt, out)
+            if prev.parent == Path(tmp):
+                prev.unlink()
+            prev = out
+
+        if compress:
+            compress_memory_image(prev, output, level=level, workers=workers)
+        else:
+            os.replace(str(prev), str(output))
+    return output
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description='turn delta checkpoints into gem5 checkpoints')
+    parser.add_argument('ckpts', nargs='+', help='delta checkpoint directories')
+    parser.add_argument('--raw', action='store_true', help='write an uncompressed pmem')
+    parser.add_argument('-f', '--force', action='store_true', help='overwrite existing pmem files')
+    parser.add_argument('-l', '--level', type=int, help='compression level', default=DEFAULT_LEVEL)
+    parser.add_argument('-j', '--workers', type=int, help='compression threads', default=DEFAULT_WORKERS)
+    args = parser.parse_args()
+
+    for ckpt in map(Path, args.ckpts):
+        if args.force and (ckpt / DELTA_FILENAME).exists() and (ckpt / PMEM_FILENAME).exists():
+            (ckpt / PMEM_FILENAME).unlink()
+        print(flatten(ckpt, not args.raw, args.level, args.workers))
@@ -21,7 +21,6 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
-import re
 import os
 import sys
 import git
@@ -31,15 +30,17 @@ import logging
 import resource
 import datetime
 import fileinput
-import subprocess
+import numpy as np
 
 from pathlib import Path
 
 sys.path.append(str(Path(__file__).parent))
 
 from CheckpointConvert import convert_checkpoint
-from CheckpointTemplate import MemoryMapping, RegisterValues, fill_checkpoint_template
+from MemoryImage import DEFAULT_LEVEL, DEFAULT_WORKERS
+from CheckpointTemplate import MemoryMapping, PageTable, RegisterValues, fill_checkpoint_template
 from Checkpoints import GDBCheckpoint
+from ProcMaps import ProcMaps
 
 try:
     import gdb  # pylint: disable=import-error
@@ -60,17 +61,18 @@ class CONFIGS:
     DEFAULT_PIN_VER    = 'pin-3.11'
 
 
+# gem5's --mem-size has to match the range_size of a checkpoint, it is kept to whole MiB
+PMEM_ALIGN = 1024 * 1024
+
+
 class GDBEngine:
     ''' This class is used by the gdb process running inside gdb.'''
 
-    # start-address end-address size offset name
-    VADDR_REGEX_STRING = r'\s*(0x[0-9a-f]+)\s+0x[0-9a-f]+\s+(0x[0-9a-f]+)\s+(0x[0-9a-f]+)\s*(.*)'
-    VADDR_REGEX = re.compile(VADDR_REGEX_STRING)
-
     BAD_MEM_REGIONS = ['[vvar]', '[vsyscall]']
 
     def __init__(self, cmd: list, ckpt_prefix: Path, run_dir: Path, compress_ckpt=True,
-                 mem_size=4*1024*1024*1024, preserve_intermediate=True):
+                 mem_size=4*1024*1024*1024, preserve_intermediate=True, compress_level=DEFAULT_LEVEL,
+                 compress_workers=DEFAULT_WORKERS, page_store=None, compact=False, compact_headroom=256*1024*1024):
         assert(len(cmd) > 0)
         self.binary = run_dir / cmd[0]
         self.args = cmd[1:]
@@ -86,7 +88,14 @@ class GDBEngine:
 
         self._ckpt_prefix = ckpt_prefix
         self._compress_ckpt = compress_ckpt
+        self._compress_level = compress_level
+        self._compress_workers = compress_workers
+        self._page_store = page_store
         self.mem_size = mem_size
+        # only the pages that hold data are placed in pmem, which then only has room for
+        # compact_headroom more pages allocated while gem5 simulates
+        self._compact = compact
+        self._compact_headroom = compact_headroom
         self._repo = git.Repo(path=__file__, search_parent_directories=True)
         self._preserve_intermediate = preserve_intermediate
 
@@ -142,6 +151,8 @@ class GDBEngine:
         if not ckpt_check():
             return False
 
+        mem_size = self._pmem_size(unexpanded_mmaps)
+
         # get stack mapping
         stack_mapping = [m for v, m in unexpanded_mmaps.items() if 'stack' in m.name]
         assert len(stack_mapping) == 1
@@ -156,7 +167,7 @@ class GDBEngine:
             pc_string=regs.get_pc_string(),
             next_pc_string=regs.get_next_pc_string(),
             float_reg_string=regs.get_float_reg_string(),
-            mem_size=self.mem_size,
+            mem_size=mem_size,
             stack_mapping=stack_mapping,
             brk=brk_value,
             mmap_end=self.mmap_end,
@@ -164,8 +175,10 @@ class GDBEngine:
             repoHEAD=self._repo.head.object.hexsha)
 
         self._dump_core_to_file(coredump_path)
-        self._dump_mappings_to_file(unexpanded_mmaps, self.mem_size, mmap_path)
-        convert_checkpoint(GDBCheckpoint(ckpt_dir, CONFIGS), True, compress=self._compress_ckpt)
+        self._dump_mappings_to_file(unexpanded_mmaps, mem_size, mmap_path)
+        convert_checkpoint(GDBCheckpoint(ckpt_dir, CONFIGS), True, compress=self._compress_ckpt,
+                           compress_level=self._compress_level, compress_workers=self._compress_workers,
+                           page_store=self._page_store)
 
         if not self._preserve_intermediate:
             coredump_path.unlink()
@@ -177,36 +190,18 @@ class GDBEngine:
         return True
 
     def _get_virtual_addresses(self, pid):
-        vaddrs  = []
-        sizes   = []
-        offsets = []
-        names   = []
-        p = subprocess.Popen(['gdb', self.binary, '--batch', '-ex', 'info proc mappings {}'.format(pid)], stdout=subprocess.PIPE)
-        raw_mappings = p.communicate()[0].decode('utf8')
-
         def mmap_filter(name):
             return True
             return CONFIGS.PINTOOL_PLUGIN not in name and os.environ.get('PIN_ROOT', CONFIGS.DEFAULT_PIN_VER) not in name
 
-        for entry in raw_mappings.split(os.linesep):
-            matches = self.VADDR_REGEX.match(entry.strip())
-            if matches:
-                sec_name = str(matches.group(4)).strip()
-                if mmap_filter(sec_name):
-                    vaddrs   += [int(matches.group(1), 16)]
-                    sizes    += [int(matches.group(2), 16)]
-                    offsets  += [int(matches.group(3), 16)]
-                    names    += [sec_name]
-
-        paddrs = []
-        flags = []
-        next_paddr = 0
-        for _, size in zip(vaddrs, sizes):
-            paddrs += [next_paddr]
-            flags += [0]
-            next_paddr += size
-
-        return paddrs, vaddrs, sizes, offsets, flags, names
+        maps = ProcMaps.read(pid)
+        if self._compact:
+            maps = maps.compact(pid)
+        maps = maps.select([mmap_filter(name) for name in maps.names])
+        sizes = maps.sizes
+        paddrs = np.cumsum(sizes) - sizes
+        flags = [0] * len(maps)
+        return paddrs.tolist(), maps.starts.tolist(), sizes.tolist(), maps.offsets.tolist(), flags, maps.names
 
     def _create_mappings(self, pid):
         paddrs, vaddrs, sizes, offsets,flags, names = self._get_virtual_addresses(pid)
@@ -214,20 +209,17 @@ class GDBEngine:
         assert len(paddrs) == len(sizes)
         assert len(paddrs) == len(flags)
         assert len(paddrs) == len(names)
-        mappings = {}
         unexpanded = {}
-        index = 0
-        pgsize = resource.getpagesize()
-        for p, v, s, o, f, name in zip(paddrs, vaddrs, sizes, offsets, flags, names):
+        for index, (p, v, s, o, f, name) in enumerate(zip(paddrs, vaddrs, sizes, offsets, flags, names)):
             unexpanded[v] = MemoryMapping(index, p, v, s, o, f, name)
-            for off in range(0, s, pgsize):
-                paddr = p + off
-                vaddr = v + off
-                offset = o + off
-                mappings[vaddr] = MemoryMapping(
-                    index, paddr, vaddr, pgsize, offset, f, name)
-            index += 1
-        return mappings, unexpanded
+        # one page table entry per page, kept as arrays until the template is filled
+        return PageTable(unexpanded.values(), resource.getpagesize()), unexpanded
+
+    def _pmem_size(self, mappings):
+        if not self._compact:
+            return self.mem_size
+        used = sum(m.size for m in mappings.values()) + self._compact_headroom
+        return (used + PMEM_ALIGN - 1) // PMEM_ALIGN * PMEM_ALIGN
 
     def _dump_core_to_file(self, file_path):
         gdb.execute('set use-coredump-filter off')
@@ -237,7 +229,7 @@ class GDBEngine:
     def _dump_mappings_to_file(self, mappings, mem_size, file_path):
         json_mappings = {'mem_size': mem_size}
         for vaddr, mapping in mappings.items():
-            json_mappings[vaddr] = mapping.__dict__
+            json_mappings[vaddr] = mapping.to_dict()
 
         with file_path.open('w') as f:
             json.dump(json_mappings, f, indent=4)
@@ -321,5 +313,10 @@ if __name__ == "__main__":
     import resource
     resource.setrlimit(resource.RLIMIT_CORE, (resource.RLIM_INFINITY, resource.RLIM_INFINITY))
 
-    engine = GDBEngine(cmd, Path(ckpt_prefix), Path(run_dir))
+    engine = GDBEngine(cmd, Path(ckpt_prefix), Path(run_dir),
+                       compress_level=options.get('compress-level', DEFAULT_LEVEL),
+                       compress_workers=options.get('compress-workers', DEFAULT_WORKERS),
+                       page_store=options.get('page-store'),
+                       compact=options.get('compact', False),
+                       compact_headroom=options.get('compact-headroom-mb', 256) * 1024 * 1024)
     engine.run()
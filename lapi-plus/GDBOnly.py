@@ -27,20 +27,30 @@ import sys
 import git
 import json
 import shutil
+import signal
 import struct
 import logging
+import contextlib
 import resource
 import datetime
 import fileinput
 import subprocess
+import numpy as np
 
 from pathlib import Path
 
 sys.path.append(str(Path(__file__).parent))
 
 from CheckpointConvert import convert_checkpoint
-from CheckpointTemplate import MemoryMapping, RegisterValues, fill_checkpoint_template
+from DeltaCheckpoint import capture_delta, clear_soft_dirty
+from MemoryImage import DEFAULT_LEVEL, DEFAULT_WORKERS
+from CheckpointTemplate import MemoryMapping, PageTable, RegisterValues, fill_checkpoint_template
 from Checkpoints import GDBCheckpoint
+from ProcMaps import ProcMaps
+
+CONVERTER = Path(__file__).parent / 'CheckpointConvert.py'
+# gem5's --mem-size has to match the range_size of a checkpoint, it is kept to whole MiB
+PMEM_ALIGN = 1024 * 1024
 
 try:
     import gdb  # pylint: disable=import-error
@@ -61,17 +71,133 @@ class CONFIGS:
     DEFAULT_PIN_VER    = 'pin-3.11'
 
 
+@contextlib.contextmanager
+def breakpoints_disabled():
+    ''' Keep the breakpoints of the plan from counting hits while GDB runs code in the inferior. '''
+    enabled = [bp for bp in gdb.breakpoints() or () if bp.enabled]
+    for bp in enabled:
+        bp.enabled = False
+    try:
+        yield
+    finally:
+        for bp in enabled:
+            if bp.is_valid():
+                bp.enabled = True
+
+
+class InferiorState:
+    ''' brk and fs_base of the stopped inferior, read without compiling anything.
+
+    Methods are tried cheapest first, the one that worked for an inferior is tried first
+    from then on. The fallbacks that run code in the inferior do so with the breakpoints of
+    the plan disabled, or the hits they cause would be counted against their ignore counts.
+    '''
+
+    SYSCALL = b'\x0f\x05'
+    SYS_BRK = 12
+    SYS_ARCH_PRCTL = 158
+    ARCH_GET_FS = 0x1003
+    # syscall clobbers rax, rcx and r11, rdi and rsi hold the arguments, rip goes last so that
+    # writing it also cancels the syscall restart
+    SAVED_REGS = ['rax', 'rcx', 'r11', 'rdi', 'rsi', 'eflags', 'rip']
+
+    def __init__(self):
+        self._working = {}
+
+    def brk(self):
+        return self._capture('brk', [self._curbrk, self._syscall_brk, self._sbrk])
+
+    def fs_base(self):
+        return self._capture('fs_base', [self._fs_base_register, self._syscall_fs_base])
+
+    def _capture(self, what, methods):
+        key = (gdb.selected_inferior().pid, what)
+        if key in self._working:
+            methods = [self._working[key]] + [m for m in methods if m != self._working[key]]
+        for method in methods:
+            try:
+                value = method()
+            except gdb.error as e:
+                logging.debug(f'{method.__name__} cannot read {what}: {e}')
+                continue
+            if value:
+                if self._working.get(key) != method:
+                    logging.info(f'Reading {what} with {method.__name__}')
+                self._working[key] = method
+                logging.info(f'{what}: {value:#x}')
+                return value
+        raise gdb.error(f'Cannot read {what} of the inferior')
+
+    @staticmethod
+    def _curbrk():
+        # glibc keeps the break in __curbrk, it is what sbrk(0) returns once it is set
+        return int(gdb.parse_and_eval('*(unsigned long *) &__curbrk'))
+
+    def _syscall_brk(self):
+        return self._inject_syscall(self.SYS_BRK, 0)
+
+    @staticmethod
+    def _sbrk():
+        with breakpoints_disabled():
+            return int(gdb.parse_and_eval('((void *(*) (unsigned long)) sbrk)(0)'))
+
+    @staticmethod
+    def _fs_base_register():
+        return int(gdb.parse_and_eval('$fs_base')) & 0xffffffffffffffff
+
+    def _syscall_fs_base(self):
+        # arch_prctl stores fs_base in memory, a word below the red zone of the stack is borrowed
+        inferior = gdb.selected_inferior()
+        scratch = (int(gdb.selected_frame().read_register('rsp')) - 256) & ~7
+        saved = inferior.read_memory(scratch, 8).tobytes()
+        try:
+            if self._inject_syscall(self.SYS_ARCH_PRCTL, self.ARCH_GET_FS, scratch):
+                return None
+            return struct.unpack('<Q', inferior.read_memory(scratch, 8).tobytes())[0]
+        finally:
+            inferior.write_memory(scratch, saved)
+
+    def _inject_syscall(self, number, *args):
+        ''' Execute one syscall instruction at the pc of the stopped inferior, returns rax. '''
+        with breakpoints_disabled():
+            return self._step_syscall(number, *args)
+
+    def _step_syscall(self, number, *args):
+        inferior = gdb.selected_inferior()
+        frame = gdb.selected_frame()
+        saved = {reg: int(frame.read_register(reg)) for reg in self.SAVED_REGS}
+        pc = saved['rip']
+        code = inferior.read_memory(pc, len(self.SYSCALL)).tobytes()
+        locking = gdb.parameter('scheduler-locking')
+        try:
+            inferior.write_memory(pc, self.SYSCALL)
+            gdb.execute('set scheduler-locking on')
+            gdb.execute(f'set $rax = {number}')
+            for reg, arg in zip(['rdi', 'rsi'], args):
+                gdb.execute(f'set ${reg} = {arg}')
+            gdb.execute('stepi', to_string=True)
+            frame = gdb.selected_frame()
+            if int(frame.read_register('rip')) != pc + len(self.SYSCALL):
+                raise gdb.error('the injected syscall was interrupted')
+            result = int(frame.read_register('rax'))
+        finally:
+            inferior.write_memory(pc, code)
+            for reg in self.SAVED_REGS:
+                gdb.execute(f'set ${reg} = {saved[reg]}')
+            gdb.execute(f'set scheduler-locking {locking}')
+        return result
+
+
 class GDBEngine:
     ''' This class is used by the gdb process running inside gdb.'''
 
-    # start-address end-address size offset name
-    VADDR_REGEX_STRING = r'\s*(0x[0-9a-f]+)\s+0x[0-9a-f]+\s+(0x[0-9a-f]+)\s+(0x[0-9a-f]+)\s*(.*)'
-    VADDR_REGEX = re.compile(VADDR_REGEX_STRING)
-
     BAD_MEM_REGIONS = ['[vvar]', '[vsyscall]']
 
     def __init__(self, cmd: list, ckpt_prefix: Path, run_dir: Path, gdb_script: Path, compress_ckpt=True,
-                 mem_size=4*1024*1024*1024, preserve_intermediate=True):
+                 mem_size=4*1024*1024*1024, preserve_intermediate=True, compress_level=DEFAULT_LEVEL,
+                 compress_workers=DEFAULT_WORKERS, dump_core=False, page_store=None,
+                 delta=False, convert_jobs=0, min_free_disk=10*1024*1024*1024, fork_dump=False,
+                 compact=False, compact_headroom=256*1024*1024):
         assert(len(cmd) > 0)
         self.binary = run_dir / cmd[0]
         self.args = cmd[1:]
@@ -81,9 +207,35 @@ class GDBEngine:
         self._ckpt_prefix = ckpt_prefix
         self._gdb_script = gdb_script
         self._compress_ckpt = compress_ckpt
+        self._compress_level = compress_level
+        self._compress_workers = compress_workers
+        self._page_store = page_store
+        self._dump_core = dump_core
+        # delta checkpoints read the pages of the stopped inferior, they need the capture mode
+        self._delta = delta and not dump_core
+        self._parent_ckpt = None
+        # conversions running in the background, the inferior goes on as soon as its state is on disk
+        # a forked copy of the inferior is dumped by a worker while the inferior goes on
+        self._fork_dump = fork_dump and not dump_core
+        self._convert_jobs = max(convert_jobs, 1) if self._fork_dump else convert_jobs
+        self._min_free_disk = min_free_disk
+        self._converters = []
+        self._failed_conversions = []
+        # forked copies killed by their converter, zombies until the inferior waits for them
+        self._unreaped = []
+        if self._fork_dump:
+            logging.warning('fork-dump is experimental: the memory of a checkpoint comes from a forked copy '
+                            'and differs from m5.cpt in the fork frame, the TLS tid and what atfork handlers reset')
+        if delta and dump_core:
+            logging.warning('Delta checkpoints cannot be taken from core files, dumping full checkpoints')
         self.mem_size = mem_size
+        # only the pages that hold data are placed in pmem, which then only has room for
+        # compact_headroom more pages allocated while gem5 simulates
+        self._compact = compact
+        self._compact_headroom = compact_headroom
         self._repo = git.Repo(path=__file__, search_parent_directories=True)
         self._preserve_intermediate = preserve_intermediate
+        self._state = InferiorState()
 
         if self._repo.is_dirty():
             logging.warning('Repo is dirty! Are you developping or running final experiments?')
@@ -93,7 +245,8 @@ class GDBEngine:
         gdb.execute('starti')
 
     def run(self):
-        brkpt_num_pattern = r'Breakpoint +([0-9]+)'
+        # 'Breakpoint 1 at ...' or 'Temporary breakpoint 1 at ...'
+        brkpt_num_pattern = r'breakpoint +([0-9]+)'
         with self._gdb_script.open() as f:
             last_brknum = None
             for gdb_cmd in f:
@@ -113,13 +266,16 @@ class GDBEngine:
                     if gdb_cmd.startswith('delete'):
                         last_brknum = None
                         gdb.execute(gdb_cmd)
-                    elif gdb_cmd.startswith('break'):
+                    elif gdb_cmd.startswith(('break', 'tbreak')):
                         res = gdb.execute(gdb_cmd, to_string=True)
-                        last_brknum = int(re.findall(brkpt_num_pattern, res)[0])
+                        last_brknum = int(re.findall(brkpt_num_pattern, res, re.IGNORECASE)[0])
                         logging.debug(f'BRKPT {last_brknum}')
                         logging.debug(res)
                     else:
                         gdb.execute(gdb_cmd)
+        self._wait_for_converters()
+        if self._failed_conversions:
+            raise RuntimeError(f'{len(self._failed_conversions)} checkpoints failed to convert')
         gdb.execute('q')
 
     def _parse_cmd(self, cmd):
@@ -130,8 +286,8 @@ class GDBEngine:
         logging.info(f'creating {ckpt_id}')
         ckpt_name = f'cpt.None.SIMP-{ckpt_id}'
         brk_ID = 0
-        brk_value = self._get_brk_value()
-        fs_base   = self._get_fs_base()
+        brk_value = self._state.brk()
+        fs_base   = self._state.fs_base()
         ckpt_dir    = self._ckpt_prefix / ckpt_name
         pmem_path     = ckpt_dir / CONFIGS.PMEM_FILENAME
         m5cpt_path    = ckpt_dir / CONFIGS.M5CPT_FILENAME
@@ -162,6 +318,8 @@ class GDBEngine:
         if not ckpt_check():
             return False
 
+        mem_size = self._pmem_size(unexpanded_mmaps)
+
         # get stack mapping
         stack_mapping = [m for v, m in unexpanded_mmaps.items() if 'stack' in m.name]
         assert len(stack_mapping) == 1
@@ -176,143 +334,180 @@ class GDBEngine:
             pc_string=regs.get_pc_string(),
             next_pc_string=regs.get_next_pc_string(),
             float_reg_string=regs.get_float_reg_string(),
-            mem_size=self.mem_size,
+            mem_size=mem_size,
             stack_mapping=stack_mapping,
             brk=brk_value,
             mmap_end=self.mmap_end,
             timeNow=str(datetime.datetime.now(datetime.timezone.utc)),
             repoHEAD=self._repo.head.object.hexsha)
 
-        self._dump_core_to_file(coredump_path)
-        self._dump_mappings_to_file(unexpanded_mmaps, self.mem_size, mmap_path)
-        convert_checkpoint(GDBCheckpoint(ckpt_dir, CONFIGS), True, compress=self._compress_ckpt)
-
-        if not self._preserve_intermediate:
+        self._dump_mappings_to_file(unexpanded_mmaps, mem_size, mmap_path)
+        if self._dump_core:
+            self._dump_core_to_file(coredump_path)
+            pid = None
+        else:
+            # the inferior is stopped, its memory is read straight into pmem
+            pid = gdb.selected_inferior().pid
+        # deltas are rebuilt at the vaddrs of their parents
+        remove_core = self._dump_core and not self._preserve_intermediate
+        remove_mappings = not self._delta and not self._preserve_intermediate
+        if self._unreaped:
+            self._reap_forks()
+        forked = self._fork_inferior() if self._fork_dump and self._parent_ckpt is None else None
+        if self._parent_ckpt is not None:
+            capture_delta(pid, ckpt_dir, self._parent_ckpt, [(v, m.size) for v, m in unexpanded_mmaps.items()])
+            remove_core = remove_mappings = False
+        elif forked is not None:
+            self._convert_async(ckpt_dir, False, remove_core, remove_mappings, pid=forked)
+            remove_core = remove_mappings = False
+        elif self._convert_jobs:
+            if pid is not None:
+                # only reading the memory needs the inferior stopped
+                convert_checkpoint(GDBCheckpoint(ckpt_dir, CONFIGS), True, compress=False, pid=pid)
+            self._convert_async(ckpt_dir, pid is not None, remove_core, remove_mappings)
+            remove_core = remove_mappings = False
+        else:
+            convert_checkpoint(GDBCheckpoint(ckpt_dir, CONFIGS), True, compress=self._compress_ckpt,
+                               compress_level=self._compress_level, compress_workers=self._compress_workers, pid=pid,
+                               page_store=self._page_store)
+        if self._delta:
+            # the next checkpoint only dumps what is written from here on
+            self._parent_ckpt = ckpt_dir if clear_soft_dirty(pid) else None
+            if self._parent_ckpt is None:
+                logging.warning('No soft-dirty page tracking, the next checkpoint is a full one')
+
+        if remove_core:
             coredump_path.unlink()
+        if remove_mappings:
             mmap_path.unlink()
 
         return True
 
-    def _get_brk_value(self):
-        def method1():
-            ret = gdb.execute('print ((void *(*) (unsigned long)) sbrk)(0)', to_string=True)
-            brk = int(re.findall('0x[0-9a-fA-F]+', ret)[0], base=16)
-            return brk
-
-        def method2():
-            gdb.execute('set language c')
-            brk_c = (Path(__file__).parent / 'get_brk_glibc.c').resolve()
-            print(f'compile file -raw {brk_c}')
-            gdb.execute(f'compile file -raw {brk_c}', to_string=True)
-            gdb.execute('set language auto')
-
-            brk_file = Path('sbrk.dat')
-            with brk_file.open('r') as f:
-                brk_val = int(f.read(), base=16)
-            return brk_val
-
-        def method3():
-            gdb.execute('set language c')
-            brk_c = (Path(__file__).parent / 'get_brk.c').resolve()
-            brk_c_fallback = (Path(__file__).parent / 'get_brk_noclose.c').resolve()
-
-            try:
-                print(f'compile file -raw {brk_c}')
-                gdb.execute(f'compile file -raw {brk_c}', to_string=True)
-            except gdb.error:
-                logging.warning('Falling back to no close')
-                print(f'compile file -raw {brk_c_fallback}')
-                gdb.execute(f'compile file -raw {brk_c_fallback}', to_string=True)
-
-            gdb.execute('set language auto')
-
-            brk_file = Path('sbrk.dat')
-            with brk_file.open('rb') as f:
-                brk_val = struct.unpack('Q', f.read()[:8])[0]
-            return brk_val
-
+    def _convert_async(self, ckpt_dir, raw_pmem, remove_core, remove_mappings, pid=None):
+        # conversion runs in a python3 process of its own, the GIL of GDB's Python stays free
+        self._wait_for_converters(self._convert_jobs - 1)
+        cmd = ['python3', str(CONVERTER), str(ckpt_dir), '--core', CONFIGS.COREDUMP_FILENAME,
+               '--mappings', CONFIGS.MMAP_FILENAME, '--pmem', CONFIGS.PMEM_FILENAME,
+               '-l', str(self._compress_level), '-j', str(self._compress_workers)]
+        if raw_pmem:
+            cmd.append('--raw-pmem')
+        if pid is not None:
+            cmd += ['--pid', str(pid), '--kill-pid']
+        if not self._compress_ckpt:
+            cmd.append('--no-compress')
+        if self._page_store is not None:
+            cmd += ['--page-store', str(self._page_store)]
+        if remove_core:
+            cmd.append('--remove-core')
+        if remove_mappings:
+            cmd.append('--remove-mappings')
+        with (ckpt_dir / 'convert.log').open('wb') as log:
+            self._converters.append((ckpt_dir, subprocess.Popen(cmd, stdout=log, stderr=subprocess.STDOUT), pid))
+        logging.debug(f'Converting {ckpt_dir} in the background')
+
+    def _fork_inferior(self):
+        ''' Fork the stopped inferior with GDB's checkpoint, returns the pid of the stopped and
+        detached child, or None if the inferior cannot fork.
+
+        The child is a copy made by fork() called inside the inferior, so its memory is not
+        exactly what m5.cpt describes: the call frame of fork() below the stack pointer, the tid
+        in the thread's TLS and what the atfork handlers of libc reset (e.g. malloc locks) differ
+        from the parent whose registers and mappings are dumped, and MADV_WIPEONFORK memory
+        reads as zeros. That is why fork-dump is opt-in.
+
+        fork(), prctl() and the waitpid() of a deleted checkpoint run in the inferior, the
+        breakpoints of the plan are disabled meanwhile so that they count no hits.
+        '''
+        with breakpoints_disabled():
+            return self._fork_stopped()
+
+    def _fork_stopped(self):
         try:
-            brk_val = method1()
-        except gdb.error:
-            logging.warning('Falling back to method 2')
-            try:
-                brk_val = method2()
-            except gdb.error:
-                logging.warning('Falling back to method 3')
-                brk_val = method3()
-
-        logging.info(f'brk value: {brk_val:#x}')
-        return brk_val
-
-    def _get_fs_base(self):
-        def method1():
-            gdb.execute('set language c')
-            fs_c = (Path(__file__).parent / 'get_fs_base_glibc.c').resolve()
-            print(f'compile file -raw {fs_c}')
-            gdb.execute(f'compile file -raw {fs_c}', to_string=True)
-            gdb.execute('set language auto')
-
-            fs_file = Path('fs_base.dat')
-            with fs_file.open('r') as f:
-                fs_base = int(f.read(), base=16)
-            return fs_base
-
-        def method2():
-            gdb.execute('set language c')
-            fs_c = (Path(__file__).parent / 'get_fs_base.c').resolve()
-            fs_c_fallback = (Path(__file__).parent / 'get_fs_base_noclose.c').resolve()
-
-            try:
-                print(f'compile file -raw {fs_c}')
-                gdb.execute(f'compile file -raw {fs_c}', to_string=True)
-            except gdb.error:
-                logging.warning('Falling back to no close')
-                print(f'compile file -raw {fs_c_fallback}')
-                gdb.execute(f'compile file -raw {fs_c_fallback}', to_string=True)
-
-            gdb.execute('set language auto')
-
-            fs_file = Path('fs_base.dat')
-            with fs_file.open('rb') as f:
-                fs_base = struct.unpack('Q', f.read()[:8])[0]
-            return fs_base
-
+            res = gdb.execute('checkpoint', to_string=True)
+            number, pid = re.findall(r'checkpoint (\d+): fork returned pid (\d+)', res)[0]
+        except (gdb.error, IndexError) as e:
+            logging.warning(f'Cannot fork the inferior ({e}), dumping it in place')
+            return None
+        pid = int(pid)
+        try:
+            if self._ptrace_scope == 1:
+                # yama only lets a process that is not GDB read the child if the child allows it
+                gdb.execute(f'restart {number}', to_string=True)
+                try:
+                    gdb.execute('call (int) prctl(0x59616d61, (unsigned long) -1, 0, 0, 0)', to_string=True)
+                finally:
+                    gdb.execute('restart 0', to_string=True)
+            # the child would run away once detached, the pending SIGSTOP keeps it where it is
+            os.kill(pid, signal.SIGSTOP)
+            gdb.execute(f'detach checkpoint {number}', to_string=True)
+        except (gdb.error, OSError) as e:
+            if gdb.selected_inferior().pid == pid:
+                raise RuntimeError(f'GDB is left on the forked copy {pid} of the inferior') from e
+            logging.warning(f'Cannot hand the forked inferior over ({e}), dumping it in place')
+            self._drop_fork(number, pid)
+            return None
+        return pid
+
+    def _drop_fork(self, number, pid):
+        # a copy that no converter is going to kill must not outlive the replay, GDB reaps a
+        # deleted checkpoint itself
         try:
-            fs_base = method1()
+            gdb.execute(f'delete checkpoint {number}', to_string=True)
+            return
         except gdb.error:
-            logging.warning('Falling back to method 2')
-            fs_base = method2()
+            pass
+        try:
+            os.kill(pid, signal.SIGKILL)
+            self._unreaped.append(pid)
+        except ProcessLookupError:
+            pass
+
+    def _reap_forks(self):
+        # the inferior is the parent of the detached copies, it has to wait for the killed ones
+        with breakpoints_disabled():
+            for pid in list(self._unreaped):
+                try:
+                    res = gdb.execute(f'call (int) waitpid({pid}, 0, 1)', to_string=True)
+                except gdb.error as e:
+                    logging.warning(f'Cannot reap the forked copy {pid}: {e}')
+                    res = ''
+                # 0 while the copy is still alive, it is tried again at the next checkpoint
+                if not res.strip().endswith('= 0'):
+                    self._unreaped.remove(pid)
 
-        logging.info(f'fs_base: {fs_base:#x}')
-        return fs_base
+    @property
+    def _ptrace_scope(self):
+        scope = Path('/proc/sys/kernel/yama/ptrace_scope')
+        return int(scope.read_text()) if scope.exists() else 0
+
+    def _wait_for_converters(self, max_running=0):
+        # back-pressure: wait until at most max_running conversions are left and the disk has room
+        while True:
+            self._converters = [c for c in self._converters if not self._converted(*c)]
+            disk_full = shutil.disk_usage(str(self._ckpt_prefix)).free < self._min_free_disk
+            if not self._converters or (len(self._converters) <= max_running and not disk_full):
+                return
+            self._converters[0][1].wait()
+
+    def _converted(self, ckpt_dir, proc, pid):
+        if proc.poll() is None:
+            return False
+        if pid is not None:
+            self._unreaped.append(pid)
+        if proc.returncode:
+            logging.error(f'Converting {ckpt_dir} failed, see {ckpt_dir / "convert.log"}')
+            self._failed_conversions.append(ckpt_dir)
+        return True
 
     def _get_virtual_addresses(self):
-        vaddrs  = []
-        sizes   = []
-        offsets = []
-        names   = []
-        raw_mappings = gdb.execute('info proc mappings', to_string=True)
-        with open('proc.map', 'w') as f:
-            f.write(raw_mappings)
-
-        for entry in raw_mappings.split(os.linesep):
-            matches = self.VADDR_REGEX.match(entry.strip())
-            if matches:
-                sec_name = str(matches.group(4)).strip()
-                vaddrs   += [int(matches.group(1), 16)]
-                sizes    += [int(matches.group(2), 16)]
-                offsets  += [int(matches.group(3), 16)]
-                names    += [sec_name]
-
-        paddrs = []
-        flags = []
-        next_paddr = 0
-        for _, size in zip(vaddrs, sizes):
-            paddrs += [next_paddr]
-            flags += [0]
-            next_paddr += size
-
-        return paddrs, vaddrs, sizes, offsets, flags, names
+        pid = gdb.selected_inferior().pid
+        maps = ProcMaps.read(pid)
+        if self._compact:
+            maps = maps.compact(pid)
+        sizes = maps.sizes
+        paddrs = np.cumsum(sizes) - sizes
+        flags = [0] * len(maps)
+        return paddrs.tolist(), maps.starts.tolist(), sizes.tolist(), maps.offsets.tolist(), flags, maps.names
 
     def _create_mappings(self):
         paddrs, vaddrs, sizes, offsets, flags, names = self._get_virtual_addresses()
@@ -320,20 +515,17 @@ class GDBEngine:
         assert len(paddrs) == len(sizes)
         assert len(paddrs) == len(flags)
         assert len(paddrs) == len(names)
-        mappings = {}
         unexpanded = {}
-        index = 0
-        pgsize = resource.getpagesize()
-        for p, v, s, o, f, name in zip(paddrs, vaddrs, sizes, offsets, flags, names):
+        for index, (p, v, s, o, f, name) in enumerate(zip(paddrs, vaddrs, sizes, offsets, flags, names)):
             unexpanded[v] = MemoryMapping(index, p, v, s, o, f, name)
-            for off in range(0, s, pgsize):
-                paddr = p + off
-                vaddr = v + off
-                offset = o + off
-                mappings[vaddr] = MemoryMapping(
-                    index, paddr, vaddr, pgsize, offset, f, name)
-            index += 1
-        return mappings, unexpanded
+        # one page table entry per page, kept as arrays until the template is filled
+        return PageTable(unexpanded.values(), resource.getpagesize()), unexpanded
+
+    def _pmem_size(self, mappings):
+        if not self._compact:
+            return self.mem_size
+        used = sum(m.size for m in mappings.values()) + self._compact_headroom
+        return (used + PMEM_ALIGN - 1) // PMEM_ALIGN * PMEM_ALIGN
 
     def _dump_core_to_file(self, file_path):
         gdb.execute('set use-coredump-filter off')
@@ -343,7 +535,7 @@ class GDBEngine:
     def _dump_mappings_to_file(self, mappings, mem_size, file_path):
         json_mappings = {'mem_size': mem_size}
         for vaddr, mapping in mappings.items():
-            json_mappings[vaddr] = mapping.__dict__
+            json_mappings[vaddr] = mapping.to_dict()
 
         with file_path.open('w') as f:
             json.dump(json_mappings, f, indent=4)
@@ -430,5 +622,15 @@ if __name__ == "__main__":
     import resource
     resource.setrlimit(resource.RLIMIT_CORE, (resource.RLIM_INFINITY, resource.RLIM_INFINITY))
 
-    engine = GDBEngine(cmd, ckpt_prefix, run_dir, run_dir / 'gdb.cmd')
+    engine = GDBEngine(cmd, ckpt_prefix, run_dir, run_dir / 'gdb.cmd',
+                       compress_level=options.get('compress-level', DEFAULT_LEVEL),
+                       compress_workers=options.get('compress-workers', DEFAULT_WORKERS),
+                       dump_core=options.get('dump-core', False),
+                       page_store=options.get('page-store'),
+                       delta=options.get('delta', False),
+                       convert_jobs=options.get('convert-jobs', 0),
+                       min_free_disk=options.get('min-free-gb', 10) * 1024 * 1024 * 1024,
+                       fork_dump=options.get('fork-dump', False),
+                       compact=options.get('compact', False),
+                       compact_headroom=options.get('compact-headroom-mb', 256) * 1024 * 1024)
     engine.run()
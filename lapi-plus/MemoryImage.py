@@ -0,0 +1,163 @@
+#! /usr/bin/env python3
+
+# gzip writer for gem5 memory images. The image is written as concatenated gzip members,
+# which gem5 reads like a single stream, so zero runs can be emitted as members that are
+# compressed once and reused instead of deflating gigabytes of zeros.
+
+import os
+import errno
+import zlib
+import struct
+import functools
+
+from pathlib import Path
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+
+DEFAULT_LEVEL = 6
+CHUNK_SIZE = 16 * 1024 * 1024
+MAX_ZERO_RUN = 64 * 1024 * 1024
+DEFAULT_WORKERS = os.cpu_count() or 1
+
+# no file name, no mtime, unknown OS
+GZIP_HEADER = b'\x1f\x8b\x08\x00\x00\x00\x00\x00\x00\xff'
+
+
+def gzip_member(data, level=DEFAULT_LEVEL):
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+    return b''.join((GZIP_HEADER, compressor.compress(data), compressor.flush(),
+                     struct.pack('<II', zlib.crc32(data), len(data) & 0xffffffff)))
+
+
+@functools.lru_cache(maxsize=None)
+def zero_member(size, level=DEFAULT_LEVEL):
+    return gzip_member(bytes(size), level)
+
+
+def zero_members(size, level=DEFAULT_LEVEL):
+    # a zero run is split into power-of-two runs, so only a few members are ever compressed
+    while size > 0:
+        run = min(MAX_ZERO_RUN, 1 << (size.bit_length() - 1))
+        yield zero_member(run, level)
+        size -= run
+
+
+def data_regions(fd, size):
+    ''' (start, end) of the parts of fd below size that may hold data, the rest are holes. '''
+    offset = 0
+    while offset < size:
+        try:
+            start = os.lseek(fd, offset, os.SEEK_DATA)
+        except AttributeError:
+            yield offset, size
+            return
+        except OSError as e:
+            if e.errno == errno.ENXIO:
+                return
+            # the file system cannot tell holes apart, everything is data
+            yield offset, size
+            return
+        if start >= size:
+            return
+        end = min(os.lseek(fd, start, os.SEEK_HOLE), size)
+        yield start, end
+        offset = end
+
+
+def image_runs(fd, size):
+    # (offset, length) of the chunks of fd to compress, offset is None for a run of zeros
+    offset = 0
+    for start, end in data_regions(fd, min(size, os.fstat(fd).st_size)):
+        if start > offset:
+            yield None, start - offset
+        for chunk in range(start, end, CHUNK_SIZE):
+            yield chunk, min(CHUNK_SIZE, end - chunk)
+        offset = end
+    if size > offset:
+        yield None, size - offset
+
+
+def image_members(fd, size, level=DEFAULT_LEVEL, workers=DEFAULT_WORKERS):
+    ''' gzip members of the first size bytes of fd, everything past its end reads as zeros.
+
+    Chunks are read and compressed in a thread pool, zlib releases the GIL while it deflates.
+    At most two chunks per worker are in flight, the members come out in file order.
+    '''
+    def compress(offset, length):
+        return gzip_member(os.pread(fd, length, offset), level)
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        for offset, length in image_runs(fd, size):
+            if offset is None:
+                pending.extend(zero_members(length, level))
+            else:
+                pending.append(pool.submit(compress, offset, length))
+            while pending and (len(pending) > 2 * workers or not isinstance(pending[0], Future)):
+                member = pending.popleft()
+                yield member.result() if isinstance(member, Future) else member
+        for member in pending:
+            yield member.result() if isinstance(member, Future) else member
+
+
+def compress_memory_image(src_path, dst_path, size=None, level=DEFAULT_LEVEL, workers=DEFAULT_WORKERS):
+    ''' gzip src_path into dst_path, the time spent scales with the data in src_path.
+
+    Holes are found with SEEK_DATA/SEEK_HOLE. If size is larger than src_path, the image
+    is padded with zeros up to it.
+    '''
+    fd = os.open(str(src_path), os.O_RDONLY)
+    try:
+        size = os.fstat(fd).st_size if size is None else size
+        with Path(dst_path).open('wb') as out:
+            for member in image_members(fd, size, level, workers):
+                out.write(member)
+    finally:
+        os.close(fd)
+    return dst_path
+
+
+def zero_memory_image(dst_path, size, level=DEFAULT_LEVEL):
+    ''' Write a gzipped memory image of size zero bytes without a raw file. '''
+    with Path(dst_path).open('wb') as out:
+        out.writelines(zero_members(size, level))
+    return dst_path
+
+
+def benchmark(src_path, level, max_workers):
+    # throughput of compress_memory_image over doubling worker counts, the output is discarded
+    import time
+    fd = os.open(str(src_path), os.O_RDONLY)
+    try:
+        size = os.fstat(fd).st_size
+        data = sum(length for offset, length in image_runs(fd, size) if offset is not None)
+    finally:
+        os.close(fd)
+    workers = 1
+    while True:
+        begin = time.perf_counter()
+        compress_memory_image(src_path, os.devnull, level=level, workers=workers)
+        seconds = time.perf_counter() - begin
+        print(f'{workers:>3} workers: {seconds:7.2f}s, {data / seconds / 2**20:8.1f} MiB/s of data, '
+              f'{size / seconds / 2**20:8.1f} MiB/s of image')
+        if workers >= max_workers:
+            break
+        workers = min(workers * 2, max_workers)
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description='gzip a raw memory image for gem5')
+    parser.add_argument('src', type=str, help='raw memory image')
+    parser.add_argument('-o', '--output', type=str, help='gzipped image, default: <src>.gz', default=None)
+    parser.add_argument('-s', '--size', type=int, help='pad the image with zeros up to this size', default=None)
+    parser.add_argument('-l', '--level', type=int, help='compression level', default=DEFAULT_LEVEL)
+    parser.add_argument('-j', '--workers', type=int, help='compression threads', default=DEFAULT_WORKERS)
+    parser.add_argument('--benchmark', action='store_true', help='measure the throughput from 1 up to -j workers')
+    args = parser.parse_args()
+    assert args.workers > 0
+
+    if args.benchmark:
+        benchmark(args.src, args.level, args.workers)
+    else:
+        compress_memory_image(args.src, args.output or args.src + '.gz', args.size, args.level, args.workers)
@@ -0,0 +1,174 @@
+#! /usr/bin/env python3
+
+# Content-addressed store for checkpoint memory. The mapped memory of a checkpoint is cut into
+# chunks aligned to its mappings, every chunk is kept once in the store as a gzip member named
+# by the hash of its content, and the checkpoint only keeps a manifest of (paddr, size, hash).
+# Text, shared libraries and input data are the same in most checkpoints of a benchmark, so
+# they are stored and compressed once. gem5's pmem is rebuilt from the manifest on demand.
+
+import os
+import sys
+import json
+import zlib
+import hashlib
+
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.append(str(Path(__file__).parent))
+
+from MemoryImage import DEFAULT_LEVEL, DEFAULT_WORKERS, gzip_member, zero_members
+
+MANIFEST_FILENAME = 'pmem.manifest'
+PMEM_FILENAME = 'system.physmem.store0.pmem'
+DEFAULT_CHUNK = 64 * 1024
+
+
+class PageStore:
+
+    def __init__(self, root):
+        self.root = Path(root)
+
+    @staticmethod
+    def digest(data):
+        return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+    def path_of(self, digest):
+        return self.root / digest[:2] / digest
+
+    def put(self, data, level=DEFAULT_LEVEL):
+        # a chunk that is already stored is neither compressed nor written again
+        digest = self.digest(data)
+        path = self.path_of(digest)
+        if not path.exists():
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = path.with_name(f'{digest}.{os.getpid()}.{id(data)}.tmp')
+            with tmp_path.open('wb') as f:
+                f.write(gzip_member(data, level))
+            os.replace(tmp_path, path)
+        return digest
+
+    def get(self, digest):
+        ''' The gzip member of a chunk. '''
+        with self.path_of(digest).open('rb') as f:
+            return f.read()
+
+    def missing(self, chunks):
+        return [digest for _, _, digest in chunks if not self.path_of(digest).exists()]
+
+
+def store_memory_image(src_path, regions, store: PageStore, manifest_path, mem_size,
+                       chunk_size=DEFAULT_CHUNK, level=DEFAULT_LEVEL, workers=DEFAULT_WORKERS):
+    ''' Put the (paddr, size) regions of a raw memory image into store and write its manifest.
+
+    Chunks start at the beginning of every region, so a mapping holds the same chunks wherever
+    it is placed in pmem. Chunks of zeros are not stored, they are the gaps of the manifest.
+    '''
+    zeros = bytes(chunk_size)
+    fd = os.open(str(src_path), os.O_RDONLY)
+
+    def put(paddr, size):
+        data = os.pread(fd, size, paddr)
+        if data == zeros[:len(data)]:
+            return None
+        return paddr, len(data), store.put(data, level)
+
+    try:
+        jobs = [(paddr + offset, min(chunk_size, size - offset))
+                for paddr, size in regions for offset in range(0, size, chunk_size)]
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            chunks = [chunk for chunk in pool.map(lambda job: put(*job), jobs) if chunk is not None]
+    finally:
+        os.close(fd)
+
+    manifest = {
+        'mem_size': mem_size,
+        'chunk_size': chunk_size,
+        'store': os.path.relpath(str(store.root), str(Path(manifest_path).parent)),
+        'chunks': sorted(chunks)
+    }
+    with Path(manifest_path).open('w') as f:
+        json.dump(manifest, f)
+    return manifest_path
+
+
+def load_manifest(manifest_path):
+    manifest_path = Path(manifest_path)
+    with manifest_path.open() as f:
+        manifest = json.load(f)
+    return manifest, PageStore(manifest_path.parent / manifest['store'])
+
+
+def materialize(manifest_path, output_path=None, raw=False, level=DEFAULT_LEVEL):
+    ''' Rebuild gem5's pmem of a checkpoint from its manifest.
+
+    The stored chunks already are gzip members, a gzipped pmem is the chunks and the zero
+    members of the gaps in paddr order, nothing is compressed again.
+    '''
+    manifest, store = load_manifest(manifest_path)
+    output_path = Path(output_path or Path(manifest_path).parent / PMEM_FILENAME)
+    missing = store.missing(manifest['chunks'])
+    if missing:
+        raise FileNotFoundError(f'{len(missing)} chunks of {manifest_path} are not in {store.root}')
+
+    with output_path.open('wb') as out:
+        if raw:
+            out.truncate(manifest['mem_size'])
+            for paddr, size, digest in manifest['chunks']:
+                os.pwrite(out.fileno(), zlib.decompress(store.get(digest), 16 + zlib.MAX_WBITS), paddr)
+        else:
+            offset = 0
+            for paddr, size, digest in manifest['chunks']:
+                out.writelines(zero_members(paddr - offset, level))
+                out.write(store.get(digest))
+                offset = paddr + size
+            out.writelines(zero_members(manifest['mem_size'] - offset, level))
+    return output_path
+
+
+def store_usage(manifest_paths):
+    # logical size of the chunks of all manifests and what their distinct chunks take in the store
+    logical, distinct = 0, {}
+    for manifest_path in manifest_paths:
+        manifest, store = load_manifest(manifest_path)
+        for _, size, digest in manifest['chunks']:
+            logical += size
+            if digest not in distinct:
+                path = store.path_of(digest)
+                distinct[digest] = path.stat().st_size if path.exists() else 0
+    return logical, len(distinct), sum(distinct.values())
+
+
+def find_manifests(paths):
+    for path in map(Path, paths):
+        if path.is_dir():
+            yield from sorted(path.glob(f'**/{MANIFEST_FILENAME}'))
+        else:
+            yield path
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description='deduplicated checkpoint memory')
+    subparsers = parser.add_subparsers(dest='command')
+
+    materialize_parser = subparsers.add_parser('materialize', help='rebuild system.physmem.store0.pmem')
+    materialize_parser.add_argument('paths', nargs='+', help='manifests, or directories searched for them')
+    materialize_parser.add_argument('--raw', action='store_true', help='write an uncompressed pmem')
+    materialize_parser.add_argument('-f', '--force', action='store_true', help='overwrite existing pmem files')
+    materialize_parser.add_argument('-j', '--workers', type=int, help='checkpoints rebuilt at once', default=DEFAULT_WORKERS)
+
+    usage_parser = subparsers.add_parser('usage', help='show how much the store deduplicates')
+    usage_parser.add_argument('paths', nargs='+', help='manifests, or directories searched for them')
+    args = parser.parse_args()
+
+    if args.command == 'materialize':
+        manifests = [m for m in find_manifests(args.paths) if args.force or not (m.parent / PMEM_FILENAME).exists()]
+        with ThreadPoolExecutor(max_workers=args.workers) as pool:
+            for pmem in pool.map(lambda m: materialize(m, raw=args.raw), manifests):
+                print(pmem)
+    elif args.command == 'usage':
+        logical, num_chunks, stored = store_usage(find_manifests(args.paths))
+        print(f'{logical / 2**20:.0f} MiB in checkpoints, {num_chunks} distinct chunks, {stored / 2**20:.0f} MiB stored')
+    else:
+        parser.print_help(sys.stderr)
@@ -0,0 +1,116 @@
+# Reader of /proc/<pid>/maps. The mappings are kept as arrays, one entry per line, with the
+# permissions as bits so that guard regions (---p) and the like can be filtered without text.
+
+import os
+import resource
+import itertools
+import numpy as np
+
+from pathlib import Path
+
+PERM_READ   = 1
+PERM_WRITE  = 2
+PERM_EXEC   = 4
+PERM_SHARED = 8
+
+# pagemap bits of a page that holds data, in memory or in swap
+PAGE_PRESENT = np.uint64(1 << 63)
+PAGE_SWAPPED = np.uint64(1 << 62)
+# kernel mappings and the stack gem5 grows are never cut
+WHOLE_MAPPINGS = {'[stack]', '[vvar]', '[vdso]', '[vsyscall]'}
+
+
+def perm_bits(perms):
+    return ((perms[0] == 'r') * PERM_READ | (perms[1] == 'w') * PERM_WRITE |
+            (perms[2] == 'x') * PERM_EXEC | (perms[3] == 's') * PERM_SHARED)
+
+
+# every permission string the kernel prints, e.g. 'r-xp'
+PERM_BITS = {''.join(perms): perm_bits(perms) for perms in itertools.product('r-', 'w-', 'x-', 'sp')}
+
+
+class ProcMaps:
+    __slots__ = ('starts', 'ends', 'perms', 'offsets', 'inodes', 'names')
+
+    def __init__(self, starts, ends, perms, offsets, inodes, names):
+        self.starts  = starts
+        self.ends    = ends
+        self.perms   = perms
+        self.offsets = offsets
+        self.inodes  = inodes
+        self.names   = names
+
+    @classmethod
+    def parse(cls, text):
+        starts, ends, perms, offsets, inodes, names = [], [], [], [], [], []
+        for line in text.splitlines():
+            # start-end perms offset dev inode [name], the name may hold spaces
+            fields = line.split(maxsplit=5)
+            if len(fields) < 5:
+                continue
+            start, _, end = fields[0].partition('-')
+            starts.append(int(start, 16))
+            ends.append(int(end, 16))
+            perms.append(PERM_BITS[fields[1]])
+            offsets.append(int(fields[2], 16))
+            inodes.append(int(fields[4]))
+            names.append(fields[5].strip() if len(fields) > 5 else '')
+        return cls(np.array(starts, dtype=np.uint64), np.array(ends, dtype=np.uint64),
+                   np.array(perms, dtype=np.uint8), np.array(offsets, dtype=np.uint64),
+                   np.array(inodes, dtype=np.uint64), names)
+
+    @classmethod
+    def read(cls, pid='self'):
+        return cls.parse(Path(f'/proc/{pid}/maps').read_text())
+
+    def __len__(self):
+        return len(self.names)
+
+    @property
+    def sizes(self):
+        return self.ends - self.starts
+
+    def accessible(self):
+        ''' Mask of the mappings that are not PROT_NONE. '''
+        return (self.perms & (PERM_READ | PERM_WRITE | PERM_EXEC)) != 0
+
+    def select(self, mask):
+        mask = np.asarray(mask, dtype=bool)
+        return ProcMaps(self.starts[mask], self.ends[mask], self.perms[mask], self.offsets[mask],
+                        self.inodes[mask], [name for name, keep in zip(self.names, mask.tolist()) if keep])
+
+    def present_runs(self, pagemap_fd, index):
+        # (start, end) of the runs of pages of mapping index that hold data
+        pgsize = resource.getpagesize()
+        start, end = int(self.starts[index]), int(self.ends[index])
+        entries = np.frombuffer(os.pread(pagemap_fd, (end - start) // pgsize * 8, start // pgsize * 8), dtype=np.uint64)
+        present = np.concatenate(([False], (entries & (PAGE_PRESENT | PAGE_SWAPPED)) != 0, [False]))
+        edges = np.flatnonzero(present[1:] != present[:-1]).reshape(-1, 2)
+        return [(start + int(first) * pgsize, start + int(last) * pgsize) for first, last in edges]
+
+    def compact(self, pid):
+        ''' The mappings of pid without PROT_NONE ones, and anonymous mappings cut down to the
+        pages that were ever touched. File backed pages read as the file whether they are
+        present or not, so those mappings stay whole.
+        '''
+        starts, ends, perms, offsets, inodes, names = [], [], [], [], [], []
+        fd = os.open(f'/proc/{pid}/pagemap', os.O_RDONLY)
+        try:
+            for index in np.flatnonzero(self.accessible()).tolist():
+                name = self.names[index]
+                if self.inodes[index] or name in WHOLE_MAPPINGS:
+                    runs = [(int(self.starts[index]), int(self.ends[index]))]
+                else:
+                    runs = self.present_runs(fd, index)
+                for start, end in runs:
+                    starts.append(start)
+                    ends.append(end)
+                    perms.append(self.perms[index])
+                    offsets.append(self.offsets[index])
+                    inodes.append(self.inodes[index])
+                    names.append(name)
+        finally:
+            os.close(fd)
+        return ProcMaps(np.array(starts, dtype=np.uint64), np.array(ends, dtype=np.uint64),
+                        np.array(perms, dtype=np.uint8), np.array(offsets, dtype=np.uint64),
+                        np.array(inodes, dtype=np.uint64), names)
@@ -0,0 +1,6 @@
+import sys
+
+from pathlib import Path
+
+# the scripts import each other as top-level modules
+sys.path.append(str(Path(__file__).parent))
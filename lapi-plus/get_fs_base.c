@@ -1,52 +0,0 @@
-// MIT License
-//
-// Copyright (c) 2019 Ian Glen Neal
-// Modified by: Copyright (c) 2019-2020 Neil Zhao
-//
-// Permission is hereby granted, free of charge, to any person obtaining a copy
-// of this software and associated documentation files (the "Software"), to deal
-// in the Software without restriction, including without limitation the rights
-// to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
-// copies of the Software, and to permit persons to whom the Software is
-// furnished to do so, subject to the following conditions:
-//
-// The above copyright notice and this permission notice shall be included in all
-// copies or substantial portions of the Software.
-//
-// THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
-// IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
-// FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
-// AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
-// LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
-// OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
-// SOFTWARE.
-
-//gistsnip:start:fsreghack2
-#define _GNU_SOURCE
-#include <unistd.h>
-#include <stdlib.h>
-#include <stdint.h>
-#include <stdio.h>
-#include <stdarg.h>
-#include <sys/syscall.h>
-#include <sys/types.h>
-#include <sys/stat.h>
-#include <fcntl.h>
-#include <inttypes.h>
-
-
-void get_fs_base(uint64_t *ret) {
-    register int       syscall_no  asm("rax") = 158;
-    register int       arg1        asm("rdi") = 0x1003;
-    register uint64_t *arg2        asm("rsi") = ret;
-    asm("syscall");
-}
-
-void _gdb_expr() {
-    char buf[BUFSIZ] = {'\0'};
-    uint64_t addr = 0;
-    get_fs_base(&addr);
-    int fd = open("fs_base.dat", O_CREAT | O_WRONLY, 0666);
-    write(fd, &addr, BUFSIZ);
-    close(fd);
-}
@@ -0,0 +1,20 @@
+import sys
+import signal
+import subprocess
+
+from pathlib import Path
+
+CONVERTER = Path(__file__).parent / 'CheckpointConvert.py'
+
+
+def test_kill_pid_when_capture_fails(tmp_path):
+    # there is no mappings.json to capture with, the forked copy still has to go
+    child = subprocess.Popen(['sleep', '60'])
+    try:
+        res = subprocess.run([sys.executable, CONVERTER, tmp_path, '--pid', str(child.pid), '--kill-pid'],
+                             capture_output=True)
+        assert res.returncode != 0
+        assert child.wait(timeout=10) == -signal.SIGKILL
+    finally:
+        child.kill()
+        child.wait()
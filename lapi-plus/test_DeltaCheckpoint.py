@@ -0,0 +1,112 @@
+import os
+import gzip
+import json
+
+import numpy as np
+import pytest
+
+from DeltaCheckpoint import (DELTA_FILENAME, MMAP_FILENAME, PAGES_FILENAME, SOFT_DIRTY, apply_delta,
+                             classify_pages, flatten, load_regions)
+from PageStore import PMEM_FILENAME
+from ProcMaps import PAGE_PRESENT, PAGE_SWAPPED
+
+PAGE = 4096
+
+
+def write_mappings(ckpt_dir, layout, mem_size):
+    # layout: (vaddr, paddr, size) of every mapping
+    ckpt_dir.mkdir()
+    mappings = {'mem_size': mem_size}
+    for vaddr, paddr, size in layout:
+        mappings[vaddr] = {'paddr': paddr, 'vaddr': vaddr, 'size': size}
+    (ckpt_dir / MMAP_FILENAME).write_text(json.dumps(mappings))
+
+
+def raw_pmem(layout, memory, mem_size):
+    # memory: vaddr -> bytes of every mapping
+    pmem = bytearray(mem_size)
+    for vaddr, paddr, size in layout:
+        pmem[paddr:paddr + size] = memory[vaddr]
+    return bytes(pmem)
+
+
+def write_delta(ckpt_dir, parent_dir, pages, zeros=()):
+    # pages: (vaddr, data) the child wrote since its parent, zeros: (vaddr, size) it dropped
+    entries, offset = [], 0
+    with (ckpt_dir / PAGES_FILENAME).open('wb') as f:
+        for vaddr, data in pages:
+            f.write(data)
+            entries.append([vaddr, len(data), offset])
+            offset += len(data)
+    delta = {'parent': os.path.relpath(str(parent_dir), str(ckpt_dir)), 'pages': entries,
+             'zeros': [list(run) for run in zeros]}
+    (ckpt_dir / DELTA_FILENAME).write_text(json.dumps(delta))
+
+
+@pytest.fixture
+def chain(tmp_path):
+    ''' A full checkpoint and a delta on top of it, returns both and the expected pmem of the delta.
+
+    The delta moves the first mapping in pmem, grows the second and maps a new one.
+    '''
+    parent_layout = [(0x10000, 0, 3 * PAGE), (0x40000, 3 * PAGE, 2 * PAGE)]
+    parent_memory = {0x10000: os.urandom(3 * PAGE), 0x40000: os.urandom(2 * PAGE)}
+    write_mappings(tmp_path / 'full', parent_layout, 8 * PAGE)
+    (tmp_path / 'full' / PMEM_FILENAME).write_bytes(raw_pmem(parent_layout, parent_memory, 8 * PAGE))
+
+    layout = [(0x10000, 2 * PAGE, 3 * PAGE), (0x40000, 5 * PAGE, 4 * PAGE), (0x80000, 0, PAGE)]
+    pages = [(0x11000, os.urandom(PAGE)), (0x43000, os.urandom(PAGE)), (0x80000, os.urandom(PAGE))]
+    memory = {
+        0x10000: parent_memory[0x10000][:PAGE] + pages[0][1] + parent_memory[0x10000][2 * PAGE:],
+        0x40000: parent_memory[0x40000] + bytes(PAGE) + pages[1][1],
+        0x80000: pages[2][1]
+    }
+    write_mappings(tmp_path / 'delta', layout, 10 * PAGE)
+    write_delta(tmp_path / 'delta', tmp_path / 'full', pages)
+    return tmp_path / 'full', tmp_path / 'delta', raw_pmem(layout, memory, 10 * PAGE)
+
+
+def test_apply_delta(chain, tmp_path):
+    full, delta, expected = chain
+    regions = apply_delta(full / PMEM_FILENAME, load_regions(full)[0], delta, tmp_path / 'pmem')
+    assert regions == load_regions(delta)[0]
+    assert (tmp_path / 'pmem').read_bytes() == expected
+
+
+def test_flatten_chain(chain, tmp_path):
+    # a delta of the delta that writes nothing has the same memory
+    full, delta, expected = chain
+    (tmp_path / 'delta2').mkdir()
+    (tmp_path / 'delta2' / MMAP_FILENAME).write_bytes((delta / MMAP_FILENAME).read_bytes())
+    write_delta(tmp_path / 'delta2', delta, [])
+    assert flatten(tmp_path / 'delta2', compress=False).read_bytes() == expected
+    assert gzip.decompress(flatten(delta).read_bytes()) == expected
+
+
+def test_dropped_pages_are_zeros(chain, tmp_path):
+    # malloc_trim dropped a page of the parent and one the delta then wrote again
+    full, delta, expected = chain
+    (tmp_path / 'trimmed').mkdir()
+    (tmp_path / 'trimmed' / MMAP_FILENAME).write_bytes((delta / MMAP_FILENAME).read_bytes())
+    page = os.urandom(PAGE)
+    write_delta(tmp_path / 'trimmed', full, [(0x41000, page)], zeros=[(0x10000, PAGE), (0x12000, PAGE)])
+    apply_delta(full / PMEM_FILENAME, load_regions(full)[0], tmp_path / 'trimmed', tmp_path / 'pmem')
+
+    # the delta's mapping of 0x10000 is at paddr 2 pages, of 0x40000 at 5 pages
+    pmem = (tmp_path / 'pmem').read_bytes()
+    assert pmem[2 * PAGE:3 * PAGE] == bytes(PAGE)
+    assert pmem[3 * PAGE:4 * PAGE] != bytes(PAGE)
+    assert pmem[4 * PAGE:5 * PAGE] == bytes(PAGE)
+    assert pmem[6 * PAGE:7 * PAGE] == page
+
+
+def test_classify_pages():
+    entries = np.array([PAGE_PRESENT, PAGE_PRESENT | SOFT_DIRTY, 0, PAGE_SWAPPED, SOFT_DIRTY, 0], dtype=np.uint64)
+    in_parent = np.array([True, True, True, True, True, False])
+    dirty, zeros = classify_pages(entries, in_parent, file_backed=False)
+    assert dirty.tolist() == [False, True, False, False, True, False]
+    assert zeros.tolist() == [False, False, True, False, False, False]
+    # a dropped page of a file mapping reads as the file, it is dumped
+    dirty, zeros = classify_pages(entries, in_parent, file_backed=True)
+    assert dirty.tolist() == [False, True, True, False, True, False]
+    assert not zeros.any()
@@ -0,0 +1,167 @@
+import os
+import sys
+import types
+import time
+import signal
+import subprocess
+
+import pytest
+
+# GDBOnly.py runs inside gdb, outside of it gdb and GitPython are stand-ins
+sys.modules.setdefault('gdb', types.ModuleType('gdb'))
+sys.modules.setdefault('git', types.ModuleType('git'))
+
+import GDBOnly
+
+
+class FakeGDB(types.ModuleType):
+    ''' The checkpoint commands of gdb, the checkpoint is a real process it can stop and kill. '''
+
+    class error(RuntimeError):
+        pass
+
+    def __init__(self, child, fail=()):
+        super().__init__('gdb')
+        self.child = child
+        self.fail = fail
+        self.executed = []
+        self.armed = []
+        self.current = os.getpid()
+        self.plan = [types.SimpleNamespace(enabled=True, is_valid=lambda: True) for _ in range(3)]
+        self.plan[2].enabled = False
+
+    def breakpoints(self):
+        return tuple(self.plan)
+
+    def execute(self, cmd, to_string=False):
+        self.executed.append(cmd)
+        self.armed.append([bp.enabled for bp in self.plan])
+        if any(cmd.startswith(prefix) for prefix in self.fail):
+            raise self.error(f'{cmd} failed')
+        if cmd == 'checkpoint':
+            return f'checkpoint 1: fork returned pid {self.child}.\n'
+        if cmd.startswith('restart'):
+            self.current = self.child if cmd != 'restart 0' else os.getpid()
+        elif cmd.startswith('delete checkpoint'):
+            os.kill(self.child, signal.SIGKILL)
+        elif cmd.startswith('call (int) waitpid'):
+            return f'$1 = {os.waitpid(self.child, os.WNOHANG)[0]}\n'
+        return ''
+
+    def selected_inferior(self):
+        return types.SimpleNamespace(pid=self.current)
+
+
+@pytest.fixture
+def child():
+    proc = subprocess.Popen(['sleep', '60'])
+    yield proc
+    proc.kill()
+    proc.wait()
+
+
+def fork(monkeypatch, child, ptrace_scope=1, fail=()):
+    fake = FakeGDB(child.pid, fail)
+    monkeypatch.setattr(GDBOnly, 'gdb', fake)
+    monkeypatch.setattr(GDBOnly.GDBEngine, '_ptrace_scope', ptrace_scope)
+    engine = GDBOnly.GDBEngine.__new__(GDBOnly.GDBEngine)
+    engine._unreaped = []
+    return engine._fork_inferior(), fake, engine
+
+
+def state(pid, expected=None):
+    # signals are delivered asynchronously, wait a little for the expected state
+    deadline = time.monotonic() + 10
+    while True:
+        with open(f'/proc/{pid}/stat') as f:
+            current = f.read().rsplit(')', 1)[1].split()[0]
+        if expected is None or current == expected or time.monotonic() > deadline:
+            return current
+        time.sleep(0.01)
+
+
+@pytest.mark.parametrize('ptrace_scope', [0, 1])
+def test_fork_is_stopped_and_detached(monkeypatch, child, ptrace_scope):
+    pid, fake, _ = fork(monkeypatch, child, ptrace_scope)
+    assert pid == child.pid
+    assert state(pid, 'T') == 'T'
+    assert fake.executed[-1] == 'detach checkpoint 1'
+    assert fake.current == os.getpid()
+    if ptrace_scope == 1:
+        assert fake.executed[1:4] == ['restart 1', 'call (int) prctl(0x59616d61, (unsigned long) -1, 0, 0, 0)', 'restart 0']
+
+
+def test_no_fork(monkeypatch, child):
+    pid, fake, _ = fork(monkeypatch, child, fail=('checkpoint',))
+    assert pid is None
+    assert fake.executed == ['checkpoint']
+
+
+@pytest.mark.parametrize('failing', ['call', 'detach'])
+def test_failed_fork_is_killed(monkeypatch, child, failing):
+    pid, fake, _ = fork(monkeypatch, child, fail=(failing,))
+    assert pid is None
+    assert fake.current == os.getpid()
+    assert 'restart 0' in fake.executed
+    assert fake.executed[-1] == 'delete checkpoint 1'
+    assert child.wait(timeout=10) == -signal.SIGKILL
+
+
+def test_stuck_on_fork(monkeypatch, child):
+    # the replay must not go on in the copy
+    with pytest.raises(RuntimeError):
+        fork(monkeypatch, child, fail=('call', 'restart 0'))
+
+
+def test_breakpoints_disabled_while_forking(monkeypatch, child):
+    # code run in the inferior must not use up the ignore counts of the plan
+    pid, fake, _ = fork(monkeypatch, child, ptrace_scope=1)
+    assert pid == child.pid
+    assert all(armed == [False, False, False] for armed in fake.armed)
+    assert [bp.enabled for bp in fake.plan] == [True, True, False]
+
+
+def test_killed_copy_is_reaped(monkeypatch, child):
+    # without the delete, the killed copy is a zombie until the next checkpoint waits for it
+    pid, fake, engine = fork(monkeypatch, child, fail=('call', 'delete checkpoint'))
+    assert pid is None
+    assert engine._unreaped == [child.pid]
+    assert state(child.pid, 'Z') == 'Z'
+    engine._reap_forks()
+    assert engine._unreaped == []
+    assert fake.armed[-1] == [False, False, False]
+    assert [bp.enabled for bp in fake.plan] == [True, True, False]
+    child.returncode = -signal.SIGKILL
+
+
+def test_converted_copy_is_reaped(monkeypatch, child):
+    _, _, engine = fork(monkeypatch, child)
+    engine._failed_conversions = []
+    proc = subprocess.Popen(['true'])
+    proc.wait()
+    assert engine._converted('ckpt', proc, child.pid)
+    assert engine._unreaped == [child.pid]
+    # the copy is still there, waitpid() returns 0 and it stays to be reaped later
+    engine._reap_forks()
+    assert engine._unreaped == [child.pid]
+
+
+def test_sbrk_runs_with_breakpoints_disabled(monkeypatch):
+    # __curbrk is not readable, sbrk(0) runs in the inferior at a stop of the plan
+    fake = FakeGDB(os.getpid())
+    seen = []
+
+    def parse_and_eval(expr):
+        seen.append((expr, [bp.enabled for bp in fake.plan]))
+        if '__curbrk' in expr:
+            raise fake.error('No symbol "__curbrk" in current context.')
+        return 0x4a2000
+
+    fake.parse_and_eval = parse_and_eval
+    monkeypatch.setattr(GDBOnly, 'gdb', fake)
+    inferior = GDBOnly.InferiorState()
+    monkeypatch.setattr(inferior, '_syscall_brk', lambda: None)
+    assert inferior.brk() == 0x4a2000
+    assert seen[0][1] == [True, True, False]
+    assert 'sbrk' in seen[-1][0] and seen[-1][1] == [False, False, False]
+    assert [bp.enabled for bp in fake.plan] == [True, True, False]
@@ -0,0 +1,46 @@
+import os
+import gzip
+
+import pytest
+
+import MemoryImage
+
+from MemoryImage import compress_memory_image, zero_memory_image
+
+
+def sparse_image(path):
+    # data at 0, a hole, data at 1 MiB and a hole up to the end
+    with path.open('wb') as f:
+        f.write(os.urandom(5000))
+        f.seek(1 << 20)
+        f.write(b'gem5' * 1000)
+        f.truncate(3 << 20)
+    return path.read_bytes()
+
+
+def test_roundtrip(tmp_path):
+    raw = sparse_image(tmp_path / 'pmem')
+    compress_memory_image(tmp_path / 'pmem', tmp_path / 'pmem.gz')
+    assert gzip.decompress((tmp_path / 'pmem.gz').read_bytes()) == raw
+
+
+def test_pad_with_zeros(tmp_path):
+    raw = sparse_image(tmp_path / 'pmem')
+    compress_memory_image(tmp_path / 'pmem', tmp_path / 'pmem.gz', size=len(raw) + 12345)
+    assert gzip.decompress((tmp_path / 'pmem.gz').read_bytes()) == raw + bytes(12345)
+
+
+def test_zero_image(tmp_path):
+    zero_memory_image(tmp_path / 'pmem.gz', (5 << 20) + 3)
+    assert gzip.decompress((tmp_path / 'pmem.gz').read_bytes()) == bytes((5 << 20) + 3)
+
+
+@pytest.mark.parametrize('workers', [1, 3, 8])
+def test_workers_keep_file_order(tmp_path, monkeypatch, workers):
+    # many small chunks in flight at once still come out as the serial image
+    monkeypatch.setattr(MemoryImage, 'CHUNK_SIZE', 4096)
+    raw = sparse_image(tmp_path / 'pmem')
+    compress_memory_image(tmp_path / 'pmem', tmp_path / 'serial.gz', workers=1)
+    compress_memory_image(tmp_path / 'pmem', tmp_path / 'pmem.gz', workers=workers)
+    assert (tmp_path / 'pmem.gz').read_bytes() == (tmp_path / 'serial.gz').read_bytes()
+    assert gzip.decompress((tmp_path / 'pmem.gz').read_bytes()) == raw
@@ -0,0 +1,57 @@
+import os
+import gzip
+
+import pytest
+
+from PageStore import PageStore, materialize, store_memory_image, store_usage
+
+MEM_SIZE = 1 << 20
+CHUNK = 4096
+REGIONS = [(0, 3 * CHUNK + 100), (8 * CHUNK, 2 * CHUNK), (64 * CHUNK, 5 * CHUNK)]
+
+
+def raw_image(path, shared):
+    # the regions hold data and a chunk of zeros, what lies outside of them is not stored
+    data = bytearray(os.urandom(MEM_SIZE))
+    data[CHUNK:2 * CHUNK] = bytes(CHUNK)
+    data[64 * CHUNK:69 * CHUNK] = shared
+    path.write_bytes(data)
+    expected = bytearray(MEM_SIZE)
+    for paddr, size in REGIONS:
+        expected[paddr:paddr + size] = data[paddr:paddr + size]
+    return bytes(expected)
+
+
+@pytest.fixture
+def shared():
+    return os.urandom(5 * CHUNK)
+
+
+@pytest.mark.parametrize('raw', [True, False])
+def test_materialize(tmp_path, shared, raw):
+    expected = raw_image(tmp_path / 'pmem.raw', shared)
+    store = PageStore(tmp_path / 'store')
+    store_memory_image(tmp_path / 'pmem.raw', REGIONS, store, tmp_path / 'pmem.manifest', MEM_SIZE, chunk_size=CHUNK)
+    pmem = materialize(tmp_path / 'pmem.manifest', tmp_path / 'pmem', raw=raw).read_bytes()
+    assert (pmem if raw else gzip.decompress(pmem)) == expected
+
+
+def test_chunks_are_stored_once(tmp_path, shared):
+    store = PageStore(tmp_path / 'store')
+    for name in ('a', 'b'):
+        raw_image(tmp_path / f'{name}.raw', shared)
+        store_memory_image(tmp_path / f'{name}.raw', REGIONS, store, tmp_path / f'{name}.manifest', MEM_SIZE,
+                           chunk_size=CHUNK)
+    logical, distinct, _ = store_usage([tmp_path / 'a.manifest', tmp_path / 'b.manifest'])
+    # 10 chunks per image hold data, the 5 of the last region are the same in both
+    assert logical == 2 * (9 * CHUNK + 100)
+    assert distinct == 2 * 5 + 5
+
+
+def test_missing_chunks(tmp_path, shared):
+    raw_image(tmp_path / 'pmem.raw', shared)
+    store = PageStore(tmp_path / 'store')
+    store_memory_image(tmp_path / 'pmem.raw', REGIONS, store, tmp_path / 'pmem.manifest', MEM_SIZE, chunk_size=CHUNK)
+    store.path_of(store.digest(shared[:CHUNK])).unlink()
+    with pytest.raises(FileNotFoundError):
+        materialize(tmp_path / 'pmem.manifest', tmp_path / 'pmem')
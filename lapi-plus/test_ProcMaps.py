@@ -0,0 +1,34 @@
+import numpy as np
+
+from ProcMaps import PERM_EXEC, PERM_READ, PERM_SHARED, PERM_WRITE, ProcMaps
+
+MAPS = '''\
+00400000-00452000 r-xp 00000000 08:02 173521      /usr/bin/my program
+00651000-00652000 rw-p 00051000 08:02 173521      /usr/bin/my program
+00652000-00655000 rw-p 00000000 00:00 0           [heap]
+7f2c4a000000-7f2c4a021000 ---p 00000000 00:00 0
+7f2c4b000000-7f2c4b200000 rw-s 00000000 00:05 98304                      /SYSV00000000 (deleted)
+7ffd1c5f0000-7ffd1c611000 rw-p 00000000 00:00 0                          [stack]
+'''
+
+
+def test_parse():
+    maps = ProcMaps.parse(MAPS)
+    assert len(maps) == 6
+    assert maps.starts.tolist() == [0x400000, 0x651000, 0x652000, 0x7f2c4a000000, 0x7f2c4b000000, 0x7ffd1c5f0000]
+    assert maps.sizes.tolist() == [0x52000, 0x1000, 0x3000, 0x21000, 0x200000, 0x21000]
+    assert maps.perms.tolist() == [PERM_READ | PERM_EXEC, PERM_READ | PERM_WRITE, PERM_READ | PERM_WRITE, 0,
+                                   PERM_READ | PERM_WRITE | PERM_SHARED, PERM_READ | PERM_WRITE]
+    assert maps.offsets.tolist() == [0, 0x51000, 0, 0, 0, 0]
+    assert maps.inodes.tolist() == [173521, 173521, 0, 0, 98304, 0]
+    assert maps.names == ['/usr/bin/my program', '/usr/bin/my program', '[heap]', '', '/SYSV00000000 (deleted)', '[stack]']
+
+
+def test_select_accessible():
+    maps = ProcMaps.parse(MAPS)
+    assert maps.accessible().tolist() == [True, True, True, False, True, True]
+    selected = maps.select(maps.accessible())
+    assert len(selected) == 5
+    assert '' not in selected.names
+    assert selected.starts.dtype == np.uint64 and selected.perms.dtype == np.uint8
+